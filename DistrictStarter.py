@@ -2,6 +2,12 @@ import os
 import subprocess
 import sys
 import random
+import time
+import select
+import signal
+import builtins
+import importlib
+import traceback
 
 NUM_DISTRICTS = 2
 
@@ -41,28 +47,291 @@ districtNames = [
     'Reverse'
 ]
 
-cutDistrictNames = random.sample(districtNames, NUM_DISTRICTS)
-
 startingNum = 200000000
 minObjIdBase = 200100000
 maxObjIdBase = 200149999
 
 isWindows = sys.platform == 'win32'
 
-os.chdir('startup/win32' if isWindows else 'startup/unix')
+# Supervisor settings.
+RESTART_DELAY = 5
+MAX_RESTART_DELAY = 60
+# A district that stays up this long is considered healthy again.
+STABLE_UPTIME = 300
+STATS_PERIOD = 300
+# How long the districts get to exit after a SIGTERM/SIGINT is passed
+# on to them, before they are killed.
+SHUTDOWN_TIMEOUT = 30
+STOP_SIGNALS = {signal.SIGTERM, signal.SIGINT}
+
+DC_FILES = ['config/dclass/otp.dc', 'config/dclass/cars.dc']
+
+def getDistricts():
+    districts = []
+    baseChannel, minObjId, maxObjId = startingNum, minObjIdBase, maxObjIdBase
+    for districtName in random.sample(districtNames, NUM_DISTRICTS):
+        districts.append({
+            'name': districtName,
+            'baseChannel': baseChannel,
+            'minObjId': minObjId,
+            'maxObjId': maxObjId,
+        })
+
+        baseChannel += 1000000
+        minObjId += 1000000
+        maxObjId += 1000000
+
+    return districts
+
+def startDistrictsInScreens(districts):
+    os.chdir('startup/win32' if isWindows else 'startup/unix')
+
+    for district in districts:
+        subprocess.shell = True
+
+        districtName = district['name']
+
+        os.environ['DISTRICT_NAME'] = districtName
+        os.environ['BASE_CHANNEL'] = str(district['baseChannel'])
+        os.environ['MIN_OBJ_ID'] = str(district['minObjId'])
+        os.environ['MAX_OBJ_ID'] = str(district['maxObjId'])
+
+        os.system('start cmd /c districtStarter.bat' if isWindows else f'screen -dmS "{districtName}" ./districtStarter.sh')
+
+def log(message):
+    print(time.strftime('%Y-%m-%d %H:%M:%S'), 'DistrictStarter:', message)
+    sys.stdout.flush()
+
+def getRss(pid):
+    # Resident set size in kB, or None if it can't be read.
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def preloadModules():
+    """
+    Imports Panda3D and the distributed object modules named in the DC
+    files before forking, so every district shares them copy-on-write
+    instead of importing them again.  Modules that can't be imported
+    outside of a running AI are simply left for the districts.
+    """
+    class game:
+        name = "cars"
+        process = "ai"
+    builtins.game = game()
+
+    from panda3d.core import loadPrcFile
+    loadPrcFile("config/config.prc")
+    if os.path.exists("config/local.prc"):
+        loadPrcFile("config/local.prc")
+
+    moduleNames = ['pandac.PandaModules', 'direct.distributed.ConnectionRepository',
+                   'direct.distributed.DistributedObjectAI']
+    for dcFileName in DC_FILES:
+        with open(dcFileName) as dcFile:
+            for line in dcFile:
+                words = line.split()
+                if len(words) < 4 or words[0] != 'from' or words[2] != 'import':
+                    continue
+                className, *suffixes = words[3].rstrip(';').split('/')
+                moduleNames.append(f'{words[1]}.{className}')
+                if 'AI' in suffixes:
+                    moduleNames.append(f'{words[1]}.{className}AI')
+
+    numLoaded = 0
+    for moduleName in moduleNames:
+        try:
+            importlib.import_module(moduleName)
+            numLoaded += 1
+        except Exception:
+            pass
+
+    log(f'Preloaded {numLoaded} of {len(moduleNames)} modules.')
+
+class DistrictSupervisor:
+    """
+    Runs every district as a child forked from this process, restarts
+    districts that exit and logs their startup time and memory usage.
+    On SIGTERM or SIGINT the signal is passed on to the districts, and
+    the supervisor exits once they have.
+    """
+
+    def __init__(self, districts):
+        self.districts = districts
+        # pid -> district
+        self.children = {}
+        # ready pipe fd -> pid
+        self.readyPipes = {}
+        # The signal we were asked to stop with.
+        self.stopSignal = None
+
+        for district in self.districts:
+            district['restartDelay'] = RESTART_DELAY
+            district['restartTime'] = 0
+
+    def run(self):
+        preloadModules()
+
+        for signum in STOP_SIGNALS:
+            signal.signal(signum, self.handleStopSignal)
+
+        nextStats = time.time() + STATS_PERIOD
+        while self.stopSignal is None:
+            now = time.time()
+            for district in self.districts:
+                if district.get('pid') is None and now >= district['restartTime']:
+                    self.startDistrict(district)
+
+            self.waitForReady(1.0)
+            self.reapChildren()
+
+            if time.time() >= nextStats:
+                self.logStats()
+                nextStats = time.time() + STATS_PERIOD
+
+        self.stopDistricts()
+        sys.exit(0)
+
+    def handleStopSignal(self, signum, frame):
+        # Only note it here; run() stops the districts after its current
+        # pass, so a restart can't slip in behind the stop.
+        self.stopSignal = signum
+
+    def stopDistricts(self):
+        signame = signal.Signals(self.stopSignal).name
+        log(f'Got {signame}, stopping {len(self.children)} districts.')
+        for pid in list(self.children):
+            try:
+                os.kill(pid, self.stopSignal)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.time() + SHUTDOWN_TIMEOUT
+        while self.children and time.time() < deadline:
+            self.reapChildren()
+            if self.children:
+                time.sleep(0.1)
+
+        for pid, district in list(self.children.items()):
+            log(f"District {district['name']} (pid {pid}) didn't exit in {SHUTDOWN_TIMEOUT}s, killing it.")
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        while self.children:
+            self.reapChildren()
+            if self.children:
+                time.sleep(0.1)
+
+        log('All districts stopped.')
+
+    def startDistrict(self, district):
+        readFd, writeFd = os.pipe()
+        startTime = time.time()
+        # Held back until the child has put back the default handlers.
+        signal.pthread_sigmask(signal.SIG_BLOCK, STOP_SIGNALS)
+        pid = os.fork()
+        if pid == 0:
+            os.close(readFd)
+            self.runDistrict(district, writeFd)
+
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+        os.close(writeFd)
+        district['pid'] = pid
+        district['startTime'] = startTime
+        self.children[pid] = district
+        self.readyPipes[readFd] = pid
+        log(f"Started district {district['name']} ({district['baseChannel']}) as pid {pid}.")
+
+    def runDistrict(self, district, readyFd):
+        # This runs in the forked child and never returns.
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, STOP_SIGNALS)
+        for fd in self.readyPipes:
+            os.close(fd)
+
+        os.environ['DISTRICT_READY_FD'] = str(readyFd)
+        sys.argv = ['AIServiceStart',
+                    '--mdip=127.0.0.1', '--mdport=6666', '--logpath=logs/',
+                    f"--district_number={district['baseChannel']}",
+                    f"--district_name={district['name']}",
+                    '--ssid=20100000',
+                    f"--min_objid={district['minObjId']}",
+                    f"--max_objid={district['maxObjId']}"]
+        status = 0
+        try:
+            import runpy
+            runpy.run_module('game.cars.ai.AIServiceStart', run_name='__main__',
+                             init_globals={'__builtins__': builtins})
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        os._exit(status)
+
+    def waitForReady(self, timeout):
+        if not self.readyPipes:
+            time.sleep(timeout)
+            return
+
+        readable, _, _ = select.select(list(self.readyPipes), [], [], timeout)
+        for fd in readable:
+            pid = self.readyPipes.pop(fd)
+            os.read(fd, 1)
+            os.close(fd)
+            district = self.children.get(pid)
+            if district:
+                log(f"District {district['name']} ready in {time.time() - district['startTime']:.2f}s, "
+                    f"RSS {getRss(pid)} kB.")
+
+    def reapChildren(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
 
-for index, elem in enumerate(cutDistrictNames):
-    subprocess.shell = True
+            district = self.children.pop(pid, None)
+            for fd, readyPid in list(self.readyPipes.items()):
+                if readyPid == pid:
+                    del self.readyPipes[fd]
+                    os.close(fd)
+            if not district:
+                continue
 
-    districtName = str(cutDistrictNames[index])
+            uptime = time.time() - district['startTime']
+            # Negative for a district killed by a signal.
+            exitCode = os.waitstatus_to_exitcode(status)
+            district['pid'] = None
+            if self.stopSignal is not None:
+                log(f"District {district['name']} (pid {pid}) exited with status {exitCode} after {uptime:.0f}s.")
+                continue
 
-    os.environ['DISTRICT_NAME'] = districtName
-    os.environ['BASE_CHANNEL'] = str(startingNum)
-    os.environ['MIN_OBJ_ID'] = str(minObjIdBase)
-    os.environ['MAX_OBJ_ID'] = str(maxObjIdBase)
+            if uptime >= STABLE_UPTIME:
+                district['restartDelay'] = RESTART_DELAY
+            log(f"District {district['name']} (pid {pid}) exited with status {exitCode} after {uptime:.0f}s, "
+                f"restarting in {district['restartDelay']}s.")
+            district['restartTime'] = time.time() + district['restartDelay']
+            # Back off if it keeps crashing.
+            district['restartDelay'] = min(district['restartDelay'] * 2, MAX_RESTART_DELAY)
 
-    os.system('start cmd /c districtStarter.bat' if isWindows else f'screen -dmS "{districtName}" ./districtStarter.sh')
+    def logStats(self):
+        for pid, district in list(self.children.items()):
+            log(f"District {district['name']} (pid {pid}): up {time.time() - district['startTime']:.0f}s, "
+                f"RSS {getRss(pid)} kB.")
 
-    startingNum = startingNum + 1000000
-    minObjIdBase = minObjIdBase + 1000000
-    maxObjIdBase = maxObjIdBase + 1000000
+if __name__ == '__main__':
+    districts = getDistricts()
+    if '--supervise' in sys.argv[1:] and not isWindows:
+        DistrictSupervisor(districts).run()
+    else:
+        startDistrictsInScreens(districts)
@@ -6,6 +6,10 @@ DBSERVER_GET_STORED_VALUES_RESP    = 1013
 
 DBSERVER_SET_STORED_VALUES         = 1014
 
+DBSERVER_GET_STORED_VALUES_BULK      = 30000
+DBSERVER_GET_STORED_VALUES_BULK_RESP = 30001
+DBSERVER_SET_STORED_VALUES_BULK      = 30002
+
 DATABASE_ID = 4003
 
 -- This is act as a database server to bridge with the
@@ -141,8 +145,12 @@ function handleDatagram(participant, msgType, dgi)
         participant:warn("CreateStoredObject not supported.")
     elseif msgType == DBSERVER_GET_STORED_VALUES then
         handleGetStoredValues(participant, dgi)
+    elseif msgType == DBSERVER_GET_STORED_VALUES_BULK then
+        handleGetStoredValuesBulk(participant, dgi)
     elseif msgType == DBSERVER_SET_STORED_VALUES then
         handleSetStoredValues(participant, dgi)
+    elseif msgType == DBSERVER_SET_STORED_VALUES_BULK then
+        handleSetStoredValuesBulk(participant, dgi)
     end
 end
 
@@ -157,22 +165,78 @@ function handleGetStoredValues(participant, dgi)
         table.insert(requestedFields, dgi:readString())
     end
 
-    local success, body = retrieveObject(participant, doId)
-    if not success then
-        -- Reply with an error
-        local dg = datagram:new()
-        dg:addServerHeader(sender, DATABASE_ID, DBSERVER_GET_STORED_VALUES_RESP)
-        dg:addUint32(context)
-        dg:addUint32(doId)
-        dg:addUint16(#requestedFields)
-        for _, field in ipairs(requestedFields) do
-            dg:addString(field)
+    -- Send a response:
+    local dg = datagram:new()
+    dg:addServerHeader(sender, DATABASE_ID, DBSERVER_GET_STORED_VALUES_RESP)
+    dg:addUint32(context)
+    addStoredValues(participant, dg, doId, requestedFields)
+    participant:routeDatagram(dg)
+end
+
+-- Same as handleGetStoredValues, but for several objects at once.  The AI
+-- batches the reads it issues in one frame into a single request.
+function handleGetStoredValuesBulk(participant, dgi)
+    local sender = participant:getSender()
+    local context = dgi:readUint32()
+
+    local requests = {}
+    local objectCount = dgi:readUint16()
+    for _ = 1, objectCount, 1 do
+        local doId = dgi:readUint32()
+        local requestedFields = {}
+        local count = dgi:readUint16()
+        for _ = 1, count, 1 do
+            table.insert(requestedFields, dgi:readString())
         end
+        table.insert(requests, {doId, requestedFields})
+    end
+
+    -- Send a response:
+    local dg = datagram:new()
+    dg:addServerHeader(sender, DATABASE_ID, DBSERVER_GET_STORED_VALUES_BULK_RESP)
+    dg:addUint32(context)
+    dg:addUint16(#requests)
+    for _, request in ipairs(requests) do
+        addStoredValues(participant, dg, request[1], request[2])
+    end
+    participant:routeDatagram(dg)
+end
+
+-- Adds the stored values of one object to a GET_STORED_VALUES response:
+-- doId, the requested field names, an error code and the packed values.
+function addStoredValues(participant, dg, doId, requestedFields)
+    dg:addUint32(doId)
+    dg:addUint16(#requestedFields)
+    for _, field in ipairs(requestedFields) do
+        dg:addString(field)
+    end
+
+    local packedFieldData = packStoredValues(participant, doId, requestedFields)
+    if packedFieldData == nil then
         dg:addUint8(1) -- error code
-        participant:routeDatagram(dg)
         return
     end
 
+    dg:addUint8(0) -- error code
+    for _, field in ipairs(requestedFields) do
+        if packedFieldData[field] ~= nil then
+            dg:addString(packedFieldData[field])
+            dg:addBool(true) -- found
+        else
+            dg:addString("")
+            dg:addBool(false) -- found
+        end
+    end
+end
+
+-- Retrieves an object from the API and packs the requested fields.
+-- Returns nil if the object could not be retrieved.
+function packStoredValues(participant, doId, requestedFields)
+    local success, body = retrieveObject(participant, doId)
+    if not success then
+        return nil
+    end
+
     local data = json.decode(body)
     local packedFieldData = {}
     local dcClass = dcFile:getClassByName(data.objectName)
@@ -187,18 +251,8 @@ function handleGetStoredValues(participant, dgi)
             packedFieldData["ACCOUNT_AV_SET"] = packedDgi:readRemainder()
         else
             participant:error("ACCOUNT_AV_SET has failed to pack!")
-            -- Reply with an error
-            local dg = datagram:new()
-            dg:addServerHeader(sender, DATABASE_ID, DBSERVER_GET_STORED_VALUES_RESP)
-            dg:addUint32(context)
-            dg:addUint32(doId)
-            dg:addUint16(#requestedFields)
-            for _, field in ipairs(requestedFields) do
-                dg:addString(field)
-            end
-            dg:addUint8(1) -- error code
-            participant:routeDatagram(dg)
-            return
+            packer:delete()
+            return nil
         end
         goto finish
     elseif data.objectName == "DistributedCarPlayer" or data.objectName == "DistributedRaceCar" then
@@ -206,7 +260,6 @@ function handleGetStoredValues(participant, dgi)
         data = data.carData
     end
 
-
     for _, field in ipairs(requestedFields) do
         local dcField = dcClass:getFieldByName(field)
         local fieldData
@@ -260,30 +313,25 @@ function handleGetStoredValues(participant, dgi)
     ::finish::
     packer:delete()
 
-    -- Send a response:
-    local dg = datagram:new()
-    dg:addServerHeader(sender, DATABASE_ID, DBSERVER_GET_STORED_VALUES_RESP)
-    dg:addUint32(context)
-    dg:addUint32(doId)
-    dg:addUint16(#requestedFields)
-    for _, field in ipairs(requestedFields) do
-        dg:addString(field)
-    end
-    dg:addUint8(0) -- error code
+    return packedFieldData
+end
 
-    for _, field in ipairs(requestedFields) do
-        if packedFieldData[field] ~= nil then
-            dg:addString(packedFieldData[field])
-            dg:addBool(true) -- found
-        else
-            dg:addString("")
-            dg:addBool(false) -- found
-        end
+function handleSetStoredValues(participant, dgi)
+    local doId, packedFields = readStoredValues(dgi)
+    storeValues(participant, doId, packedFields)
+end
+
+-- Same as handleSetStoredValues, but for several objects at once.  The AI
+-- writes the fields it has cached in bulk.
+function handleSetStoredValuesBulk(participant, dgi)
+    local objectCount = dgi:readUint16()
+    for _ = 1, objectCount, 1 do
+        local doId, packedFields = readStoredValues(dgi)
+        storeValues(participant, doId, packedFields)
     end
-    participant:routeDatagram(dg)
 end
 
-function handleSetStoredValues(participant, dgi)
+function readStoredValues(dgi)
     local doId = dgi:readUint32()
 
     local count = dgi:readUint16()
@@ -292,6 +340,10 @@ function handleSetStoredValues(participant, dgi)
         packedFields[dgi:readString()] = dgi:readString()
     end
 
+    return doId, packedFields
+end
+
+function storeValues(participant, doId, packedFields)
     -- Get the object just so we'll know what we're dealing with.
     local success, body = retrieveObject(participant, doId)
     if not success then
@@ -6,7 +6,11 @@ CarsAIMsgName2Id = {
     # ShardManager messages:
     'SHARDMANAGER_REGISTER_SHARD': 20000,
     'SHARDMANAGER_UPDATE_SHARD': 20001,
-    'SHARDMANAGER_DELETE_SHARD': 20002}
+    'SHARDMANAGER_DELETE_SHARD': 20002,
+    # APIDatabase messages:
+    'DBSERVER_GET_STORED_VALUES_BULK': 30000,
+    'DBSERVER_GET_STORED_VALUES_BULK_RESP': 30001,
+    'DBSERVER_SET_STORED_VALUES_BULK': 30002}
 CarsAIMsgId2Names = invertDictLossless(CarsAIMsgName2Id)
 for name, value in list(CarsAIMsgName2Id.items()):
     exec('%s = %s' % (name, value))
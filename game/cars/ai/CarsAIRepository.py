@@ -1,3 +1,5 @@
+import os
+
 from direct.directnotify import DirectNotifyGlobal
 from direct.distributed.PyDatagram import PyDatagram
 from direct.distributed.PyDatagramIterator import PyDatagramIterator
@@ -10,8 +12,13 @@ from game.otp.ai.AIDistrict import AIDistrict
 
 from game.cars.distributed.CarsDistrictAI import CarsDistrictAI
 from game.cars.zone.DistributedZoneAI import DistributedZoneAI
+from game.cars.zone.TelemetryManager import TelemetryManager
+from game.cars.zone.ZoneMembership import ZoneMembership
 from game.cars.carplayer.InteractiveObjectAI import InteractiveObjectAI
 from game.cars.racing.DistributedSinglePlayerRacingLobbyAI import DistributedSinglePlayerRacingLobbyAI
+from game.cars.racing.RaceClock import RaceClock
+from game.cars.racing.LeaderboardManager import LeaderboardManager
+from game.cars.dungeon.InstanceManager import InstanceManager
 from game.cars.ai.HolidayManagerAI import HolidayManagerAI
 
 from game.cars.carplayer.DistributedCarPlayerAI import DistributedCarPlayerAI
@@ -19,12 +26,11 @@ from game.cars.carplayer.DistributedRaceCarAI import DistributedRaceCarAI
 
 
 from game.cars.ai.ServerBase import ServerBase
-from game.cars.ai.ServerGlobals import WORLD_OF_CARS_ONLINE
 
-from game.cars.ai.DatabaseObject import DatabaseObject
+from game.cars.ai.DatabaseObject import DatabaseObject, DatabaseReadCoalescer
+from game.cars.ai.DatabaseWriteCache import DatabaseWriteCache
 from game.cars.distributed.MongoInterface import MongoInterface
-
-import requests
+from game.cars.ai.PopulationReporter import PopulationReporter
 
 class CarsAIRepository(AIDistrict, ServerBase):
     notify = DirectNotifyGlobal.directNotify.newCategory("CarsAIRepository")
@@ -34,6 +40,69 @@ class CarsAIRepository(AIDistrict, ServerBase):
         ServerBase.__init__(self)
 
         self.mongoInterface = MongoInterface(self)
+        self.populationReporter = PopulationReporter(self)
+        self.raceClock = RaceClock(self)
+        self.leaderboardManager = LeaderboardManager(self)
+        self.instanceManager = InstanceManager(self)
+        self.telemetryManager = TelemetryManager(self)
+        self.zoneMembership = ZoneMembership(self)
+        self.spRaceLobby = None
+
+        self.dbReadCoalescer = None
+        if config.GetBool('want-db-read-coalescing', 1):
+            self.dbReadCoalescer = DatabaseReadCoalescer(self)
+
+        self.dbWriteCache = None
+        if config.GetBool('want-db-write-behind', 1):
+            self.dbWriteCache = DatabaseWriteCache(self)
+
+    def handleMessageType(self, msgType, di):
+        if msgType == DBSERVER_GET_STORED_VALUES_BULK_RESP:
+            if self.dbReadCoalescer:
+                self.dbReadCoalescer.handleBulkResponse(di)
+            else:
+                self.notify.warning('Ignoring DBSERVER_GET_STORED_VALUES_BULK_RESP, read coalescing is disabled.')
+        else:
+            AIDistrict.handleMessageType(self, msgType, di)
+
+    def _logPerformanceData(self, task=None):
+        if self.dbReadCoalescer:
+            self.notify.info(self.dbReadCoalescer.getStatsString())
+        if self.dbWriteCache:
+            self.notify.info(self.dbWriteCache.getStatsString())
+        self.notify.info(self.telemetryManager.getStatsString())
+        self.notify.info(self.zoneMembership.getStatsString())
+        self.notify.info(self.instanceManager.getStatsString())
+        self.notify.info(self.raceClock.getStatsString())
+        self.notify.info(self.leaderboardManager.getStatsString())
+        if self.spRaceLobby:
+            self.notify.info(self.spRaceLobby.getStatsString())
+        if self.isProdServer():
+            self.notify.info(self.populationReporter.getStatsString())
+
+        return AIDistrict._logPerformanceData(self, task)
+
+    def storeObjectLocation(self, object, parentId, zoneId):
+        oldZoneId = object.zoneId
+        AIDistrict.storeObjectLocation(self, object, parentId, zoneId)
+        if isinstance(object, DistributedCarPlayerAI):
+            if object.zoneId != oldZoneId:
+                # Take the car off the old zone's spatial grid, the next
+                # setTelemetry puts it on the new one.
+                self.telemetryManager.removeAvatar(object.doId)
+            if object.zoneId is not None:
+                self.zoneMembership.addAvatar(object.doId, object.zoneId)
+
+    def deleteObjectLocation(self, object, parentId, zoneId):
+        AIDistrict.deleteObjectLocation(self, object, parentId, zoneId)
+        if isinstance(object, DistributedCarPlayerAI):
+            self.zoneMembership.removeAvatar(object.doId, zoneId)
+
+    def getAvatarsInZone(self, zoneId):
+        return self.zoneMembership.getAvatarsInZone(zoneId)
+
+    def getAvatarZoneId(self, avId):
+        return self.zoneMembership.getAvatarZoneId(avId)
 
     def getGameDoId(self):
         return OTP_DO_ID_CARS
@@ -83,6 +152,14 @@ class CarsAIRepository(AIDistrict, ServerBase):
         self.spRaceLobby = DistributedSinglePlayerRacingLobbyAI(self, "spRace_rh", 42002, "car_w_trk_tfn_twistinTailfin_SS_V1_phys.xml") # dungeonItemId is from constants.js
         self.spRaceLobby.generateWithRequired(self.redhoodValley.doId)
 
+        if self.dbWriteCache:
+            self.dbWriteCache.start()
+
+        self.telemetryManager.start()
+        self.zoneMembership.start()
+        self.instanceManager.start()
+        self.leaderboardManager.start()
+
         self.holidayManager = HolidayManagerAI(self)
         # self.holidayManager.generateWithRequired(DUNGEON_INTEREST_HANDLE)
 
@@ -93,9 +170,37 @@ class CarsAIRepository(AIDistrict, ServerBase):
 
         if self.isProdServer():
             # Register us with the API server
+            self.populationReporter.start()
             self.sendPopulation()
 
         self.notify.info("Ready!")
+        self.notifyDistrictStarter()
+
+    def notifyDistrictStarter(self):
+        # Tell the DistrictStarter supervisor (if it started us) that we're up.
+        readyFd = os.environ.pop('DISTRICT_READY_FD', None)
+        if readyFd is None:
+            return
+
+        try:
+            os.write(int(readyFd), b'1')
+            os.close(int(readyFd))
+        except (OSError, ValueError) as e:
+            self.notify.warning('Could not notify DistrictStarter: %s' % e)
+
+    def exitPlayGame(self):
+        if self.dbWriteCache:
+            # Write out everything that is still cached before we go.
+            self.dbWriteCache.stop()
+
+        self.telemetryManager.stop()
+        self.zoneMembership.stop()
+        self.instanceManager.stop()
+        self.leaderboardManager.stop()
+        self.populationReporter.stop()
+        self.mongoInterface.shutdown()
+
+        AIDistrict.exitPlayGame(self)
 
     def registerShard(self):
         dg = PyDatagram()
@@ -144,22 +249,8 @@ class CarsAIRepository(AIDistrict, ServerBase):
         return dbo.readRaceCar(fields)
 
     def sendPopulation(self):
-        data = {
-            'token': config.GetString('api-token'),
-            'population': self.getPopulation(),
-            'serverType': WORLD_OF_CARS_ONLINE,
-            'shardName': self.districtName,
-            'shardId': self.districtId
-        }
-
-        headers = {
-            'User-Agent': 'Sunrise Games - CarsAIRepository'
-        }
-
-        try:
-            requests.post('https://api.sunrise.games/api/setPopulation', json=data, headers=headers)
-        except:
-            self.notify.warning('Failed to send district population!')
+        # Sent from a background thread, see PopulationReporter.
+        self.populationReporter.report(self.getPopulation())
 
     def incrementPopulation(self):
         AIDistrict.incrementPopulation(self)
@@ -5,6 +5,27 @@ from game.cars.carplayer.DistributedCarPlayerAI import DistributedCarPlayerAI
 from game.cars.carplayer.DistributedRaceCarAI import DistributedRaceCarAI
 from direct.distributed.PyDatagram import PyDatagram
 
+def unpackStoredValues(di):
+    """
+    Unpacks the body of a DBSERVER_GET_STORED_VALUES_RESP for one object
+    (everything after the doId).  Returns (retCode, fields, values), where
+    values maps each found field name to its packed bytes.
+    """
+    count = di.getUint16()
+    fields = []
+    for i in range(count):
+        fields.append(di.getString())
+
+    retCode = di.getUint8()
+    values = {}
+    if retCode == 0:
+        for i in range(count):
+            value, found = di.getBlob(), di.getBool()
+            if found:
+                values[fields[i]] = value
+
+    return retCode, fields, values
+
 class DatabaseObject:
     notify = directNotify.newCategory('DatabaseObject')
     notify.setInfo(0)
@@ -60,6 +81,12 @@ class DatabaseObject:
         return
 
     def getFields(self, fields):
+        if self.air.dbReadCoalescer:
+            # Let the coalescer merge this read with any others issued
+            # this frame.
+            self.air.dbReadCoalescer.queueRead(self, fields)
+            return
+
         context = self.air.dbObjContext
         self.air.dbObjContext += 1
         self.air.dbObjMap[context] = self
@@ -78,30 +105,31 @@ class DatabaseObject:
         if objId != self.doId:
             self.notify.warning('Unexpected doId %d' % objId)
             return
-        count = di.getUint16()
-        fields = []
-        for i in range(count):
-            name = di.getString()
-            fields.append(name)
+        retCode, fields, values = unpackStoredValues(di)
+        self.gotFields(retCode, fields, values)
 
-        retCode = di.getUint8()
+    def gotFields(self, retCode, fields, values):
         if retCode != 0:
             self.notify.warning('Failed to retrieve data for object %d' % self.doId)
         else:
-            values = []
-            for i in range(count):
-                value, found = di.getBlob(), di.getBool()
-                values.append(value)
+            if self.air.dbWriteCache:
+                # Values that have not been written to the database yet
+                # are more recent than what it returned.
+                dirtyValues = self.air.dbWriteCache.getDirtyValues(self.doId)
+                for field in fields:
+                    if field in dirtyValues:
+                        values[field] = dirtyValues[field]
 
-                if not found:
-                    self.notify.info('field %s is not found' % fields[i])
+            for field in fields:
+                if field not in values:
+                    self.notify.info('field %s is not found' % field)
                     try:
-                        del self.values[fields[i]]
+                        del self.values[field]
                     except:
                         pass
 
                 else:
-                    self.values[fields[i]] = PyDatagram(values[i])
+                    self.values[field] = PyDatagram(values[field])
 
             self.notify.info('got data for %d' % self.doId)
             if self.gotDataHandler != None:
@@ -112,6 +140,11 @@ class DatabaseObject:
         return
 
     def setFields(self, values):
+        if self.air.dbWriteCache:
+            # Written out later together with the other dirty fields.
+            self.air.dbWriteCache.storeValues(self.doId, values)
+            return
+
         dg = PyDatagram()
         dg.addServerHeader(DBSERVER_ID, self.air.ourChannel, DBSERVER_SET_STORED_VALUES)
         dg.addUint32(self.doId)
@@ -198,3 +231,175 @@ class DatabaseObject:
         dg.addUint32(self.doId)
         dg.addUint32(3735928559)
         self.air.send(dg)
+
+class DatabasePendingRead:
+    """
+    A single DBSERVER_GET_STORED_VALUES request for one doId, shared by
+    every DatabaseObject that asked for (a subset of) its fields.
+    """
+
+    def __init__(self, coalescer, doId):
+        self.coalescer = coalescer
+        self.doId = doId
+        self.fields = []
+        self.waiters = []
+
+    def addWaiter(self, dbo, fields):
+        for field in fields:
+            if field not in self.fields:
+                self.fields.append(field)
+        self.waiters.append((dbo, fields))
+
+    def getFieldsResponse(self, di):
+        # Called by AIRepository through dbObjMap for unbatched reads.
+        objId = di.getUint32()
+        if objId != self.doId:
+            self.coalescer.notify.warning('Unexpected doId %d' % objId)
+            return
+        self.resolve(*unpackStoredValues(di))
+
+    def resolve(self, retCode, fields, values):
+        self.coalescer.readDone(self)
+        for dbo, wantedFields in self.waiters:
+            dbo.gotFields(retCode, wantedFields,
+                          {field: values[field] for field in wantedFields if field in values})
+
+class DatabaseReadCoalescer:
+    """
+    Collects the stored value reads issued during a frame and sends them
+    to the database at the end of that frame, one request per doId.  When
+    bulk reads are enabled, requests for several objects are packed into a
+    single DBSERVER_GET_STORED_VALUES_BULK datagram (see APIDatabase.lua).
+    A read for a doId whose fields are already being fetched simply waits
+    on the outstanding request.
+    """
+    notify = directNotify.newCategory('DatabaseReadCoalescer')
+
+    # Run after the reader poll and the game tasks of the frame.
+    FlushSort = 40
+
+    def __init__(self, air):
+        self.air = air
+        self.wantBulkReads = config.GetBool('want-db-bulk-reads', 1)
+        self.maxBulkObjects = config.GetInt('db-bulk-read-max-objects', 64)
+
+        # doId -> DatabasePendingRead waiting for the end of the frame.
+        self.queuedReads = {}
+        # doId -> DatabasePendingRead that has been sent to the database.
+        self.inFlightReads = {}
+        # context -> {doId: DatabasePendingRead} for bulk requests.
+        self.bulkContexts = {}
+
+        # Counters for the performance log.
+        self.numReads = 0
+        self.numSharedReads = 0
+        self.numDatagrams = 0
+
+    def queueRead(self, dbo, fields):
+        self.numReads += 1
+        fields = list(fields)
+
+        inFlight = self.inFlightReads.get(dbo.doId)
+        if inFlight and set(fields).issubset(inFlight.fields):
+            self.numSharedReads += 1
+            inFlight.addWaiter(dbo, fields)
+            return
+
+        pending = self.queuedReads.get(dbo.doId)
+        if pending:
+            self.numSharedReads += 1
+        else:
+            pending = DatabasePendingRead(self, dbo.doId)
+            self.queuedReads[dbo.doId] = pending
+            if len(self.queuedReads) == 1:
+                taskMgr.add(self.__flushTask, self.air.uniqueName('dbReadFlush'),
+                            sort=self.FlushSort)
+        pending.addWaiter(dbo, fields)
+
+    def __flushTask(self, task):
+        self.flush()
+        return task.done
+
+    def flush(self):
+        pendingReads = list(self.queuedReads.values())
+        self.queuedReads = {}
+        for pending in pendingReads:
+            self.inFlightReads[pending.doId] = pending
+
+        if not self.wantBulkReads:
+            for pending in pendingReads:
+                self.sendRead(pending)
+            return
+
+        while pendingReads:
+            batch = pendingReads[:self.maxBulkObjects]
+            pendingReads = pendingReads[self.maxBulkObjects:]
+            if len(batch) == 1:
+                self.sendRead(batch[0])
+            else:
+                self.sendBulkRead(batch)
+
+    def allocateContext(self):
+        context = self.air.dbObjContext
+        self.air.dbObjContext += 1
+        return context
+
+    def sendRead(self, pending):
+        context = self.allocateContext()
+        self.air.dbObjMap[context] = pending
+        dg = PyDatagram()
+        dg.addServerHeader(DBSERVER_ID, self.air.ourChannel, DBSERVER_GET_STORED_VALUES)
+        dg.addUint32(context)
+        dg.addUint32(pending.doId)
+        dg.addUint16(len(pending.fields))
+        for f in pending.fields:
+            dg.addString(f)
+
+        self.numDatagrams += 1
+        self.air.send(dg)
+
+    def sendBulkRead(self, batch):
+        context = self.allocateContext()
+        self.bulkContexts[context] = {pending.doId: pending for pending in batch}
+        dg = PyDatagram()
+        dg.addServerHeader(DBSERVER_ID, self.air.ourChannel, DBSERVER_GET_STORED_VALUES_BULK)
+        dg.addUint32(context)
+        dg.addUint16(len(batch))
+        for pending in batch:
+            dg.addUint32(pending.doId)
+            dg.addUint16(len(pending.fields))
+            for f in pending.fields:
+                dg.addString(f)
+
+        self.numDatagrams += 1
+        self.air.send(dg)
+
+    def handleBulkResponse(self, di):
+        context = di.getUint32()
+        pendingReads = self.bulkContexts.pop(context, None)
+        if pendingReads is None:
+            self.notify.warning(
+                'Ignoring unexpected context %d for DBSERVER_GET_STORED_VALUES_BULK' % context)
+            return
+
+        count = di.getUint16()
+        for i in range(count):
+            doId = di.getUint32()
+            retCode, fields, values = unpackStoredValues(di)
+            pending = pendingReads.pop(doId, None)
+            if pending:
+                pending.resolve(retCode, fields, values)
+            else:
+                self.notify.warning('Unexpected doId %d in bulk response' % doId)
+
+        for pending in list(pendingReads.values()):
+            self.notify.warning('Bulk response is missing doId %d' % pending.doId)
+            pending.resolve(1, pending.fields, {})
+
+    def readDone(self, pending):
+        if self.inFlightReads.get(pending.doId) is pending:
+            del self.inFlightReads[pending.doId]
+
+    def getStatsString(self):
+        return 'db reads=%s, shared=%s, datagrams=%s, in flight=%s' % (
+            self.numReads, self.numSharedReads, self.numDatagrams, len(self.inFlightReads))
@@ -0,0 +1,191 @@
+from pandac.PandaModules import *
+from .CarsAIMsgTypes import *
+from direct.directnotify.DirectNotifyGlobal import *
+from direct.distributed.PyDatagram import PyDatagram
+from direct.task import Task
+
+class DatabaseWriteCache:
+    """
+    Write-behind cache for persistent fields.  Instead of sending every
+    change of a db field to the database as it happens, objects store the
+    field here; repeated changes of the same field replace each other and
+    the dirty fields of every object are written out together on a timer,
+    when the object is deleted and when the AI shuts down cleanly.
+
+    In case the AI goes away without a clean shutdown, the unsaved values
+    are also registered as post remove messages with the message director.
+    The post removes are rebuilt from the dirty fields every
+    db-write-behind-post-remove-period seconds if anything was stored,
+    and in the frame objects are flushed on their own, so the post
+    remove of an object that has logged out can't write old values over
+    newer ones.  Values stored since the last rebuild aren't covered yet.
+
+    Fields of objects the state server keeps in the database (the DBSS
+    range, e.g. setCarCoins and setRacingPoints) don't go through here,
+    the DBSS already writes their updates.
+    """
+    notify = directNotify.newCategory('DatabaseWriteCache')
+
+    # Run after the game tasks of the frame.
+    PostRemoveSort = 45
+
+    def __init__(self, air):
+        self.air = air
+        self.flushPeriod = config.GetFloat('db-write-behind-period', 30.0)
+        self.maxBulkObjects = config.GetInt('db-bulk-write-max-objects', 64)
+        self.wantPostRemove = config.GetBool('db-write-behind-post-remove', 1)
+        self.postRemovePeriod = config.GetFloat('db-write-behind-post-remove-period', 5.0)
+
+        # doId -> {fieldName: packed PyDatagram}
+        self.dirtyFields = {}
+        # Whether the post removes are behind the dirty fields.
+        self.postRemoveStale = False
+
+        # Counters for the performance log.
+        self.numStores = 0
+        self.numMerged = 0
+        self.numDatagrams = 0
+
+    def start(self):
+        taskMgr.doMethodLater(self.flushPeriod, self.__flushTask,
+                              self.air.uniqueName('dbWriteFlush'))
+        if self.wantPostRemove:
+            taskMgr.doMethodLater(self.postRemovePeriod, self.__postRemoveTask,
+                                  self.air.uniqueName('dbWritePostRemove'))
+
+    def stop(self):
+        self.flush()
+        taskMgr.remove(self.air.uniqueName('dbWriteFlush'))
+        taskMgr.remove(self.air.uniqueName('dbWritePostRemove'))
+        taskMgr.remove(self.air.uniqueName('dbWritePostRemoveNow'))
+        if self.wantPostRemove:
+            # Everything has been written out, nothing is left to save.
+            self.air.setTransientPostSocketClose([])
+
+    def storeFields(self, do, fields):
+        """
+        Marks the indicated db fields of the object as dirty, packing
+        their current values.
+        """
+        values = {}
+        for fieldName in fields:
+            field = do.dclass.getFieldByName(fieldName)
+            if field == None:
+                self.notify.warning('No definition for %s' % fieldName)
+                continue
+
+            dg = PyDatagram()
+            do.dclass.packRequiredField(dg, do, field)
+            values[fieldName] = dg
+
+        self.storeValues(do.doId, values)
+
+    def storeValues(self, doId, values):
+        """
+        Marks the indicated packed values ({fieldName: PyDatagram}) of the
+        object as dirty.
+        """
+        dirty = self.dirtyFields.setdefault(doId, {})
+        for fieldName, dg in list(values.items()):
+            if fieldName in dirty:
+                self.numMerged += 1
+            dirty[fieldName] = dg
+            self.numStores += 1
+
+        self.postRemoveStale = True
+
+    def getDirtyValues(self, doId):
+        """
+        Returns the unsaved values of the object as {fieldName: bytes}, so
+        database reads can see changes that have not been written yet.
+        """
+        dirty = self.dirtyFields.get(doId)
+        if not dirty:
+            return {}
+        return {fieldName: dg.getMessage() for fieldName, dg in list(dirty.items())}
+
+    def flushObjects(self, doIds):
+        dirtyFields = {}
+        for doId in doIds:
+            dirty = self.dirtyFields.pop(doId, None)
+            if dirty:
+                dirtyFields[doId] = dirty
+
+        if dirtyFields:
+            self.sendFields(dirtyFields)
+            if self.wantPostRemove:
+                # Their values may change elsewhere once they are gone, so
+                # their post removes have to go now.  Several flushes in
+                # the same frame only need one update.
+                self.postRemoveStale = True
+                taskName = self.air.uniqueName('dbWritePostRemoveNow')
+                if not taskMgr.hasTaskNamed(taskName):
+                    taskMgr.add(self.__updatePostRemove, taskName, sort=self.PostRemoveSort)
+
+    def flush(self):
+        if not self.dirtyFields:
+            return
+
+        dirtyFields = self.dirtyFields
+        self.dirtyFields = {}
+        self.sendFields(dirtyFields)
+        if self.wantPostRemove:
+            # Nothing is unsaved now.
+            taskMgr.remove(self.air.uniqueName('dbWritePostRemoveNow'))
+            self.air.setTransientPostSocketClose([])
+            self.postRemoveStale = False
+
+    def __flushTask(self, task):
+        self.flush()
+        return Task.again
+
+    def sendFields(self, dirtyFields):
+        for dg in self.makeSetFieldsDatagrams(dirtyFields):
+            self.air.send(dg)
+            self.numDatagrams += 1
+
+    def makeSetFieldsDatagrams(self, dirtyFields):
+        datagrams = []
+        items = list(dirtyFields.items())
+        while items:
+            batch = items[:self.maxBulkObjects]
+            items = items[self.maxBulkObjects:]
+            datagrams.append(self.makeSetFieldsDatagram(batch))
+
+        return datagrams
+
+    def makeSetFieldsDatagram(self, batch):
+        dg = PyDatagram()
+        if len(batch) == 1:
+            doId, values = batch[0]
+            dg.addServerHeader(DBSERVER_ID, self.air.ourChannel, DBSERVER_SET_STORED_VALUES)
+            self.addFields(dg, doId, values)
+        else:
+            dg.addServerHeader(DBSERVER_ID, self.air.ourChannel, DBSERVER_SET_STORED_VALUES_BULK)
+            dg.addUint16(len(batch))
+            for doId, values in batch:
+                self.addFields(dg, doId, values)
+
+        return dg
+
+    def addFields(self, dg, doId, values):
+        dg.addUint32(doId)
+        dg.addUint16(len(values))
+        for field, value in list(values.items()):
+            dg.addString(field)
+            dg.addBlob(value.getMessage())
+
+    def __postRemoveTask(self, task):
+        if self.postRemoveStale:
+            self.__updatePostRemove()
+        return Task.again
+
+    def __updatePostRemove(self, task=None):
+        # Replaces all of the previous post removes.
+        self.air.setTransientPostSocketClose(self.makeSetFieldsDatagrams(self.dirtyFields))
+        self.postRemoveStale = False
+        return Task.done
+
+    def getStatsString(self):
+        return 'db stores=%s, merged=%s, datagrams=%s, dirty objects=%s' % (
+            self.numStores, self.numMerged, self.numDatagrams, len(self.dirtyFields))
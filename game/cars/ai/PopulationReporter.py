@@ -0,0 +1,120 @@
+from direct.directnotify.DirectNotifyGlobal import directNotify
+from game.cars.ai.ServerGlobals import WORLD_OF_CARS_ONLINE
+
+import queue
+import threading
+import time
+
+import requests
+
+class PopulationReporter:
+    """
+    Sends the district population to the API server from a background
+    thread, so a slow API never stalls the AI's event loop.
+
+    Reports are put on a bounded queue; when the worker picks one up it
+    waits for the debounce interval and then only sends the most recent
+    report, so a burst of logins results in a single request.
+    """
+    notify = directNotify.newCategory("PopulationReporter")
+
+    URL = 'https://api.sunrise.games/api/setPopulation'
+
+    def __init__(self, air):
+        self.air = air
+        self.debounceTime = config.GetFloat('population-report-debounce', 1.0)
+        self.timeout = (config.GetFloat('population-report-connect-timeout', 3.0),
+                        config.GetFloat('population-report-read-timeout', 5.0))
+
+        self.queue = queue.Queue(config.GetInt('population-report-queue-size', 16))
+        self.session = requests.Session()
+        self.session.headers.update({
+            'User-Agent': 'Sunrise Games - CarsAIRepository'
+        })
+
+        # Counters for the performance log.
+        self.numReports = 0
+        self.numSent = 0
+        self.numCoalesced = 0
+        self.numDropped = 0
+        self.numFailed = 0
+
+        self.thread = None
+
+    def start(self):
+        if self.thread:
+            return
+
+        self.thread = threading.Thread(target=self.__run, name='PopulationReporter', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.thread:
+            return
+
+        # Wake the worker up; None tells it to finish.
+        try:
+            self.queue.put_nowait(None)
+        except queue.Full:
+            pass
+        self.thread = None
+
+    def report(self, population):
+        data = {
+            'token': config.GetString('api-token'),
+            'population': population,
+            'serverType': WORLD_OF_CARS_ONLINE,
+            'shardName': self.air.districtName,
+            'shardId': self.air.districtId
+        }
+
+        self.numReports += 1
+        try:
+            self.queue.put_nowait(data)
+        except queue.Full:
+            # Make room by dropping the oldest report; the latest count is
+            # the one that matters.
+            try:
+                self.queue.get_nowait()
+                self.numDropped += 1
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(data)
+            except queue.Full:
+                self.numDropped += 1
+
+    def __run(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+
+            # Give the rest of the burst a chance to arrive, then only send
+            # the latest report.
+            time.sleep(self.debounceTime)
+            while True:
+                try:
+                    newer = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if newer is None:
+                    self.__send(data)
+                    return
+                data = newer
+                self.numCoalesced += 1
+
+            self.__send(data)
+
+    def __send(self, data):
+        try:
+            response = self.session.post(self.URL, json=data, timeout=self.timeout)
+            response.raise_for_status()
+            self.numSent += 1
+        except Exception as e:
+            self.numFailed += 1
+            self.notify.warning('Failed to send district population: %s' % e)
+
+    def getStatsString(self):
+        return 'population reports=%s, sent=%s, coalesced=%s, dropped=%s, failed=%s' % (
+            self.numReports, self.numSent, self.numCoalesced, self.numDropped, self.numFailed)
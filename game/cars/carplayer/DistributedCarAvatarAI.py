@@ -4,5 +4,12 @@ class DistributedCarAvatarAI(DistributedObjectAI):
     def __init__(self, air):
         DistributedObjectAI.__init__(self, air)
 
+    def delete(self):
+        self.air.telemetryManager.removeAvatar(self.doId)
+        DistributedObjectAI.delete(self)
+
+    def setTelemetry(self, x: int, y: int, unk0: int, unk1: int, unk2: int, angle: int, unk3: int, timeStamp: int):
+        self.air.telemetryManager.handleTelemetry(self, (x, y, unk0, unk1, unk2, angle, unk3), timeStamp)
+
     def d_setTelemetry(self, x: int, y: int, unk0: int, unk1: int, unk2: int, angle: int, unk3, timeStamp: int):
         self.sendUpdate('setTelemetry', [x, y, unk0, unk1, unk2, angle, unk3, timeStamp])
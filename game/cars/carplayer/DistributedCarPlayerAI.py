@@ -68,6 +68,10 @@ class DistributedCarPlayerAI(DistributedCarAvatarAI):
 
         self.air.decrementPopulation()
 
+        if self.air.dbWriteCache:
+            # Save whatever is still cached for us and our race car.
+            self.air.dbWriteCache.flushObjects([self.doId, self.racecarId])
+
         DistributedCarAvatarAI.delete(self)
 
     def sendEventLog(self, event: str, params: list, args: list):
@@ -1,16 +1,51 @@
-from pymongo import MongoClient
+from direct.directnotify.DirectNotifyGlobal import directNotify
+from direct.task import Task
+from pymongo import MongoClient, UpdateOne
+
+from concurrent.futures import ThreadPoolExecutor
+import queue
+
+# One client (and thus one connection pool) per host, shared by every
+# repository in the process.
+_clients = {}
+
+def getMongoClient(host):
+    client = _clients.get(host)
+    if client is None:
+        client = MongoClient(host, maxPoolSize=config.GetInt('mongodb-max-pool-size', 16))
+        _clients[host] = client
+    return client
 
 class MongoInterface:
-    def __init__(self, air):
+    """
+    Persistence adapter for MongoDB.
+
+    The plain methods block the calling thread.  The *Async methods run on
+    a small thread pool instead and call their callback from a task on the
+    Panda task manager, so callbacks run on the AI thread like everything
+    else.  A client (e.g. a mongomock one) may be passed in for testing.
+    """
+    notify = directNotify.newCategory("MongoInterface")
+
+    def __init__(self, air, client=None):
         self.air = air
 
-        client = MongoClient(config.GetString('mongodb-host'))
+        if client is None:
+            client = getMongoClient(config.GetString('mongodb-host'))
         self.mongodb = client[config.GetString('mongodb-name')]
         self.webMongo = client['woc']
 
-    def retrieveFields(self, dclass: str, doId: int) -> list:
-        cursor = getattr(self.mongodb, dclass)
-        return cursor.find_one({'_id': doId})
+        self.executor = None
+        # (callback, result, exception) tuples completed by the executor.
+        self.results = queue.Queue()
+        self.numPending = 0
+
+    def retrieveFields(self, dclass: str, doId: int, fields: list = None) -> dict:
+        table = getattr(self.mongodb, dclass)
+        projection = None
+        if fields is not None:
+            projection = {fieldName: 1 for fieldName in fields}
+        return table.find_one({'_id': doId}, projection)
 
     def updateField(self, dclass: str, fieldName: str, doId: int, value: list):
         queryData = {'_id': doId}
@@ -20,9 +55,102 @@ class MongoInterface:
         table.update_one(queryData, updatedVal)
 
     def updateFields(self, dclass: str, fields: dict, doId: int):
-        queryData = {'_id': doId}
-        cursor = getattr(self.mongodb, dclass)
+        # All fields go in a single update.
+        table = getattr(self.mongodb, dclass)
+        table.update_one({'_id': doId}, {'$set': fields})
+
+    def updateObjects(self, dclass: str, objects: dict):
+        # objects is {doId: {fieldName: value}}; written with one bulk_write.
+        if not objects:
+            return None
+
+        table = getattr(self.mongodb, dclass)
+        operations = [UpdateOne({'_id': doId}, {'$set': fields})
+                      for doId, fields in list(objects.items())]
+        return table.bulk_write(operations, ordered=False)
+
+    def updateMinimums(self, collection: str, documents: dict, minField: str):
+        # documents is {_id: {fieldName: value}}; upserted with one
+        # bulk_write.  minField only ever goes down ($min), so writers that
+        # race each other can't undo a better value.
+        if not documents:
+            return None
+
+        table = getattr(self.mongodb, collection)
+        operations = []
+        for _id, fields in list(documents.items()):
+            fields = dict(fields)
+            update = {'$min': {minField: fields.pop(minField)}}
+            if fields:
+                update['$set'] = fields
+            operations.append(UpdateOne({'_id': _id}, update, upsert=True))
+        return table.bulk_write(operations, ordered=False)
+
+    def findAll(self, collection: str, query: dict, fields: list = None) -> list:
+        table = getattr(self.mongodb, collection)
+        projection = None
+        if fields is not None:
+            projection = {fieldName: 1 for fieldName in fields}
+        return list(table.find(query, projection))
+
+    def retrieveFieldsAsync(self, dclass: str, doId: int, fields: list = None, callback=None):
+        self.submit(callback, self.retrieveFields, dclass, doId, fields)
+
+    def updateFieldsAsync(self, dclass: str, fields: dict, doId: int, callback=None):
+        self.submit(callback, self.updateFields, dclass, fields, doId)
+
+    def updateObjectsAsync(self, dclass: str, objects: dict, callback=None):
+        self.submit(callback, self.updateObjects, dclass, objects)
+
+    def updateMinimumsAsync(self, collection: str, documents: dict, minField: str, callback=None):
+        self.submit(callback, self.updateMinimums, collection, documents, minField)
+
+    def findAllAsync(self, collection: str, query: dict, fields: list = None, callback=None):
+        self.submit(callback, self.findAll, collection, query, fields)
+
+    def submit(self, callback, function, *args):
+        """
+        Runs function(*args) on the executor.  When it is done,
+        callback(result, exception) is called from the task manager.
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=config.GetInt('mongodb-executor-threads', 4),
+                thread_name_prefix='MongoInterface')
+
+        future = self.executor.submit(function, *args)
+        future.add_done_callback(lambda future: self.__queueResult(callback, future))
+
+        self.numPending += 1
+        taskName = self.air.uniqueName('mongoResults')
+        if not taskMgr.hasTaskNamed(taskName):
+            taskMgr.add(self.__deliverResults, taskName)
+
+    def __queueResult(self, callback, future):
+        # Called on an executor thread.
+        exception = future.exception()
+        result = future.result() if exception is None else None
+        self.results.put((callback, result, exception))
+
+    def __deliverResults(self, task):
+        while True:
+            try:
+                callback, result, exception = self.results.get_nowait()
+            except queue.Empty:
+                break
+
+            self.numPending -= 1
+            if exception is not None:
+                self.notify.warning('Database operation failed: %s' % exception)
+            if callback:
+                callback(result, exception)
+
+        if self.numPending > 0:
+            return Task.cont
+        return Task.done
 
-        for fieldName, value in fields:
-            updatedVal = {'$set': {fieldName: value}}
-            table.update_one(queryData, updatedVal)
+    def shutdown(self):
+        taskMgr.remove(self.air.uniqueName('mongoResults'))
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
@@ -15,6 +15,22 @@ class DistributedDungeonAI(DistributedObjectAI):
         self.contextDoId: int = 0
         self.dungeonItemId: int = 1000
 
+        # Set by the InstanceManager if it owns our zone.
+        self.instance = None
+
+    def delete(self):
+        if self.instance:
+            self.air.instanceManager.objectDeleted(self)
+        DistributedObjectAI.delete(self)
+
+    def releaseInstance(self, reason):
+        # Deletes us along with the rest of our instance, and gives the
+        # zones back.
+        if self.instance:
+            self.air.instanceManager.releaseInstance(self.instance, reason)
+        else:
+            self.requestDelete()
+
     def getWaitForObjects(self):
         return [] # self.playerIds
 
@@ -0,0 +1,210 @@
+from direct.directnotify.DirectNotifyGlobal import directNotify
+from direct.task import Task
+from typing import Dict, List
+
+class DungeonInstance:
+    """
+    One running dungeon, e.g. a single player race: the lobby context in
+    a zone of its own and the dungeon in another.  Each zone is given
+    back once the object in it is deleted, or right away if nothing was
+    generated there.
+    """
+
+    def __init__(self, instanceId: int, contextZoneId: int, zoneId: int, avIds: List[int], createTime: float):
+        self.instanceId: int = instanceId
+        self.contextZoneId: int = contextZoneId
+        self.zoneId: int = zoneId
+        self.avIds: List[int] = list(avIds)
+        self.createTime: float = createTime
+
+        # Set once the instance is on its way out.
+        self.releaseTime: float = None
+        self.reason: str = ''
+
+        # doId -> zoneId of the objects generated for it that still exist.
+        self.objects: Dict[int, int] = {}
+        # Zones that haven't been given back yet.
+        self.heldZoneIds = {contextZoneId, zoneId}
+
+    def getInstanceId(self) -> int:
+        return self.instanceId
+
+    def isReleased(self) -> bool:
+        return self.releaseTime is not None
+
+
+class InstanceManager:
+    """
+    Allocates the zones of dungeon instances and makes sure they are
+    given back.  An instance is released when its dungeon or context is
+    deleted, when the dungeon asks for it because everybody left (quit or
+    disconnect), or by the sweep once it is older than
+    dungeon-instance-max-age.  Releasing deletes whatever objects are
+    left, and the zones are deallocated as their deletes come back from
+    the state server.  If those never come, the sweep frees the zones
+    after dungeon-instance-release-timeout seconds anyway.
+    """
+    notify = directNotify.newCategory('InstanceManager')
+
+    def __init__(self, air, maxAge=None, releaseTimeout=None, sweepPeriod=None):
+        self.air = air
+        if maxAge is None:
+            maxAge = config.GetFloat('dungeon-instance-max-age', 1800.0)
+        if releaseTimeout is None:
+            releaseTimeout = config.GetFloat('dungeon-instance-release-timeout', 60.0)
+        if sweepPeriod is None:
+            sweepPeriod = config.GetFloat('dungeon-instance-sweep-period', 30.0)
+        self.maxAge = maxAge
+        self.releaseTimeout = releaseTimeout
+        self.sweepPeriod = sweepPeriod
+
+        # instanceId -> DungeonInstance
+        self.instances: Dict[int, DungeonInstance] = {}
+        # doId -> DungeonInstance, for the objects that still exist.
+        self.doId2instance: Dict[int, DungeonInstance] = {}
+        # Not the zoneId, a zone can come back to us before the instance
+        # that had it is done with its other one.
+        self.nextInstanceId = 1
+
+        # Counters for the performance log.
+        self.numCreated = 0
+        self.numReleased = 0
+        self.numForced = 0
+        self.numZonesHeld = 0
+        self.maxLive = 0
+        self.totalLifetime = 0.0
+        self.reasonCounts: Dict[str, int] = {}
+
+    def getTime(self) -> float:
+        return globalClock.getFrameTime()
+
+    def start(self):
+        taskMgr.doMethodLater(self.sweepPeriod, self.__sweepTask,
+                              self.air.uniqueName('instanceSweep'))
+
+    def stop(self):
+        taskMgr.remove(self.air.uniqueName('instanceSweep'))
+
+    def createInstance(self, avIds: List[int]) -> DungeonInstance:
+        contextZoneId = self.air.allocateZone()
+        try:
+            zoneId = self.air.allocateZone()
+        except Exception:
+            self.air.deallocateZone(contextZoneId)
+            raise
+
+        instance = DungeonInstance(self.nextInstanceId, contextZoneId, zoneId, avIds, self.getTime())
+        self.nextInstanceId += 1
+        self.instances[instance.getInstanceId()] = instance
+        self.numZonesHeld += 2
+        self.numCreated += 1
+        self.maxLive = max(self.maxLive, len(self.instances))
+        return instance
+
+    def addObject(self, instance: DungeonInstance, obj):
+        """
+        obj has been generated in one of the instance's zones; it gets
+        deleted with the instance, and calls objectDeleted when it goes.
+        """
+        if obj.zoneId not in instance.heldZoneIds:
+            self.notify.warning('%s is in zone %s, which is not held by instance %s!' % (
+                obj.doId, obj.zoneId, instance.getInstanceId()))
+        instance.objects[obj.doId] = obj.zoneId
+        self.doId2instance[obj.doId] = instance
+        obj.instance = instance
+
+        if instance.isReleased():
+            # Too late, it's going away.
+            obj.requestDelete()
+
+    def objectDeleted(self, obj):
+        instance = self.doId2instance.get(obj.doId)
+        if instance is None:
+            return
+
+        self.__removeObject(instance, obj.doId)
+        # The rest of the instance goes with it.
+        self.releaseInstance(instance, 'deleted')
+
+    def __removeObject(self, instance: DungeonInstance, doId: int):
+        self.doId2instance.pop(doId, None)
+        zoneId = instance.objects.pop(doId)
+        if zoneId not in instance.objects.values():
+            self.__freeZone(instance, zoneId)
+
+    def releaseInstance(self, instance: DungeonInstance, reason: str):
+        if not instance.isReleased():
+            instance.releaseTime = self.getTime()
+            instance.reason = reason
+            self.reasonCounts[reason] = self.reasonCounts.get(reason, 0) + 1
+
+            for doId in list(instance.objects):
+                obj = self.air.doId2do.get(doId)
+                if obj:
+                    obj.requestDelete()
+                else:
+                    # Already gone without telling us.
+                    self.__removeObject(instance, doId)
+
+            # Nothing was generated in these, or it's gone already.
+            for zoneId in list(instance.heldZoneIds):
+                if zoneId not in instance.objects.values():
+                    self.__freeZone(instance, zoneId)
+
+        self.__checkDone(instance)
+
+    def __freeZone(self, instance: DungeonInstance, zoneId: int):
+        if zoneId in instance.heldZoneIds:
+            instance.heldZoneIds.discard(zoneId)
+            self.air.deallocateZone(zoneId)
+            self.numZonesHeld -= 1
+
+    def __checkDone(self, instance: DungeonInstance):
+        if instance.heldZoneIds:
+            return
+        if self.instances.pop(instance.getInstanceId(), None) is None:
+            return
+        self.numReleased += 1
+        self.totalLifetime += self.getTime() - instance.createTime
+
+    def sweep(self):
+        now = self.getTime()
+        for instance in list(self.instances.values()):
+            if not instance.isReleased():
+                if now - instance.createTime > self.maxAge:
+                    self.notify.info('Instance %s of %s timed out after %d seconds.' % (
+                        instance.getInstanceId(), instance.avIds, now - instance.createTime))
+                    self.releaseInstance(instance, 'timeout')
+            elif now - instance.releaseTime > self.releaseTimeout:
+                self.notify.warning('Objects %s of instance %s were never deleted, freeing its zones anyway.' % (
+                    list(instance.objects), instance.getInstanceId()))
+                for doId in instance.objects:
+                    self.doId2instance.pop(doId, None)
+                instance.objects.clear()
+                for zoneId in list(instance.heldZoneIds):
+                    self.__freeZone(instance, zoneId)
+                self.numForced += 1
+                self.__checkDone(instance)
+
+    def __sweepTask(self, task):
+        self.sweep()
+        return Task.again
+
+    def getNumInstances(self) -> int:
+        return len(self.instances)
+
+    def getOldestAge(self) -> float:
+        if not self.instances:
+            return 0.0
+        return self.getTime() - min(instance.createTime for instance in self.instances.values())
+
+    def getStatsString(self):
+        releasing = sum(1 for instance in self.instances.values() if instance.isReleased())
+        averageLifetime = 0.0
+        if self.numReleased:
+            averageLifetime = self.totalLifetime / self.numReleased
+        reasons = ', '.join('%s %s' % (reason, count) for reason, count in sorted(self.reasonCounts.items()))
+        return ('dungeon instances: %s live (%s releasing, max %s), oldest %.0fs, %s zones held, '
+                '%s created, %s released (%s), %s forced, %.1fs average lifetime' % (
+            len(self.instances), releasing, self.maxLive, self.getOldestAge(), self.numZonesHeld,
+            self.numCreated, self.numReleased, reasons, self.numForced, averageLifetime))
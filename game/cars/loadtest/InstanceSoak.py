@@ -0,0 +1,238 @@
+import sys
+import time
+import getopt
+import heapq
+import random
+
+from panda3d.core import UniqueIdAllocator
+
+from game.cars.distributed.CarsGlobals import DynamicZonesBegin, DynamicZonesEnd
+from game.cars.dungeon.InstanceManager import InstanceManager
+
+# Define a usage string
+helpString ="""
+python -m game.cars.loadtest.InstanceSoak [--races=<number>] [--rate=<races per second>] [--seed=<number>]
+
+Runs --races synthetic single player races through the InstanceManager,
+the way DistributedSinglePlayerRacingLobbyAI.join sets them up, with a
+stand-in for the AI repository and the state server on a simulated
+clock.  Races end every way they can: the player quits or disconnects,
+the race gets deleted from outside, generating it fails, the player
+never leaves and the instance times out, or a delete never comes back
+from the state server.  At the end every instance must be gone and the
+zone allocator must be back where it started, and no more zones may be
+held at any time than the races running then need.
+
+Example:
+
+python -m game.cars.loadtest.InstanceSoak --races=100000 --rate=20
+"""
+
+# Get the options
+try:
+    opts, pargs = getopt.getopt(sys.argv[1:], '', [
+        'races=',
+        'rate=',
+        'seed=',
+        ])
+except Exception as e:
+    print(e)
+    print(helpString)
+    sys.exit(1)
+
+# Default values
+numRaces = 100000
+rate = 20.
+seed = 1
+
+for opt in opts:
+    flag, value = opt
+    if (flag == '--races'):
+        numRaces = int(value)
+    elif (flag == '--rate'):
+        rate = float(value)
+    elif (flag == '--seed'):
+        seed = int(value)
+    else:
+        print("Error: Illegal option: " + flag)
+        print(helpString)
+        sys.exit(1)
+
+MAX_AGE = 1800.
+RELEASE_TIMEOUT = 60.
+SWEEP_PERIOD = 30.
+
+# How races end, and how often.
+ENDINGS = [('quit', 60),
+           ('disconnect', 25),
+           ('deleted', 5),
+           ('error', 3),
+           ('stuck', 4),
+           ('lost', 3)]
+
+class SoakAir:
+    """
+    Just what the InstanceManager and the stand-in objects use of the AI
+    repository.  Deletes are answered by the state server on the next
+    tick, except for the ones it loses.
+    """
+
+    def __init__(self):
+        self.minZone = DynamicZonesBegin
+        self.maxZone = DynamicZonesEnd - 1
+        self.zoneAllocator = UniqueIdAllocator(self.minZone, self.maxZone)
+        self.numZones = 0
+
+        self.doId2do = {}
+        self.nextDoId = 100000000
+        self.deletes = []
+        self.lostDoIds = set()
+
+    def uniqueName(self, name):
+        return name
+
+    def allocateZone(self):
+        zoneId = self.zoneAllocator.allocate()
+        if zoneId == -1:
+            raise RuntimeError("zoneAllocator.allocate() is out of zoneIds")
+        self.numZones += 1
+        return zoneId
+
+    def deallocateZone(self, zoneId):
+        self.zoneAllocator.free(zoneId)
+        self.numZones -= 1
+
+    def processDeletes(self):
+        deletes = self.deletes
+        self.deletes = []
+        for doId in deletes:
+            if doId in self.lostDoIds:
+                continue
+            obj = self.doId2do.pop(doId, None)
+            if obj:
+                obj.delete()
+
+class SoakObject:
+    # Stands in for the lobby context and the race.
+
+    def __init__(self, air):
+        self.air = air
+        self.doId = 0
+        self.zoneId = 0
+        self.instance = None
+
+    def generateWithRequired(self, zoneId):
+        self.doId = self.air.nextDoId
+        self.air.nextDoId += 1
+        self.zoneId = zoneId
+        self.air.doId2do[self.doId] = self
+
+    def requestDelete(self):
+        self.air.deletes.append(self.doId)
+
+    def delete(self):
+        if self.instance:
+            self.air.instanceManager.objectDeleted(self)
+
+class SoakInstanceManager(InstanceManager):
+
+    def __init__(self, air):
+        InstanceManager.__init__(self, air, MAX_AGE, RELEASE_TIMEOUT, SWEEP_PERIOD)
+        self.now = 0.
+
+    def getTime(self):
+        return self.now
+
+def join(air, avatarId, failGenerate):
+    instanceManager = air.instanceManager
+    instance = instanceManager.createInstance([avatarId])
+    try:
+        lobbyContext = SoakObject(air)
+        lobbyContext.generateWithRequired(instance.contextZoneId)
+        instanceManager.addObject(instance, lobbyContext)
+
+        if failGenerate:
+            raise RuntimeError('generate failed')
+        race = SoakObject(air)
+        race.generateWithRequired(instance.zoneId)
+        instanceManager.addObject(instance, race)
+    except RuntimeError:
+        instanceManager.releaseInstance(instance, 'error')
+        return None, None
+    return instance, race
+
+def run():
+    rng = random.Random(seed)
+    air = SoakAir()
+    manager = SoakInstanceManager(air)
+    manager.notify.setInfo(0)
+    manager.notify.setWarning(0)
+    air.instanceManager = manager
+
+    endings = [name for name, weight in ENDINGS for i in range(weight)]
+    # (end time, race number, instance, race, how)
+    ending = []
+    started = 0
+    nextSweep = SWEEP_PERIOD
+    maxZones = 0
+    numLeaked = 0
+    start = time.perf_counter()
+    while started < numRaces or ending or manager.getNumInstances():
+        manager.now += 1.
+        air.processDeletes()
+
+        for i in range(min(numRaces - started, int(rate) + (rng.random() < rate % 1))):
+            how = rng.choice(endings)
+            instance, race = join(air, started, how == 'error')
+            if race:
+                heapq.heappush(ending, (manager.now + rng.uniform(30, 300), started, instance, race, how))
+            started += 1
+
+        while ending and ending[0][0] <= manager.now:
+            endTime, number, instance, race, how = heapq.heappop(ending)
+            if how in ('quit', 'disconnect'):
+                # What the race does when everybody has left.
+                manager.releaseInstance(instance, how)
+            elif how == 'deleted':
+                race.requestDelete()
+            elif how == 'lost':
+                air.lostDoIds.add(race.doId)
+                manager.releaseInstance(instance, 'quit')
+            # 'stuck' ones are left to the sweep.
+
+        if manager.now >= nextSweep:
+            nextSweep += SWEEP_PERIOD
+            manager.sweep()
+
+        maxZones = max(maxZones, air.numZones)
+        if air.numZones > 2 * manager.getNumInstances():
+            numLeaked += 1
+
+        if started >= numRaces and not ending and manager.getNumInstances():
+            # Only the stuck and lost ones left, skip ahead to the sweeps.
+            manager.now = max(manager.now, nextSweep - 1.)
+
+    duration = time.perf_counter() - start
+    print('%d races in %.0f simulated seconds, %.2fs real time' % (numRaces, manager.now, duration))
+    print(manager.getStatsString())
+    print('zones: %d held at the end, at most %d held at once' % (air.numZones, maxZones))
+
+    ok = True
+    if manager.getNumInstances() or manager.doId2instance:
+        print('FAIL: %d instances still live' % manager.getNumInstances())
+        ok = False
+    if air.numZones or manager.numZonesHeld:
+        print('FAIL: %d zones never given back' % air.numZones)
+        ok = False
+    if numLeaked:
+        print('FAIL: more zones held than the live instances have, %d times' % numLeaked)
+        ok = False
+    if air.zoneAllocator.fractionUsed() != 0:
+        print('FAIL: the zone allocator still has zones out')
+        ok = False
+    if ok:
+        print('OK')
+    return ok
+
+if not run():
+    sys.exit(1)
@@ -0,0 +1,146 @@
+import sys
+import time
+import getopt
+import random
+from bisect import bisect_left, insort
+
+from game.cars.racing.Leaderboard import Leaderboard
+
+# Define a usage string
+helpString ="""
+python -m game.cars.loadtest.LeaderboardBench [--results=<number>] [--players=<number>] [--lookups=<number>] [--baseline] [--seed=<number>]
+
+Times a leaderboard on synthetic race results: --results lap times from
+--players players, most of them a bit slower than their own best, the
+way players improve over a week.  Reports how fast results go in, how
+fast any player's rank and the top ten can be looked up while results
+keep coming, and how long taking the dirty entries for a flush takes.
+
+With --baseline the same results also go into a single sorted list with
+bisect, what a leaderboard without the chunked index would do.
+
+Example:
+
+python -m game.cars.loadtest.LeaderboardBench --results=5000000 --players=500000
+python -m game.cars.loadtest.LeaderboardBench --results=1000000 --players=200000 --baseline
+"""
+
+# Get the options
+try:
+    opts, pargs = getopt.getopt(sys.argv[1:], '', [
+        'results=',
+        'players=',
+        'lookups=',
+        'baseline',
+        'seed=',
+        ])
+except Exception as e:
+    print(e)
+    print(helpString)
+    sys.exit(1)
+
+# Default values
+numResults = 2000000
+numPlayers = 200000
+numLookups = 200000
+baseline = False
+seed = 1
+
+for opt in opts:
+    flag, value = opt
+    if (flag == '--results'):
+        numResults = int(value)
+    elif (flag == '--players'):
+        numPlayers = int(value)
+    elif (flag == '--lookups'):
+        numLookups = int(value)
+    elif (flag == '--baseline'):
+        baseline = True
+    elif (flag == '--seed'):
+        seed = int(value)
+    else:
+        print("Error: Illegal option: " + flag)
+        print(helpString)
+        sys.exit(1)
+
+rng = random.Random(seed)
+
+def report(name, count, duration):
+    print('  %-26s %9d in %7.3fs, %10.0f/sec' % (name, count, duration, count / duration))
+
+# Every player has a skill, their results are spread above it.
+skills = [rng.lognormvariate(11.0, 0.15) for i in range(numPlayers)]
+results = []
+for i in range(numResults):
+    playerId = 100000000 + rng.randrange(numPlayers)
+    results.append((playerId, int(skills[playerId - 100000000] * (1 + rng.expovariate(20)))))
+lookups = [100000000 + rng.randrange(numPlayers) for i in range(numLookups)]
+print('%d results from %d players' % (numResults, numPlayers))
+
+board = Leaderboard('bench:bestLap:all')
+start = time.perf_counter()
+for playerId, value in results:
+    board.addResult(playerId, value)
+report('addResult', numResults, time.perf_counter() - start)
+print('  %d players on the board, %d new bests' % (len(board), board.numImproved))
+
+start = time.perf_counter()
+for playerId in lookups:
+    board.getRank(playerId)
+report('getRank', numLookups, time.perf_counter() - start)
+
+# Top ten between results, as clients would ask while races finish.
+mixed = results[:numLookups]
+start = time.perf_counter()
+for playerId, value in mixed:
+    board.addResult(playerId, value - 1000)
+    board.getTop()
+report('addResult + getTop', len(mixed), time.perf_counter() - start)
+
+start = time.perf_counter()
+for i in range(1000):
+    board.getTop(100)
+report('getTop(100)', 1000, time.perf_counter() - start)
+
+start = time.perf_counter()
+dirty = board.takeDirty()
+print('  takeDirty                  %9d in %7.3fs' % (len(dirty), time.perf_counter() - start))
+
+start = time.perf_counter()
+reloaded = Leaderboard('bench:bestLap:all')
+reloaded.load(list(dirty.items()))
+print('  load                       %9d in %7.3fs' % (len(reloaded), time.perf_counter() - start))
+
+# Every rank must match a plain sort.
+order = sorted(board.playerId2key.values())
+for key in rng.sample(order, min(len(order), 1000)):
+    if board.getRank(key[2]) != bisect_left(order, key) + 1:
+        print('  getRank is wrong for %s!' % key[2])
+        sys.exit(1)
+if board.getTop(100) != [(key[2], key[0]) for key in order[:100]]:
+    print('  getTop is wrong!')
+    sys.exit(1)
+
+if baseline:
+    keys = []
+    playerId2key = {}
+    counter = 0
+    start = time.perf_counter()
+    for playerId, value in results:
+        oldKey = playerId2key.get(playerId)
+        if oldKey is not None and oldKey[0] <= value:
+            continue
+        counter += 1
+        key = (value, counter, playerId)
+        if oldKey is not None:
+            del keys[bisect_left(keys, oldKey)]
+        insort(keys, key)
+        playerId2key[playerId] = key
+    report('sorted list insert', numResults, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for playerId in lookups:
+        key = playerId2key.get(playerId)
+        if key is not None:
+            bisect_left(keys, key)
+    report('sorted list rank', numLookups, time.perf_counter() - start)
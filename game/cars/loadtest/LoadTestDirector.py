@@ -0,0 +1,542 @@
+from pandac.PandaModules import *
+from direct.directnotify.DirectNotifyGlobal import directNotify
+from direct.distributed.PyDatagram import PyDatagram
+from direct.distributed.PyDatagramIterator import PyDatagramIterator
+from game.cars.ai.CarsAIMsgTypes import *
+from game.otp.ai.MessageProfiler import LatencyHistogram
+
+import asyncio
+import struct
+import time
+
+# The channel the stand-in sends pings and database responses from.
+STANDIN_CHANNEL = 4010
+
+class LoadTestStats:
+    """
+    Counters and latency histograms collected during a load test.
+    """
+
+    def __init__(self):
+        self.startTime = time.monotonic()
+        self.counters = {}
+        # name -> LatencyHistogram
+        self.latencies = {}
+        # Latest 'ai-performance' server event: (avg frame, max frame) in seconds.
+        self.aiFrameTimes = None
+        # name -> latest 'ai-profile' server event for it
+        self.aiProfile = {}
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def addLatency(self, name, duration):
+        histogram = self.latencies.get(name)
+        if histogram is None:
+            histogram = self.latencies[name] = LatencyHistogram()
+        histogram.add(duration)
+
+    def getReport(self):
+        elapsed = max(time.monotonic() - self.startTime, 1e-9)
+        counters = self.counters
+        lines = ['Load test report after %.1fs:' % elapsed]
+        lines.append('  cars logged in=%s, joins=%s, races finished=%s, failures=%s' % (
+            counters.get('logins', 0), counters.get('joins', 0), counters.get('racesFinished', 0),
+            counters.get('failures', 0)))
+        lines.append('  to AI: %.1f msg/s, %.1f kB/s; from AI: %.1f msg/s, %.1f kB/s' % (
+            counters.get('messagesToAI', 0) / elapsed, counters.get('bytesToAI', 0) / elapsed / 1024.,
+            counters.get('messagesFromAI', 0) / elapsed, counters.get('bytesFromAI', 0) / elapsed / 1024.))
+        lines.append('  telemetry sent=%s, db reads=%s, db writes=%s, unhandled from AI=%s, bundles from AI=%s' % (
+            counters.get('telemetry', 0), counters.get('dbReads', 0), counters.get('dbWrites', 0),
+            counters.get('unhandled', 0), counters.get('bundlesFromAI', 0)))
+
+        if self.aiFrameTimes:
+            lines.append('  AI frame duration: avg=%.2fms, max=%.2fms' % (
+                self.aiFrameTimes[0] * 1000., self.aiFrameTimes[1] * 1000.))
+
+        lines.append('  latency (ms): name|count|p50|p99|max')
+        for name in sorted(self.latencies):
+            histogram = self.latencies[name]
+            lines.append('    %s|%s|%.2f|%.2f|%.2f' % (
+                name, histogram.count, histogram.getPercentile(.5) * 1000.,
+                histogram.getPercentile(.99) * 1000., histogram.max * 1000.))
+
+        if self.aiProfile:
+            lines.append('  AI message profile (name|count|p50 ms|p99 ms|max ms|total ms):')
+            entries = sorted(self.aiProfile.values(),
+                             key=lambda entry: float(entry.split('|')[-1]), reverse=True)
+            for entry in entries[:10]:
+                lines.append('    %s' % entry)
+
+        return '\n'.join(lines)
+
+class AIConnection:
+    """
+    One process connected to the stand-in, normally an AI district.
+    """
+
+    def __init__(self, director, reader, writer):
+        self.director = director
+        self.reader = reader
+        self.writer = writer
+        self.channels = set()
+        # (low, high) channel ranges
+        self.ranges = []
+        self.name = ''
+
+    def hasChannel(self, channel):
+        if channel in self.channels:
+            return True
+        for low, high in self.ranges:
+            if low <= channel <= high:
+                return True
+        return False
+
+    def send(self, data):
+        self.writer.write(struct.pack('<H', len(data)) + data)
+
+    async def run(self):
+        try:
+            while True:
+                header = await self.reader.readexactly(2)
+                length = struct.unpack('<H', header)[0]
+                data = await self.reader.readexactly(length)
+                self.director.handleData(self, data)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.director.removeConnection(self)
+            self.writer.close()
+
+class LoadTestDirector:
+    """
+    Stands in for the message director, state server and database server
+    so a district can be put under load without any other service.
+
+    Datagrams between connected processes are routed by channel like the
+    real message director does.  Everything else the AI sends is handled
+    here: generates, location changes and deletes are tracked (deletes are
+    echoed back like the state server does), database reads are answered
+    from an in-memory store that starts out with the DC defaults, and
+    field updates sent to the simulated cars are handed to them.
+    """
+    notify = directNotify.newCategory('LoadTestDirector')
+
+    def __init__(self, dcFile, host='127.0.0.1', port=6666, eventPort=4343,
+                 pingPeriod=1.0):
+        self.dcFile = dcFile
+        self.host = host
+        self.port = port
+        self.eventPort = eventPort
+        self.pingPeriod = pingPeriod
+
+        self.stats = LoadTestStats()
+        self.connections = []
+
+        # The channel and district of the first AI to connect.
+        self.aiChannel = None
+        self.districtId = None
+        self.lobbyId = None
+        self.ready = asyncio.Event()
+
+        # doId -> [className, parentId, zoneId] of the objects the AI generated.
+        self.objects = {}
+        # mapId -> doId of the DistributedZones; players are in the zone
+        # object's doId, not its mapId.
+        self.zoneIds = {}
+        # doId -> className of the objects that live in the "database".
+        self.dbClasses = {}
+        # doId -> {fieldName: packed bytes}
+        self.dbValues = {}
+
+        # puppet channel -> SimulatedCar
+        self.carsByChannel = {}
+        # doId -> set of SimulatedCars that see its broadcasts
+        self.listeners = {}
+        # lobby context doId -> zone of its race
+        self.gotoDungeonZones = {}
+
+        self.packer = DCPacker()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handleConnection, self.host, self.port)
+        if self.eventPort:
+            loop = asyncio.get_running_loop()
+            await loop.create_datagram_endpoint(
+                lambda: EventServerProtocol(self), local_addr=(self.host, self.eventPort))
+        self.pingTask = asyncio.ensure_future(self.sendPings())
+
+    def stop(self):
+        self.pingTask.cancel()
+        self.server.close()
+        for connection in list(self.connections):
+            connection.writer.close()
+
+    async def handleConnection(self, reader, writer):
+        connection = AIConnection(self, reader, writer)
+        self.connections.append(connection)
+        await connection.run()
+
+    def removeConnection(self, connection):
+        if connection in self.connections:
+            self.connections.remove(connection)
+            self.notify.warning('%s disconnected.' % (connection.name or 'AI'))
+
+    ##### Routing #####
+
+    def handleData(self, connection, data):
+        dg = PyDatagram(data)
+        di = PyDatagramIterator(dg)
+        numChannels = di.getUint8()
+        channels = [di.getUint64() for i in range(numChannels)]
+        if channels == [CONTROL_MESSAGE]:
+            self.handleControl(connection, di.getUint16(), di)
+            return
+
+        sender = di.getUint64()
+        if channels == [self.districtId] and sender in self.objects:
+            # A message bundle (AIRepository.sendMessageBundle): it goes
+            # to the district from the object that sent it, and has no
+            # message type, only the bundled datagrams one after the
+            # other, each with its length.  The state server handles
+            # them as if the AI had sent them on their own.
+            self.stats.count('bundlesFromAI')
+            while di.getRemainingSize():
+                self.handleData(connection, di.getBlob())
+            return
+
+        msgType = di.getUint16()
+
+        self.stats.count('messagesFromAI')
+        self.stats.count('bytesFromAI', len(data))
+
+        for channel in channels:
+            handled = False
+            for other in self.connections:
+                if other is not connection and other.hasChannel(channel):
+                    other.send(data)
+                    handled = True
+            if not handled:
+                self.handleMessage(channel, sender, msgType,
+                                   PyDatagramIterator(dg, di.getCurrentIndex()))
+
+    def handleControl(self, connection, msgType, di):
+        if msgType == CONTROL_SET_CHANNEL:
+            channel = di.getUint64()
+            connection.channels.add(channel)
+            if self.aiChannel is None:
+                self.aiChannel = channel
+        elif msgType == CONTROL_REMOVE_CHANNEL:
+            connection.channels.discard(di.getUint64())
+        elif msgType == CONTROL_ADD_RANGE:
+            connection.ranges.append((di.getUint64(), di.getUint64()))
+        elif msgType == CONTROL_REMOVE_RANGE:
+            low, high = di.getUint64(), di.getUint64()
+            if (low, high) in connection.ranges:
+                connection.ranges.remove((low, high))
+        elif msgType == CONTROL_SET_CON_NAME:
+            connection.name = di.getString()
+        # Post removes and the like don't matter here.
+
+    def sendToAI(self, dg, channel=None):
+        if channel is None:
+            channel = self.aiChannel
+        data = dg.getMessage()
+        for connection in self.connections:
+            if connection.hasChannel(channel):
+                connection.send(data)
+                self.stats.count('messagesToAI')
+                self.stats.count('bytesToAI', len(data))
+
+    ##### State server and database #####
+
+    def handleMessage(self, channel, sender, msgType, di):
+        if msgType in (STATESERVER_OBJECT_GENERATE_WITH_REQUIRED,
+                       STATESERVER_OBJECT_GENERATE_WITH_REQUIRED_OTHER):
+            self.handleGenerate(di)
+        elif msgType == STATESERVER_OBJECT_UPDATE_FIELD:
+            self.handleUpdateField(channel, di)
+        elif msgType == STATESERVER_OBJECT_SET_ZONE:
+            obj = self.objects.get(channel)
+            if obj:
+                obj[1] = di.getUint32()
+                obj[2] = di.getUint32()
+        elif msgType == STATESERVER_OBJECT_DELETE_RAM:
+            self.handleDeleteRam(channel, sender, di.getUint32())
+        elif msgType == DBSERVER_GET_STORED_VALUES:
+            self.handleGetStoredValues(sender, di)
+        elif msgType == DBSERVER_GET_STORED_VALUES_BULK:
+            self.handleGetStoredValuesBulk(sender, di)
+        elif msgType == DBSERVER_SET_STORED_VALUES:
+            self.handleSetStoredValues(di)
+        elif msgType == DBSERVER_SET_STORED_VALUES_BULK:
+            for i in range(di.getUint16()):
+                self.handleSetStoredValues(di)
+        elif msgType == SERVER_PING and channel == STANDIN_CHANNEL:
+            sec = di.getUint32()
+            usec = di.getUint32()
+            self.stats.addLatency('ping', time.monotonic() - (sec + usec / 1000000.))
+        else:
+            # Uberdog and shard manager traffic ends up here.
+            self.stats.count('unhandled')
+
+    def handleGenerate(self, di):
+        parentId = di.getUint32()
+        zoneId = di.getUint32()
+        dclass = self.dcFile.getClass(di.getUint16())
+        doId = di.getUint32()
+        className = dclass.getName()
+        self.objects[doId] = [className, parentId, zoneId]
+
+        if className == 'CarsDistrict':
+            self.districtId = doId
+        elif className == 'DistributedZone':
+            di.getString() # setName
+            self.zoneIds[di.getInt32()] = doId
+        elif className == 'DistributedSinglePlayerRacingLobby' and self.lobbyId is None:
+            self.lobbyId = doId
+            self.ready.set()
+
+    def handleDeleteRam(self, channel, sender, doId):
+        if channel != doId:
+            # The AI clears out its district before starting up.
+            dg = PyDatagram()
+            dg.addServerHeader(sender, STANDIN_CHANNEL, STATESERVER_OBJECT_NOTFOUND)
+            dg.addUint32(doId)
+            self.sendToAI(dg, sender)
+            return
+
+        if self.objects.pop(doId, None):
+            self.listeners.pop(doId, None)
+            self.gotoDungeonZones.pop(doId, None)
+            dg = PyDatagram()
+            dg.addServerHeader(sender, STANDIN_CHANNEL, STATESERVER_OBJECT_DELETE_RAM)
+            dg.addUint32(doId)
+            self.sendToAI(dg, sender)
+
+    def handleUpdateField(self, channel, di):
+        doId = di.getUint32()
+        field = self.dcFile.getFieldByIndex(di.getUint16())
+        fieldName = field.getName()
+        car = self.carsByChannel.get(channel)
+        broadcast = channel == doId
+        listeners = self.listeners.get(doId) if broadcast else None
+        if not car and not listeners and not (broadcast and fieldName == 'gotoDungeon'):
+            return
+
+        self.packer.setUnpackData(di.getRemainingBytes())
+        self.packer.beginUnpack(field)
+        args = field.unpackArgs(self.packer)
+        self.packer.endUnpack()
+
+        if broadcast and fieldName == 'gotoDungeon':
+            # Lobby contexts tell their players which zone the race is in.
+            self.gotoDungeonZones[doId] = args[1]
+        if car:
+            car.handleUpdate(doId, fieldName, args)
+        if listeners:
+            for listener in list(listeners):
+                listener.handleUpdate(doId, fieldName, args)
+
+    def handleGetStoredValues(self, sender, di):
+        context = di.getUint32()
+        doId = di.getUint32()
+        fields = [di.getString() for i in range(di.getUint16())]
+
+        dg = PyDatagram()
+        dg.addServerHeader(sender, DBSERVER_ID, DBSERVER_GET_STORED_VALUES_RESP)
+        dg.addUint32(context)
+        self.addStoredValues(dg, doId, fields)
+        self.sendToAI(dg, sender)
+
+    def handleGetStoredValuesBulk(self, sender, di):
+        context = di.getUint32()
+        requests = []
+        for i in range(di.getUint16()):
+            doId = di.getUint32()
+            requests.append((doId, [di.getString() for j in range(di.getUint16())]))
+
+        dg = PyDatagram()
+        dg.addServerHeader(sender, DBSERVER_ID, DBSERVER_GET_STORED_VALUES_BULK_RESP)
+        dg.addUint32(context)
+        dg.addUint16(len(requests))
+        for doId, fields in requests:
+            self.addStoredValues(dg, doId, fields)
+        self.sendToAI(dg, sender)
+
+    def addStoredValues(self, dg, doId, fields):
+        self.stats.count('dbReads')
+        dg.addUint32(doId)
+        dg.addUint16(len(fields))
+        for field in fields:
+            dg.addString(field)
+
+        values = self.getStoredValues(doId)
+        if values is None:
+            dg.addUint8(1)
+            return
+
+        dg.addUint8(0)
+        for field in fields:
+            value = values.get(field)
+            dg.addBlob(value or b'')
+            dg.addBool(value is not None)
+
+    def getStoredValues(self, doId):
+        values = self.dbValues.get(doId)
+        if values is None:
+            className = self.dbClasses.get(doId)
+            if className is None:
+                return None
+
+            # Start out with the defaults of every db field.
+            dclass = self.dcFile.getClassByName(className)
+            values = {}
+            for i in range(dclass.getNumInheritedFields()):
+                field = dclass.getInheritedField(i)
+                if field.isDb() and not field.asMolecularField():
+                    values[field.getName()] = bytes(field.getDefaultValue())
+            self.dbValues[doId] = values
+
+        return values
+
+    def handleSetStoredValues(self, di):
+        doId = di.getUint32()
+        values = self.getStoredValues(doId)
+        for i in range(di.getUint16()):
+            field = di.getString()
+            value = di.getBlob()
+            if values is not None:
+                values[field] = value
+        self.stats.count('dbWrites')
+
+    ##### Simulated clients #####
+
+    def addCar(self, car):
+        self.carsByChannel[car.puppetChannel] = car
+        self.dbClasses[car.avatarId] = 'DistributedCarPlayer'
+        self.dbClasses[car.racecarId] = 'DistributedRaceCar'
+
+    def removeCar(self, car):
+        self.carsByChannel.pop(car.puppetChannel, None)
+
+    def listen(self, car, doId):
+        self.listeners.setdefault(doId, set()).add(car)
+
+    def ignore(self, car, doId):
+        listeners = self.listeners.get(doId)
+        if listeners:
+            listeners.discard(car)
+
+    def findObject(self, className, zoneId):
+        for doId, (objClassName, parentId, objZoneId) in list(self.objects.items()):
+            if objClassName == className and objZoneId == zoneId:
+                return doId
+        return None
+
+    def sendUpdate(self, className, fieldName, doId, sender, args):
+        dclass = self.dcFile.getClassByName(className)
+        dg = dclass.aiFormatUpdate(fieldName, doId, self.aiChannel, sender, args)
+        self.sendToAI(dg)
+
+    def sendEnterAI(self, className, doId, parentId, zoneId, required={}, other={}):
+        """
+        Tells the AI an object entered its interest, like the state server
+        does when a client moves its avatar into the district.
+        """
+        dclass = self.dcFile.getClassByName(className)
+        dg = PyDatagram()
+        dg.addServerHeader(self.aiChannel, STANDIN_CHANNEL, STATESERVER_OBJECT_ENTER_AI_RECV)
+        dg.addUint32(0) # context
+        dg.addUint32(parentId)
+        dg.addUint32(zoneId)
+        dg.addUint16(dclass.getNumber())
+        dg.addUint32(doId)
+
+        for i in range(dclass.getNumInheritedFields()):
+            field = dclass.getInheritedField(i)
+            if field.isRequired() and not field.asMolecularField():
+                if field.getName() in required:
+                    dg.appendData(self.packArgs(field, required[field.getName()]))
+                else:
+                    dg.appendData(field.getDefaultValue())
+
+        dg.addUint16(len(other))
+        for fieldName, args in list(other.items()):
+            field = dclass.getFieldByName(fieldName)
+            dg.addUint16(field.getNumber())
+            dg.appendData(self.packArgs(field, args))
+
+        self.sendToAI(dg)
+
+    def sendDeleteRam(self, doId):
+        dg = PyDatagram()
+        dg.addServerHeader(self.aiChannel, STANDIN_CHANNEL, STATESERVER_OBJECT_DELETE_RAM)
+        dg.addUint32(doId)
+        self.sendToAI(dg)
+
+    def packArgs(self, field, args):
+        self.packer.beginPack(field)
+        field.packArgs(self.packer, args)
+        self.packer.endPack()
+        data = self.packer.getBytes()
+        self.packer.clearData()
+        return data
+
+    async def sendPings(self):
+        # The time a ping takes to come back shows how long the AI takes
+        # to get around to messages, i.e. how long its frames are.
+        while True:
+            await asyncio.sleep(self.pingPeriod)
+            if self.aiChannel is None:
+                continue
+
+            now = time.monotonic()
+            sec = int(now)
+            dg = PyDatagram()
+            dg.addServerHeader(self.aiChannel, STANDIN_CHANNEL, SERVER_PING)
+            dg.addUint32(sec)
+            dg.addUint32(int((now - sec) * 1000000.))
+            dg.addString('loadtest')
+            dg.addUint32(STANDIN_CHANNEL)
+            self.sendToAI(dg)
+
+    ##### Event server #####
+
+    def handleServerEvent(self, data):
+        # The AI may pack several events into one datagram, each with its
+        # own length prefix.
+        dg = PyDatagram(data)
+        di = PyDatagramIterator(dg)
+        while di.getRemainingSize() >= 2:
+            length = di.getUint16()
+            end = di.getCurrentIndex() + length
+            if di.getUint16() == 1:
+                di.getUint16() # server type
+                di.getUint32() # channel
+                eventType = di.getString()
+                di.getString() # who
+                self.handleEvent(eventType, di.getString())
+
+            di = PyDatagramIterator(dg, end)
+
+    def handleEvent(self, eventType, description):
+        if eventType == 'ai-performance':
+            avgFrameDur, maxFrameDur = description.split('|')[:2]
+            self.stats.aiFrameTimes = (float(avgFrameDur), float(maxFrameDur))
+        elif eventType == 'ai-profile':
+            self.stats.aiProfile[description.split('|', 1)[0]] = description
+
+class EventServerProtocol(asyncio.DatagramProtocol):
+    """
+    Receives the AI's server events over UDP, like the event server.
+    """
+
+    def __init__(self, director):
+        self.director = director
+
+    def datagram_received(self, data, addr):
+        try:
+            self.director.handleServerEvent(data)
+        except Exception as e:
+            self.director.notify.warning('Bad server event: %s' % e)
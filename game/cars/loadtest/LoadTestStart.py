@@ -0,0 +1,189 @@
+#!python -S
+
+class game:
+    name = "cars"
+    process = "ai"
+__builtins__.game = game()
+
+import os
+import sys
+import getopt
+import asyncio
+import subprocess
+
+from panda3d.core import loadPrcFile
+
+# Load our base configuration.
+loadPrcFile("config/config.prc")
+
+if os.path.exists("config/local.prc"):
+    # A local configuration exists, load it.
+    loadPrcFile("config/local.prc")
+
+from pandac.PandaModules import *
+
+__builtins__.config = getConfigShowbase()
+
+from game.cars.loadtest.LoadTestDirector import LoadTestDirector, LoadTestStats
+from game.cars.loadtest.SimulatedCar import SimulatedCar
+from game.cars.racing.TrackRegistry import TrackRegistry
+
+# Define a usage string
+helpString ="""
+python -m game.cars.loadtest.LoadTestStart [--port=<port>] [--esport=<eventserver port>] [--cars=<number>] [--races=<number>] [--duration=<seconds>] [--telemetry_rate=<hz>] [--segment_interval=<seconds>] [--ramp_up=<seconds>] [--report_period=<seconds>] [--track=<hotspot name>:<physics file>] [--joins_only] [--spawn_ai]
+
+Puts a district under load.  Listens on the indicated port as a stand-in
+for the message director (and state and database servers), waits for an
+AI district to connect to it and then logs in the indicated number of
+simulated cars.  Each car streams setTelemetry and keeps racing in the
+single player racing lobby until it has done --races races (0 means
+forever) or --duration has passed.
+
+With --joins_only, the cars only join the lobby, wait for
+gotoLobbyContext and log out again, to time joins.  With --ramp_up=0
+they all join at once; compare the join latency with the default
+race-pool-size 0 and with a pool, e.g. race-pool-size 4, in
+config/local.prc.
+
+With --spawn_ai, an AI district is started against the stand-in, so
+nothing else needs to be running.  For the AI's frame duration and
+message profile to show up in the report, run it with
+ai-performance-log-period and want-message-profiler set in
+config/local.prc.
+
+Example:
+
+python -m game.cars.loadtest.LoadTestStart --port=6667 --cars=100 --duration=600 --spawn_ai
+python -m game.cars.loadtest.LoadTestStart --port=6667 --cars=200 --duration=120 --ramp_up=0 --joins_only --spawn_ai
+"""
+
+# Get the options
+try:
+    opts, pargs = getopt.getopt(sys.argv[1:], '', [
+        'port=',
+        'esport=',
+        'cars=',
+        'races=',
+        'duration=',
+        'telemetry_rate=',
+        'segment_interval=',
+        'ramp_up=',
+        'report_period=',
+        'track=',
+        'joins_only',
+        'spawn_ai',
+        ])
+except Exception as e:
+    print(e)
+    print(helpString)
+    sys.exit(1)
+
+# Default values
+port = 6667
+esport = 4343
+numCars = 10
+numRaces = 0
+duration = 300.
+telemetryRate = 10.
+segmentInterval = 0.25
+rampUp = 10.
+reportPeriod = 30.
+# Same as the racing lobby of CarsAIRepository.createObjects.
+hotSpotName = "spRace_rh"
+physicsFile = "car_w_trk_tfn_twistinTailfin_SS_V1_phys.xml"
+joinsOnly = False
+spawnAI = False
+
+for opt in opts:
+    flag, value = opt
+    if (flag == '--port'):
+        port = int(value)
+    elif (flag == '--esport'):
+        esport = int(value)
+    elif (flag == '--cars'):
+        numCars = int(value)
+    elif (flag == '--races'):
+        numRaces = int(value)
+    elif (flag == '--duration'):
+        duration = float(value)
+    elif (flag == '--telemetry_rate'):
+        telemetryRate = float(value)
+    elif (flag == '--segment_interval'):
+        segmentInterval = float(value)
+    elif (flag == '--ramp_up'):
+        rampUp = float(value)
+    elif (flag == '--report_period'):
+        reportPeriod = float(value)
+    elif (flag == '--track'):
+        hotSpotName, physicsFile = value.split(':', 1)
+    elif (flag == '--joins_only'):
+        joinsOnly = True
+    elif (flag == '--spawn_ai'):
+        spawnAI = True
+    else:
+        print("Error: Illegal option: " + flag)
+        print(helpString)
+        sys.exit(1)
+
+def spawnDistrict():
+    return subprocess.Popen([
+        sys.executable, '-m', 'game.cars.ai.AIServiceStart',
+        '--mdip=127.0.0.1', f'--mdport={port}',
+        '--esip=127.0.0.1', f'--esport={esport}',
+        '--logpath=logs/',
+        '--district_number=200000000', '--district_name=LoadTest',
+        '--ssid=20100000', '--min_objid=200100000', '--max_objid=200149999'])
+
+async def report(director):
+    while True:
+        await asyncio.sleep(reportPeriod)
+        print(director.stats.getReport())
+        sys.stdout.flush()
+
+async def main():
+    dcFile = DCFile()
+    for dcFileName in ['config/dclass/otp.dc', 'config/dclass/cars.dc']:
+        dcFile.read(Filename(dcFileName))
+
+    track = TrackRegistry.getTrack(hotSpotName, physicsFile)
+
+    director = LoadTestDirector(dcFile, port=port, eventPort=esport)
+    await director.start()
+    print("Message director stand-in listening on port %s." % port)
+
+    aiProcess = None
+    if spawnAI:
+        aiProcess = spawnDistrict()
+
+    print("Waiting for the district to come up...")
+    await director.ready.wait()
+    # The stats cover the load test, not the district's startup.
+    director.stats = LoadTestStats()
+
+    print("Starting %s cars." % numCars)
+    cars = []
+    tasks = []
+    for index in range(numCars):
+        car = SimulatedCar(director, index, track, telemetryRate, segmentInterval)
+        cars.append(car)
+        tasks.append(asyncio.ensure_future(car.run(numRaces, joinsOnly)))
+        if rampUp:
+            await asyncio.sleep(rampUp / numCars)
+
+    reportTask = asyncio.ensure_future(report(director))
+    try:
+        await asyncio.wait(tasks, timeout=duration)
+    finally:
+        reportTask.cancel()
+        for task in tasks:
+            task.cancel()
+        for car in cars:
+            car.logout()
+
+        print(director.stats.getReport())
+        director.stop()
+        if aiProcess:
+            aiProcess.terminate()
+            aiProcess.wait()
+
+asyncio.run(main())
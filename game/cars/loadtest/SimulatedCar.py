@@ -0,0 +1,208 @@
+from direct.directnotify.DirectNotifyGlobal import directNotify
+from game.cars.zone import ZoneConstants
+
+import asyncio
+import math
+import time
+
+# Simulated cars live in the range the database would give them.
+AVATAR_ID_BASE = 100000000
+RACECAR_ID_BASE = 150000000
+
+# Single player races are always run with three NPC opponents.
+NPC_IDS = [1, 2, 3]
+
+class LoadTestTimeout(Exception):
+    pass
+
+class SimulatedCar:
+    """
+    A headless client for the load test.  It does what a real client does
+    through the client agent: it logs in, streams setTelemetry while it is
+    around, joins the single player racing lobby, drives a race by
+    entering every segment of the track in order, and logs out again.
+    """
+    notify = directNotify.newCategory('SimulatedCar')
+
+    def __init__(self, director, index, track, telemetryRate=10.0,
+                 segmentInterval=0.25, timeout=30.0):
+        self.director = director
+        self.stats = director.stats
+        self.track = track
+        self.telemetryRate = telemetryRate
+        self.segmentInterval = segmentInterval
+        self.timeout = timeout
+
+        self.avatarId = AVATAR_ID_BASE + index
+        self.racecarId = RACECAR_ID_BASE + index
+        # The client agent puts the account id in the high bits; this
+        # test uses the avatar id for both.
+        self.sender = (self.avatarId << 32) | self.avatarId
+        self.puppetChannel = (1 << 32) + self.avatarId
+
+        # [fieldName, doId, predicate, future]
+        self.waiters = []
+        self.telemetryTask = None
+        self.loggedIn = False
+        self.raceId = None
+
+    async def run(self, numRaces, joinOnly=False):
+        raceNum = 0
+        while numRaces <= 0 or raceNum < numRaces:
+            raceNum += 1
+            try:
+                await self.login()
+                if joinOnly:
+                    # Logging out leaves the race, which lets it go.
+                    await self.join()
+                else:
+                    await self.race()
+            except LoadTestTimeout as e:
+                self.stats.count('failures')
+                self.notify.warning('Car %s timed out waiting for %s.' % (self.avatarId, e))
+            finally:
+                self.logout()
+
+            # Give the AI a moment to clean up before logging back in.
+            await asyncio.sleep(1.0)
+
+    ##### Messages from the AI #####
+
+    def handleUpdate(self, doId, fieldName, args):
+        for waiter in list(self.waiters):
+            waitFieldName, waitDoId, predicate, future = waiter
+            if waitFieldName != fieldName or (waitDoId is not None and waitDoId != doId):
+                continue
+            if predicate and not predicate(args):
+                continue
+
+            self.waiters.remove(waiter)
+            if not future.done():
+                future.set_result(args)
+
+    def expect(self, fieldName, doId=None, predicate=None):
+        """
+        Returns a future for the next update of the indicated field.  Call
+        this before sending whatever triggers the update.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append([fieldName, doId, predicate, future])
+        return future
+
+    async def wait(self, future, what, latencyName=None, startTime=None):
+        if startTime is None:
+            startTime = time.monotonic()
+        try:
+            result = await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            self.waiters = [waiter for waiter in self.waiters if waiter[3] is not future]
+            raise LoadTestTimeout(what)
+
+        if latencyName:
+            self.stats.addLatency(latencyName, time.monotonic() - startTime)
+        return result
+
+    def sendUpdate(self, className, fieldName, doId, args):
+        self.director.sendUpdate(className, fieldName, doId, self.sender, args)
+
+    ##### Session #####
+
+    async def login(self):
+        self.director.addCar(self)
+        generated = self.expect('generateComplete', self.avatarId)
+        self.director.sendEnterAI(
+            'DistributedCarPlayer', self.avatarId,
+            self.director.districtId, self.director.zoneIds[ZoneConstants.DOWNTOWN_RADIATOR_SPRINGS],
+            required={'setDISLid': [self.avatarId]},
+            other={'setDISLname': ['LoadTest%d' % self.avatarId],
+                   'setCars': [1, [self.racecarId]]})
+        self.loggedIn = True
+        await self.wait(generated, 'generateComplete', 'login')
+        self.stats.count('logins')
+
+        self.telemetryTask = asyncio.ensure_future(self.streamTelemetry())
+
+    def logout(self):
+        if self.telemetryTask:
+            self.telemetryTask.cancel()
+            self.telemetryTask = None
+
+        if self.raceId:
+            self.director.ignore(self, self.raceId)
+            self.raceId = None
+
+        if self.loggedIn:
+            # Like the state server does when the client goes away.
+            self.director.sendDeleteRam(self.avatarId)
+            self.loggedIn = False
+
+        self.director.removeCar(self)
+        for waiter in self.waiters:
+            waiter[3].cancel()
+        self.waiters = []
+
+    async def streamTelemetry(self):
+        period = 1. / self.telemetryRate
+        startTime = time.monotonic()
+        while True:
+            # Drive around in a circle.
+            t = time.monotonic() - startTime
+            angle = (t * 20.) % 360.
+            x = int(1000 * math.cos(math.radians(angle)))
+            y = int(1000 * math.sin(math.radians(angle)))
+            self.sendUpdate('DistributedCarPlayer', 'setTelemetry', self.avatarId,
+                            [x, y, 0, 0, 0, int(angle), 0, int(t * 1000) & 0x7fffffff])
+            self.stats.count('telemetry')
+            await asyncio.sleep(period)
+
+    ##### Racing #####
+
+    async def join(self):
+        lobbyId = self.director.lobbyId
+        lobbyClass = self.director.objects[lobbyId][0]
+
+        joined = self.expect('gotoLobbyContext', lobbyId)
+        self.sendUpdate(lobbyClass, 'join', lobbyId, [])
+        contextZoneId, = await self.wait(joined, 'gotoLobbyContext', 'join')
+        self.stats.count('joins')
+        return contextZoneId
+
+    async def race(self):
+        contextZoneId = await self.join()
+
+        # The context tells us where the race is, and the race is
+        # generated in the same frame, so both have arrived by now.
+        contextId = self.director.findObject('DistributedSinglePlayerRacingLobbyContext', contextZoneId)
+        raceId = None
+        if contextId:
+            raceId = self.director.findObject('DistributedSPRace', self.director.gotoDungeonZones.get(contextId))
+        if not raceId:
+            raise LoadTestTimeout('race generate')
+
+        self.raceId = raceId
+        self.director.listen(self, raceId)
+
+        countDownDone = self.expect('setCountDown', raceId, lambda args: args[0] == 0)
+        startTime = time.monotonic()
+        self.sendUpdate('DistributedSPRace', 'setOpponentNPCs', raceId, [NPC_IDS])
+        self.sendUpdate('DistributedSPRace', 'syncReady', raceId, [])
+        await self.wait(countDownDone, 'setCountDown', 'countDown', startTime)
+
+        # Drive every lap by following the first child of each segment.
+        startingSegment = self.track.startingTrackSegment
+        segment = self.track.segmentById[startingSegment]
+        result = self.expect('setRacerResult', raceId, lambda args: args[0] == self.avatarId)
+        raceStartTime = time.monotonic()
+        for lap in range(self.track.totalLaps):
+            for step in range(len(self.track.segments)):
+                nextSegment = segment.children[0]
+                await asyncio.sleep(self.segmentInterval)
+                self.sendUpdate('DistributedSPRace', 'onSegmentEnter', raceId,
+                                [nextSegment.id, segment.id, 1])
+                segment = nextSegment
+                if segment.id == startingSegment:
+                    break
+
+        await self.wait(result, 'setRacerResult', 'finish')
+        self.stats.addLatency('race', time.monotonic() - raceStartTime)
+        self.stats.count('racesFinished')
@@ -0,0 +1,130 @@
+import sys
+import time
+import getopt
+import random
+
+from game.cars.zone.SpatialGrid import SpatialGrid
+
+# Define a usage string
+helpString ="""
+python -m game.cars.loadtest.SpatialGridBench [--cars=<number>] [--rate=<hz>] [--seconds=<simulated seconds>] [--area=<size>] [--cell_size=<size>] [--radius=<distance>] [--k=<number>]
+
+Times the SpatialGrid of one zone with cars that move at random in a
+square area.  Every tick each car moves and updates its position, then
+each car asks for the cars within --radius of it and for its --k nearest
+neighbours.  Reports the time taken per tick and per second of simulated
+time, next to a brute force scan over every pair of cars.  Needs nothing
+but the standard library.
+
+Example:
+
+python -m game.cars.loadtest.SpatialGridBench --cars=500 --rate=10
+"""
+
+# Get the options
+try:
+    opts, pargs = getopt.getopt(sys.argv[1:], '', [
+        'cars=',
+        'rate=',
+        'seconds=',
+        'area=',
+        'cell_size=',
+        'radius=',
+        'k=',
+        ])
+except Exception as e:
+    print(e)
+    print(helpString)
+    sys.exit(1)
+
+# Default values
+numCars = 500
+rate = 10.
+seconds = 5.
+area = 4000
+cellSize = 100
+radius = 150
+k = 5
+
+for opt in opts:
+    flag, value = opt
+    if (flag == '--cars'):
+        numCars = int(value)
+    elif (flag == '--rate'):
+        rate = float(value)
+    elif (flag == '--seconds'):
+        seconds = float(value)
+    elif (flag == '--area'):
+        area = int(value)
+    elif (flag == '--cell_size'):
+        cellSize = int(value)
+    elif (flag == '--radius'):
+        radius = int(value)
+    elif (flag == '--k'):
+        k = int(value)
+    else:
+        print("Error: Illegal option: " + flag)
+        print(helpString)
+        sys.exit(1)
+
+def bruteForce(cars, doId):
+    x, y = cars[doId][:2]
+    inRadius = []
+    distances = []
+    for otherId, (otherX, otherY, heading) in cars.items():
+        if otherId == doId:
+            continue
+        distanceSquared = (otherX - x) ** 2 + (otherY - y) ** 2
+        if distanceSquared <= radius * radius:
+            inRadius.append(otherId)
+        distances.append((distanceSquared, otherId))
+    distances.sort()
+    return inRadius, distances[:k]
+
+rng = random.Random(numCars)
+grid = SpatialGrid(cellSize)
+# doId -> [x, y, heading]
+cars = {}
+for doId in range(1, numCars + 1):
+    cars[doId] = [rng.uniform(0, area), rng.uniform(0, area), rng.uniform(0, 360)]
+
+numTicks = int(seconds * rate)
+speed = 200. / rate
+updateTime = 0.
+radiusTime = 0.
+nearestTime = 0.
+bruteTime = 0.
+numFound = 0
+for tick in range(numTicks):
+    for car in cars.values():
+        car[0] = min(max(car[0] + rng.uniform(-speed, speed), 0), area)
+        car[1] = min(max(car[1] + rng.uniform(-speed, speed), 0), area)
+
+    start = time.perf_counter()
+    for doId, car in cars.items():
+        grid.update(doId, int(car[0]), int(car[1]))
+    updateTime += time.perf_counter() - start
+
+    start = time.perf_counter()
+    for doId, car in cars.items():
+        numFound += len(grid.queryRadius(int(car[0]), int(car[1]), radius, exclude=doId))
+    radiusTime += time.perf_counter() - start
+
+    start = time.perf_counter()
+    for doId, car in cars.items():
+        grid.queryNearest(int(car[0]), int(car[1]), k, exclude=doId)
+    nearestTime += time.perf_counter() - start
+
+    if tick == 0:
+        # Only once, it's slow.
+        start = time.perf_counter()
+        for doId in cars:
+            bruteForce(cars, doId)
+        bruteTime = time.perf_counter() - start
+
+print('%s cars at %.0f Hz, cell size %s, radius %s, k %s:' % (numCars, rate, cellSize, radius, k))
+for name, total in [('update', updateTime), ('radius query', radiusTime), ('nearest query', nearestTime)]:
+    print('  %-14s %8.3fms per tick, %6.1fms per second' % (
+        name, total * 1000. / numTicks, total * 1000. * rate / numTicks))
+print('  %-14s %8.3fms per tick' % ('brute force', bruteTime * 1000.))
+print('  %.1f cars within radius on average' % (numFound / float(numTicks * numCars)))
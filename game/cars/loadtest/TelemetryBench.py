@@ -0,0 +1,117 @@
+import sys
+import time
+import getopt
+import random
+
+from game.cars.zone.TelemetryZone import TelemetryZone, NUM_TIERS
+
+# Define a usage string
+helpString ="""
+python -m game.cars.loadtest.TelemetryBench [--cars=<number>[,<number>...]] [--rate=<hz>] [--seconds=<simulated seconds>] [--area=<size>] [--near=<distance>] [--mid=<distance>] [--mid_period=<ticks>] [--far_period=<ticks>]
+
+Measures how many setTelemetry messages per second one zone generates
+when the state server broadcasts them, and when the AI rebroadcasts them
+with TelemetryZone's distance tiers.  The cars drive around at random in
+a square area and send telemetry at --rate, which is also the rebroadcast
+rate.  Takes the same distances and periods as the telemetry-* config
+variables.  Needs nothing but the standard library.
+
+Example:
+
+python -m game.cars.loadtest.TelemetryBench --cars=50,100,200
+"""
+
+# Get the options
+try:
+    opts, pargs = getopt.getopt(sys.argv[1:], '', [
+        'cars=',
+        'rate=',
+        'seconds=',
+        'area=',
+        'near=',
+        'mid=',
+        'mid_period=',
+        'far_period=',
+        ])
+except Exception as e:
+    print(e)
+    print(helpString)
+    sys.exit(1)
+
+# Default values, the same as TelemetryManager's.
+carCounts = [50, 100, 200]
+rate = 10.
+seconds = 30.
+area = 4000
+nearDistance = 250
+midDistance = 1000
+midPeriod = 2
+farPeriod = 5
+
+for opt in opts:
+    flag, value = opt
+    if (flag == '--cars'):
+        carCounts = [int(count) for count in value.split(',')]
+    elif (flag == '--rate'):
+        rate = float(value)
+    elif (flag == '--seconds'):
+        seconds = float(value)
+    elif (flag == '--area'):
+        area = int(value)
+    elif (flag == '--near'):
+        nearDistance = int(value)
+    elif (flag == '--mid'):
+        midDistance = int(value)
+    elif (flag == '--mid_period'):
+        midPeriod = int(value)
+    elif (flag == '--far_period'):
+        farPeriod = int(value)
+    else:
+        print("Error: Illegal option: " + flag)
+        print(helpString)
+        sys.exit(1)
+
+def run(numCars):
+    rng = random.Random(numCars)
+    zone = TelemetryZone(0, nearDistance, max(1, midDistance // nearDistance),
+                         midPeriod, farPeriod)
+    # doId -> [x, y, heading]
+    cars = {}
+    for doId in range(1, numCars + 1):
+        cars[doId] = [rng.uniform(0, area), rng.uniform(0, area), rng.uniform(0, 360)]
+
+    numTicks = int(seconds * rate)
+    speed = 200. / rate
+    numUpdates = 0
+    numDatagrams = 0
+    numDelivered = 0
+    deliveredByTier = [0] * NUM_TIERS
+    planTime = 0.
+    for tick in range(numTicks):
+        for doId, car in cars.items():
+            car[2] = (car[2] + rng.uniform(-20, 20)) % 360
+            direction = rng.choice((-1, 1))
+            car[0] = min(max(car[0] + direction * speed * rng.random(), 0), area)
+            car[1] = min(max(car[1] + direction * speed * rng.random(), 0), area)
+            zone.update(doId, (int(car[0]), int(car[1]), 0, 0, 0, int(car[2]), 0), tick)
+            numUpdates += 1
+
+        start = time.perf_counter()
+        plan = zone.planRebroadcast(tick)
+        planTime += time.perf_counter() - start
+
+        for doId, tier, recipients in plan:
+            numDatagrams += (len(recipients) + 254) // 255
+            numDelivered += len(recipients)
+            deliveredByTier[tier] += len(recipients)
+
+    broadcast = numUpdates * (numCars - 1) / seconds
+    throttled = numDelivered / seconds
+    print('%4d cars: broadcast %8.0f msg/s | rebroadcast %8.0f msg/s (%3.0f%%), near/mid/far %s, '
+          '%6.0f datagrams/s from the AI, %.2fms planning per tick' % (
+        numCars, broadcast, throttled, 100. * throttled / max(broadcast, 1),
+        '/'.join('%.0f' % (count / seconds) for count in deliveredByTier),
+        numDatagrams / seconds, planTime * 1000. / numTicks))
+
+for numCars in carCounts:
+    run(numCars)
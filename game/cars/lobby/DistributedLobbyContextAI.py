@@ -12,6 +12,14 @@ class DistributedLobbyContextAI(DistributedObjectAI):
         self.destinationShard: int = 0
         self.destinationZone: int = 0
 
+        # Set by the InstanceManager if it owns our zone.
+        self.instance = None
+
+    def delete(self):
+        if self.instance:
+            self.air.instanceManager.objectDeleted(self)
+        DistributedObjectAI.delete(self)
+
     def getPlayersInDungeon(self):
         return self.playersInDungeon
 
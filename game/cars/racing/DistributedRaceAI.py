@@ -13,6 +13,7 @@ from direct.task.Task import Task
 class DistributedRaceAI(DistributedDungeonAI):
     notify = directNotify.newCategory("DistributedRaceAI")
     COUNTDOWN_TIME = 4
+    PLACE_UPDATE_PERIOD = 1.0
 
     def __init__(self, air, track):
         DistributedDungeonAI.__init__(self, air)
@@ -25,20 +26,44 @@ class DistributedRaceAI(DistributedDungeonAI):
         self.finishedPlayerIds: List[int] = []
         self.playerIdsThatLeft: List[int] = []
 
-        self.totalRaceTime = 0
+        # Times come from the district's RaceClock; these are its timestamps.
+        self.raceStartTime: float = 0.0
+        self.playerIdToLapStartTime: Dict[int, float] = {}
         self.playerIdToBestLapTime: Dict[int, int] = {}
-        self.playerIdToCurrentLapTime: Dict[int, int] = {}
         self.playerIdToMaxLap: Dict[int, int] = {}
 
         self.places: List[int] = [0, 0, 0, 0]
 
+        # Sort key for placement: (-lap, -segment progress, arrival order),
+        # updated whenever a racer moves.  Ties go to whoever got there first.
+        self.playerIdToProgressKey: Dict[int, tuple] = {}
+        self.progressCounter: int = 0
+
+        # What the race sends during a frame, held until the RaceClock
+        # flushes it at the end of the frame: formatted updates, and the
+        # (playerId, place) of racers to reward.
+        self.output: list = []
+        self.pendingRewards: List[tuple] = []
+        self.numMessages: int = 0
+        self.numBytes: int = 0
+
+    def addRacer(self, player, ready):
+        self.playerIdToLap[player] = 1
+        self.playerIdToMaxLap[player] = 1
+        self.playerIdToBestLapTime[player] = 900000 # 15 minutes, seems like the best default.
+        self.playerIdToReady[player] = ready
+        self.playerIdToSegment[player] = self.track.segmentById[self.track.startingTrackSegment]
+        self.updateProgressKey(player)
+
+    def updateProgressKey(self, player):
+        self.progressCounter += 1
+        self.playerIdToProgressKey[player] = (-self.playerIdToLap[player],
+                                              -self.playerIdToSegment[player].progress,
+                                              self.progressCounter)
+
     def announceGenerate(self):
         for player in self.playerIds:
-            self.playerIdToLap[player] = 1
-            self.playerIdToMaxLap[player] = 1
-            self.playerIdToBestLapTime[player] = 900000 # 15 minutes, seems like the best default.
-            self.playerIdToReady[player] = False
-            self.playerIdToSegment[player] = self.track.segmentById[self.track.startingTrackSegment]
+            self.addRacer(player, False)
 
             self.accept(self.staticGetZoneChangeEvent(player), Functor(self._playerChangedZone, player))
             self.acceptOnce(self.air.getDeleteDoIdEvent(player), self._playerDeleted, extraArgs=[player])
@@ -48,32 +73,29 @@ class DistributedRaceAI(DistributedDungeonAI):
         # FIXME: Client seems to set their player's zone to the quiet zone
         # for single player races, how would this work for multiplayer races?
         if playerId in self.playerIds and oldZoneId == 1:
-            self._playerDeleted(playerId)
+            self._playerDeleted(playerId, 'quit')
 
-    def _playerDeleted(self, playerId):
+    def _playerDeleted(self, playerId, reason='disconnect'):
         self.notify.debug(f"Player {playerId} have left the race!")
         self.playerIds.remove(playerId)
         self.playerIdsThatLeft.append(playerId)
         self.ignore(self.staticGetZoneChangeEvent(playerId))
         self.ignore(self.air.getDeleteDoIdEvent(playerId))
 
-        taskMgr.remove(f"playerLapTime-{playerId}")
-
         if not self.getActualPlayers():
             self.notify.debug("Everybody has left, shutting down...")
-            self.requestDelete()
+            self.releaseInstance(reason)
 
     def delete(self):
         # Stop the rest of the Tasks:
         taskMgr.remove(self.taskName("countDown"))
-        taskMgr.remove(self.taskName("totalRaceTime"))
-        taskMgr.remove(self.taskName("placeUpdate"))
-        for playerId in self.playerIds:
-            taskMgr.remove(self.taskName(f"playerLapTime-{playerId}"))
+        self.flushOutput()
+        self.air.raceClock.raceDone(self)
 
-        # Delete the lobby context if it still exists.
+        # Delete the lobby context if it still exists, the InstanceManager
+        # does that if it owns us.
         context: DistributedObjectAI = self.air.getDo(self.contextDoId)
-        if context:
+        if context and not self.instance:
             context.requestDelete()
         DistributedDungeonAI.delete(self)
 
@@ -85,75 +107,75 @@ class DistributedRaceAI(DistributedDungeonAI):
         return False
 
     def sendPlaces(self):
-        firstPlaceIndexToDetermine = 0
-        numPlayersDidntFinish = 0
+        places: List[int] = [0] * len(self.places)
+        lastIndex = len(places) - 1
 
-        # Players that have finished must retain their position and increment the first position we check for other players.
-        for player in self.finishedPlayerIds:
-            finishedPlaceIndex = self.finishedPlayerIds.index(player)
-            self.places[3 - finishedPlaceIndex] = player
-            firstPlaceIndexToDetermine += 1
+        # Players that have finished retain their position (the last index is first place).
+        for finishedPlaceIndex, player in enumerate(self.finishedPlayerIds):
+            places[lastIndex - finishedPlaceIndex] = player
+        finished = set(self.finishedPlayerIds)
 
-        # Players that left but didn't finish will display as the lowest position based on the index (e.g. the first player that leaves would be 4th).
+        # Players that left but didn't finish will display as the lowest position (e.g. the first player that leaves would be 4th).
+        numPlayersDidntFinish = 0
         for player in self.playerIdsThatLeft:
-            if player in self.finishedPlayerIds:
+            if player in finished:
                 continue
-
-            self.places[self.playerIdsThatLeft.index(player)] = player
+            places[numPlayersDidntFinish] = player
             numPlayersDidntFinish += 1
 
-        # Now we need to store and churn through lap and segment data from players that are still in the race and haven't finished yet.
-        playerLapsAndSegmentsIds: Dict[int, tuple] = {}
-
-        for player in self.playerIds:
-            if player in self.finishedPlayerIds:
-                continue
-
-            playerLap = self.playerIdToLap.get(player)
-            playerSegment = self.playerIdToSegment.get(player)
-            playerLapsAndSegmentsIds[player] = (playerLap, playerSegment.id)
+        # Everybody else is placed by how far along the track they are.
+        racing = [player for player in self.playerIds if player not in finished]
+        racing.sort(key=self.playerIdToProgressKey.__getitem__)
+        firstPlaceIndexToDetermine = lastIndex - len(finished)
+        for index, player in enumerate(racing[:len(places) - len(finished) - numPlayersDidntFinish]):
+            places[firstPlaceIndexToDetermine - index] = player
 
-        if len(playerLapsAndSegmentsIds) == 0:
-            # All players have finished/left. Just send the update now.
-            self.sendUpdate('setPlaces', [self.places])
+        if places == self.places:
+            # Nobody moved past anybody, the clients have these already.
+            self.air.raceClock.numPlacesSkipped += 1
             return
-
-        playersOnFurthestLap: List[int] = []
-        playersInFurthestSegment: List[int] = []
-
-        for placeIndex in range(firstPlaceIndexToDetermine, (4 - numPlayersDidntFinish)):
-            # If we still have players to churn through on the furthest lap, we don't need to iterate again.
-            if not playersOnFurthestLap:
-                furthestLap = -1
-                for player in playerLapsAndSegmentsIds:
-                    playerLap, playerSegmentId = playerLapsAndSegmentsIds.get(player)
-                    if not playersOnFurthestLap or playerLap > furthestLap:
-                        furthestLap = playerLap
-                        playersOnFurthestLap = [player]
-                    elif playerLap == furthestLap:
-                        playersOnFurthestLap.append(player)
-
-            # Same as above, but for segment:
-            if not playersInFurthestSegment:
-                furthestSegmentId = -1
-                for player in playersOnFurthestLap:
-                    playerLap, playerSegmentId = playerLapsAndSegmentsIds.get(player)
-                    if not playersInFurthestSegment or playerSegmentId > furthestSegmentId:
-                        furthestSegmentId = playerSegmentId
-                        playersInFurthestSegment = [player]
-                    elif playerSegmentId == furthestSegmentId:
-                        playersInFurthestSegment.append(player)
-
-            # TODO: Determine what happens if there's a segment tie. Right now, lowest avId gets the lower place.
-            playerForThisPlace = playersInFurthestSegment[0]
-            self.places[3 - placeIndex] = playerForThisPlace
-
-            # Cleanup for further iterations.
-            del playerLapsAndSegmentsIds[playerForThisPlace]
-            playersOnFurthestLap.remove(playerForThisPlace)
-            playersInFurthestSegment.remove(playerForThisPlace)
-
-        self.sendUpdate('setPlaces', [self.places])
+        self.places = places
+        self.air.raceClock.numPlacesSent += 1
+        self.queueUpdate('setPlaces', [self.places])
+
+    def queueUpdate(self, fieldName, args):
+        dg = self.dclass.aiFormatUpdate(fieldName, self.doId, self.doId, self.air.ourChannel, args)
+        self.output.append(dg)
+        self.air.raceClock.queueOutput(self)
+
+    def flushOutput(self):
+        """
+        Sends everything queued this frame, in one message bundle with
+        want-race-message-bundles.  Rewards are given here too, so
+        the coins, racing points and rule response go in the same bundle
+        as the result.
+        """
+        if not self.output and not self.pendingRewards:
+            return
+        output = self.output
+        rewards = self.pendingRewards
+        self.output = []
+        self.pendingRewards = []
+
+        raceClock = self.air.raceClock
+        numBytes = 0
+        if raceClock.wantBundles:
+            self.air.startMessageBundle('race-%s' % self.doId)
+        try:
+            for dg in output:
+                self.air.sendDatagram(dg)
+                numBytes += dg.getLength()
+            for playerId, place in rewards:
+                self.giveReward(playerId, place)
+        finally:
+            if raceClock.wantBundles:
+                self.air.sendMessageBundle(self.doId)
+                raceClock.numBundles += 1
+
+        self.numMessages += len(output)
+        self.numBytes += numBytes
+        raceClock.numMessages += len(output)
+        raceClock.numBytes += numBytes
 
     def raceStarted(self) -> bool:
         return self.countDown == 0
@@ -216,9 +238,11 @@ class DistributedRaceAI(DistributedDungeonAI):
                 self.notify.debug(f"{playerId} has reached lap {self.playerIdToLap[playerId]}!")
                 if self.playerIdToLap[playerId] > self.playerIdToMaxLap[playerId]:
                     self.playerIdToMaxLap[playerId] = self.playerIdToLap[playerId]
-                    if self.playerIdToCurrentLapTime[playerId] < self.playerIdToBestLapTime[playerId]:
-                        self.playerIdToBestLapTime[playerId] = self.playerIdToCurrentLapTime[playerId]
-                    self.playerIdToCurrentLapTime[playerId] = 0
+                    lapTime = self.getCurrentLapTime(playerId)
+                    if lapTime < self.playerIdToBestLapTime[playerId]:
+                        self.playerIdToBestLapTime[playerId] = lapTime
+                    self.playerIdToLapStartTime[playerId] = self.air.raceClock.getTime()
+            self.updateProgressKey(playerId)
         elif segment in currentSegment.parentIds:
             parentSegment = currentSegment.parentById.get(segment)
             if not parentSegment:
@@ -229,6 +253,7 @@ class DistributedRaceAI(DistributedDungeonAI):
                 # They have reached back a lap!
                 self.playerIdToLap[playerId] -= 1
                 self.notify.debug(f"{playerId} went back to lap {self.playerIdToLap[playerId]}!")
+            self.updateProgressKey(playerId)
 
         if self.playerIdToLap[playerId] > self.track.totalLaps:
             self.playerFinishedRace(playerId)
@@ -243,12 +268,21 @@ class DistributedRaceAI(DistributedDungeonAI):
         place = self.finishedPlayerIds.index(playerId) + 1
 
         # TODO: Photo finish?
-        self.sendUpdate('setRacerResult', (playerId, place, self.playerIdToBestLapTime[playerId], self.totalRaceTime, 0, 0))
+        self.queueUpdate('setRacerResult', (playerId, place, self.playerIdToBestLapTime[playerId], self.getTotalRaceTime(), 0, 0))
 
         if self.isNPC(playerId):
             # We don't give out rewards to NPCs.
             return
 
+        player: DistributedCarPlayerAI = self.air.getDo(playerId)
+        name = player.getDISLname() if player else ''
+        self.air.leaderboardManager.recordResult(self.track.name, playerId, name,
+                                                 self.playerIdToBestLapTime[playerId], self.getTotalRaceTime())
+
+        self.pendingRewards.append((playerId, place))
+        self.air.raceClock.queueOutput(self)
+
+    def giveReward(self, playerId, place):
         player: DistributedCarPlayerAI = self.air.getDo(playerId)
         if not player:
             self.notify.warning(f"No player for playerid: {playerId}")
@@ -263,26 +297,25 @@ class DistributedRaceAI(DistributedDungeonAI):
 
     def __doCountDown(self, task: Task):
         self.countDown -= 1
-        self.sendUpdate('setCountDown', (self.countDown,))
+        self.queueUpdate('setCountDown', (self.countDown,))
         if self.countDown == 0:
-            # Start the timers.
-            taskMgr.add(self.__doTotalRaceTime, self.taskName("totalRaceTime"))
+            # Start the clock.
+            self.raceStartTime = self.air.raceClock.getTime()
             for playerId in self.playerIds:
-                taskMgr.add(self.__doPlayerLapTime, self.taskName(f"playerLapTime-{playerId}"), extraArgs=[playerId], appendTask=True)
-            self.doMethodLater(1.0, self.__doPlaceUpdate, self.taskName("placeUpdate"))
+                self.playerIdToLapStartTime[playerId] = self.raceStartTime
+            self.air.raceClock.addRace(self, self.PLACE_UPDATE_PERIOD)
             return task.done
 
         task.delayTime = 1
         return task.again
 
-    def __doTotalRaceTime(self, task: Task):
-        self.totalRaceTime = int(task.time * 1000)
-        return task.cont
-
-    def __doPlayerLapTime(self, playerId: int, task: Task):
-        self.playerIdToCurrentLapTime[playerId] = int(task.time * 1000)
-        return task.cont
-
-    def __doPlaceUpdate(self, task: Task):
-        self.sendPlaces()
-        return task.again
+    def getTotalRaceTime(self) -> int:
+        if not self.raceStarted():
+            return 0
+        return self.air.raceClock.getElapsedMs(self.raceStartTime)
+
+    def getCurrentLapTime(self, playerId: int) -> int:
+        lapStartTime = self.playerIdToLapStartTime.get(playerId)
+        if lapStartTime is None:
+            return 0
+        return self.air.raceClock.getElapsedMs(lapStartTime)
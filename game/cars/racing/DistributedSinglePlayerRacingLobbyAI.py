@@ -2,8 +2,10 @@ from game.cars.racing.DistributedLobbyAI import DistributedLobbyAI
 from game.cars.racing.DistributedSinglePlayerRacingLobbyContextAI import DistributedSinglePlayerRacingLobbyContextAI
 from game.cars.racing.DistributedSPRaceAI import DistributedSPRaceAI
 from game.cars.distributed.CarsGlobals import DUNGEON_INTEREST_HANDLE
+from typing import List, Tuple
 
 from .Track import Track
+from .TrackRegistry import TrackRegistry
 
 class DistributedSinglePlayerRacingLobbyAI(DistributedLobbyAI):
 
@@ -12,27 +14,82 @@ class DistributedSinglePlayerRacingLobbyAI(DistributedLobbyAI):
 
         self.hotSpotName: str = hotSpotName
         self.dungeonItemId: int = dungeonItemId
-        self.track: Track = Track(hotSpotName, track)
-        self.track.totalLaps = 3
+        # Shared with every other lobby on this track; Track defaults to 3 laps.
+        self.track: Track = TrackRegistry.getTrack(hotSpotName, track)
 
-    def join(self):
-        avatarId = self.air.getAvatarIdFromSender()
+        # Contexts and races made ahead of time, a few frames after the
+        # last join took one, so join only has to generate them.  The
+        # default race-pool-size of 0 turns it off, and join makes them
+        # itself.
+        self.poolSize: int = config.GetInt('race-pool-size', 0)
+        self.pool: List[Tuple[DistributedSinglePlayerRacingLobbyContextAI, DistributedSPRaceAI]] = []
+        self.numPoolHits: int = 0
+        self.numPoolMisses: int = 0
 
-        # Maybe host it's own context zone allocation?
-        contextZoneId = self.air.allocateZone()
-        zoneId = self.air.allocateZone()
+    def announceGenerate(self):
+        DistributedLobbyAI.announceGenerate(self)
+        self.refillPool()
 
-        lobbyContext = DistributedSinglePlayerRacingLobbyContextAI(self.air)
-        lobbyContext.owningAv = avatarId
-        lobbyContext.playersInContext.append(avatarId)
-        lobbyContext.generateOtpObject(self.doId, contextZoneId)
+    def delete(self):
+        taskMgr.remove(self.taskName('refillRacePool'))
+        self.pool = []
+        DistributedLobbyAI.delete(self)
 
+    def makeRace(self):
+        lobbyContext = DistributedSinglePlayerRacingLobbyContextAI(self.air)
         race = DistributedSPRaceAI(self.air, self.track)
-        race.playerIds.append(avatarId)
         race.lobbyDoId = self.doId
-        race.contextDoId = lobbyContext.doId
         race.dungeonItemId = self.dungeonItemId
-        race.generateWithRequired(zoneId)
+        return lobbyContext, race
+
+    def takeRace(self):
+        if self.pool:
+            self.numPoolHits += 1
+            lobbyContext, race = self.pool.pop()
+            self.refillPool()
+            return lobbyContext, race
+
+        if self.poolSize:
+            self.numPoolMisses += 1
+        return self.makeRace()
+
+    def refillPool(self):
+        taskName = self.taskName('refillRacePool')
+        if len(self.pool) < self.poolSize and not taskMgr.hasTaskNamed(taskName):
+            taskMgr.add(self.__refillPoolTask, taskName)
+
+    def __refillPoolTask(self, task):
+        # One pair per frame, so a burst of joins doesn't hold up a frame.
+        self.pool.append(self.makeRace())
+        if len(self.pool) < self.poolSize:
+            return task.cont
+        return task.done
+
+    def getStatsString(self):
+        return 'race pool %s: %s of %s ready, %s hits, %s misses' % (
+            self.hotSpotName, len(self.pool), self.poolSize, self.numPoolHits, self.numPoolMisses)
+
+    def join(self):
+        avatarId = self.air.getAvatarIdFromSender()
+
+        # The context and the race get a zone each, which go back to the
+        # pool when the instance is released.
+        instanceManager = self.air.instanceManager
+        instance = instanceManager.createInstance([avatarId])
+        lobbyContext, race = self.takeRace()
+        try:
+            lobbyContext.owningAv = avatarId
+            lobbyContext.playersInContext.append(avatarId)
+            lobbyContext.generateOtpObject(self.doId, instance.contextZoneId)
+            instanceManager.addObject(instance, lobbyContext)
+
+            race.playerIds.append(avatarId)
+            race.contextDoId = lobbyContext.doId
+            race.generateWithRequired(instance.zoneId)
+            instanceManager.addObject(instance, race)
+        except Exception:
+            instanceManager.releaseInstance(instance, 'error')
+            raise
 
         lobbyContext.b_setGotoDungeon(self.air.district.doId, race.zoneId)
-        self.sendUpdateToAvatarId(avatarId, 'gotoLobbyContext', [contextZoneId])
+        self.sendUpdateToAvatarId(avatarId, 'gotoLobbyContext', [instance.contextZoneId])
@@ -0,0 +1,229 @@
+from bisect import bisect_left, insort
+from typing import Dict, List, Set
+
+class RankedList:
+    """
+    A sorted list of unique keys, kept as chunks of at most 2 * load keys
+    with a Fenwick tree over the chunk lengths.  Finding the chunk is a
+    bisect on the chunk maximums and counting the keys in front of it is
+    a walk up the tree, so insert, remove and rank are O(log n) apart
+    from moving at most 2 * load pointers inside one chunk.
+    """
+
+    def __init__(self, keys=(), load=512):
+        self.load = load
+        self.chunks: List[list] = []
+        self.maxes: list = []
+        self.tree: List[int] = [0]
+        self.size = 0
+
+        keys = sorted(keys)
+        for i in range(0, len(keys), load):
+            chunk = keys[i:i + load]
+            self.chunks.append(chunk)
+            self.maxes.append(chunk[-1])
+        self.size = len(keys)
+        self.__rebuild()
+
+    def __len__(self):
+        return self.size
+
+    def __rebuild(self):
+        # 1-based, tree[i] covers the (i & -i) chunks ending at chunk i - 1.
+        tree = [0] + [len(chunk) for chunk in self.chunks]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self.tree = tree
+
+    def __add(self, index, delta):
+        tree = self.tree
+        i = index + 1
+        while i < len(tree):
+            tree[i] += delta
+            i += i & -i
+
+    def __countBefore(self, index):
+        # How many keys are in chunks[:index].
+        tree = self.tree
+        total = 0
+        while index > 0:
+            total += tree[index]
+            index -= index & -index
+        return total
+
+    def insert(self, key):
+        if not self.chunks:
+            self.chunks.append([key])
+            self.maxes.append(key)
+            self.size = 1
+            self.__rebuild()
+            return
+
+        index = bisect_left(self.maxes, key)
+        if index == len(self.maxes):
+            # Past the end, goes on the last chunk.
+            index -= 1
+            chunk = self.chunks[index]
+            chunk.append(key)
+            self.maxes[index] = key
+        else:
+            chunk = self.chunks[index]
+            insort(chunk, key)
+        self.size += 1
+
+        if len(chunk) > 2 * self.load:
+            self.chunks[index:index + 1] = [chunk[:self.load], chunk[self.load:]]
+            self.maxes[index:index + 1] = [chunk[self.load - 1], chunk[-1]]
+            self.__rebuild()
+        else:
+            self.__add(index, 1)
+
+    def remove(self, key):
+        index = bisect_left(self.maxes, key)
+        if index == len(self.maxes):
+            raise ValueError('%s is not in the list' % (key,))
+        chunk = self.chunks[index]
+        position = bisect_left(chunk, key)
+        if chunk[position] != key:
+            raise ValueError('%s is not in the list' % (key,))
+
+        del chunk[position]
+        self.size -= 1
+        if chunk:
+            self.maxes[index] = chunk[-1]
+            self.__add(index, -1)
+        else:
+            del self.chunks[index]
+            del self.maxes[index]
+            self.__rebuild()
+
+    def rank(self, key) -> int:
+        # How many keys are smaller than key.
+        index = bisect_left(self.maxes, key)
+        if index == len(self.maxes):
+            return self.size
+        return self.__countBefore(index) + bisect_left(self.chunks[index], key)
+
+    def head(self, count) -> list:
+        result = []
+        for chunk in self.chunks:
+            if len(result) >= count:
+                break
+            result.extend(chunk[:count - len(result)])
+        return result
+
+
+class Leaderboard:
+    """
+    The best value of every player in one category, e.g. the best lap on
+    a track this week.  Lower is better, the values are times in ms.
+    Ties go to whoever got there first, or for values loaded from the
+    database, to the lower playerId.
+    """
+
+    def __init__(self, category: str, topCount: int = 10):
+        self.category = category
+        self.topCount = topCount
+
+        # Keys are (value, arrival order, playerId).
+        self.entries = RankedList()
+        self.playerId2key: Dict[int, tuple] = {}
+        self.counter = 0
+        self.topCache: list = None
+
+        # Players whose best hasn't been written to the database yet.
+        self.dirty: Set[int] = set()
+
+        # Counters for the performance log.
+        self.numResults = 0
+        self.numImproved = 0
+
+    def __len__(self):
+        return len(self.playerId2key)
+
+    def __setKey(self, playerId: int, key: tuple):
+        oldKey = self.playerId2key.get(playerId)
+        if oldKey is not None:
+            self.entries.remove(oldKey)
+        self.entries.insert(key)
+        self.playerId2key[playerId] = key
+
+        topCache = self.topCache
+        if topCache is not None and (len(topCache) < self.topCount or key < topCache[-1]):
+            self.topCache = None
+
+    def addResult(self, playerId: int, value: int) -> bool:
+        """
+        Returns True if value is a new best for the player.
+        """
+        self.numResults += 1
+        oldKey = self.playerId2key.get(playerId)
+        if oldKey is not None and oldKey[0] <= value:
+            return False
+
+        self.counter += 1
+        self.__setKey(playerId, (value, self.counter, playerId))
+        self.dirty.add(playerId)
+        self.numImproved += 1
+        return True
+
+    def load(self, rows):
+        """
+        Merges (playerId, value) rows read back from the database, the
+        better value wins.  Loaded values aren't dirty.
+        """
+        if not self.playerId2key:
+            keys = {}
+            for playerId, value in rows:
+                key = keys.get(playerId)
+                if key is None or value < key[0]:
+                    keys[playerId] = (value, 0, playerId)
+            self.entries = RankedList(keys.values(), self.entries.load)
+            self.playerId2key = keys
+            self.topCache = None
+            return
+
+        for playerId, value in rows:
+            oldKey = self.playerId2key.get(playerId)
+            if oldKey is None or value < oldKey[0]:
+                self.__setKey(playerId, (value, 0, playerId))
+
+    def getValue(self, playerId: int) -> int:
+        key = self.playerId2key.get(playerId)
+        if key is None:
+            return None
+        return key[0]
+
+    def getRank(self, playerId: int) -> int:
+        """
+        1 for the best player, 0 if the player isn't on the board.
+        """
+        key = self.playerId2key.get(playerId)
+        if key is None:
+            return 0
+        return self.entries.rank(key) + 1
+
+    def getTop(self, count: int = None) -> List[tuple]:
+        """
+        The best count (playerId, value) pairs, best first.
+        """
+        if count is None:
+            count = self.topCount
+        if count > self.topCount:
+            return [(key[2], key[0]) for key in self.entries.head(count)]
+
+        if self.topCache is None:
+            self.topCache = self.entries.head(self.topCount)
+        return [(key[2], key[0]) for key in self.topCache[:count]]
+
+    def takeDirty(self) -> Dict[int, int]:
+        """
+        Returns {playerId: value} for the dirty players, and marks them
+        clean.
+        """
+        dirty = self.dirty
+        self.dirty = set()
+        return {playerId: self.playerId2key[playerId][0] for playerId in dirty
+                if playerId in self.playerId2key}
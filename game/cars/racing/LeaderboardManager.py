@@ -0,0 +1,221 @@
+from direct.directnotify.DirectNotifyGlobal import directNotify
+from direct.task import Task
+from typing import Dict, List
+import time
+
+from .Leaderboard import Leaderboard
+
+class LeaderboardManager:
+    """
+    The race leaderboards of the district.  For every track there is a
+    board of each player's best lap and one of their best total time, all
+    time and for the current week and day (leaderboard-periods).  The
+    category of a board is '<track>:<stat>:<period>', e.g.
+    'spRace_rh:bestLap:2026-W42', the same kind of category string the
+    OTP LeaderBoard takes.
+
+    Results are kept in memory.  New bests are written to the Leaderboard
+    collection in batches every leaderboard-flush-period seconds, and the
+    boards of the current periods are read back when the district starts.
+    The writes use $min, so districts sharing the collection keep each
+    other's better values.  A district only sees other districts' results
+    when it loads.
+    """
+    notify = directNotify.newCategory('LeaderboardManager')
+
+    COLLECTION = 'Leaderboard'
+    STATS = ('bestLap', 'totalTime')
+
+    def __init__(self, air):
+        self.air = air
+        self.topCount = config.GetInt('leaderboard-top-count', 10)
+        self.flushPeriod = config.GetFloat('leaderboard-flush-period', 30.0)
+        self.batchSize = config.GetInt('leaderboard-flush-batch-size', 1000)
+        self.periods = config.GetString('leaderboard-periods', 'all weekly daily').split()
+        self.wantPersistence = config.GetBool('want-leaderboard-persistence', 1)
+        # Also send new bests to the OTP LeaderBoard, if there is one.
+        self.wantOtpLeaderboard = config.GetBool('want-otp-leaderboard', 0)
+
+        # category -> Leaderboard
+        self.boards: Dict[str, Leaderboard] = {}
+        self.periodIds: List[str] = self.getPeriodIds()
+        self.playerId2name: Dict[int, str] = {}
+
+        # Counters for the performance log.
+        self.numResults = 0
+        self.numLoaded = 0
+        self.numWritten = 0
+        self.numBatches = 0
+        self.numFailed = 0
+
+    def getTime(self) -> float:
+        return time.time()
+
+    def getPeriodId(self, period: str, now: float) -> str:
+        if period == 'weekly':
+            return time.strftime('%G-W%V', time.gmtime(now))
+        elif period == 'daily':
+            return time.strftime('%Y-%m-%d', time.gmtime(now))
+        return 'all'
+
+    def getPeriodIds(self) -> List[str]:
+        now = self.getTime()
+        return [self.getPeriodId(period, now) for period in self.periods]
+
+    def makeCategory(self, trackName: str, stat: str, periodId: str) -> str:
+        return '%s:%s:%s' % (trackName, stat, periodId)
+
+    def start(self):
+        if self.wantPersistence:
+            self.air.mongoInterface.findAllAsync(self.COLLECTION, {'period': {'$in': self.periodIds}},
+                                                 ['category', 'playerId', 'name', 'value'],
+                                                 callback=self.__handleLoaded)
+        taskMgr.doMethodLater(self.flushPeriod, self.__flushTask,
+                              self.air.uniqueName('leaderboardFlush'))
+
+    def stop(self):
+        taskMgr.remove(self.air.uniqueName('leaderboardFlush'))
+        self.flush()
+
+    def __handleLoaded(self, documents, exception):
+        if exception is not None:
+            self.notify.warning('Could not load the leaderboards: %s' % exception)
+            return
+
+        category2rows: Dict[str, list] = {}
+        for document in documents:
+            category = document['category']
+            if category.rsplit(':', 1)[-1] not in self.periodIds:
+                # The period has ended while we were loading.
+                continue
+            category2rows.setdefault(category, []).append((document['playerId'], document['value']))
+            if document.get('name'):
+                self.playerId2name.setdefault(document['playerId'], document['name'])
+
+        for category, rows in list(category2rows.items()):
+            self.getBoard(category).load(rows)
+            self.numLoaded += len(rows)
+        self.notify.info('Loaded %s results into %s leaderboards.' % (self.numLoaded, len(category2rows)))
+
+    def getBoard(self, category: str) -> Leaderboard:
+        board = self.boards.get(category)
+        if board is None:
+            board = Leaderboard(category, self.topCount)
+            self.boards[category] = board
+        return board
+
+    def recordResult(self, trackName: str, playerId: int, name: str, bestLapTime: int, totalTime: int):
+        """
+        Called by the race when a player finishes.
+        """
+        self.numResults += 1
+        if name:
+            self.playerId2name[playerId] = name
+
+        for stat, value in ((self.STATS[0], bestLapTime), (self.STATS[1], totalTime)):
+            if value <= 0:
+                continue
+            for periodId in self.periodIds:
+                category = self.makeCategory(trackName, stat, periodId)
+                if self.getBoard(category).addResult(playerId, value) and self.wantOtpLeaderboard:
+                    self.air.setLeaderboardValue(category, playerId, name, value)
+
+    def __flushTask(self, task):
+        self.flush()
+
+        periodIds = self.getPeriodIds()
+        if periodIds != self.periodIds:
+            # A day or week is over, its boards are written out by now.
+            self.periodIds = periodIds
+            for category in list(self.boards):
+                if category.rsplit(':', 1)[-1] not in periodIds:
+                    del self.boards[category]
+
+        return Task.again
+
+    def flush(self):
+        """
+        Writes the new bests of every board, batchSize per bulk write.
+        """
+        if not self.wantPersistence:
+            for board in self.boards.values():
+                board.dirty.clear()
+            return
+
+        documents = {}
+        for category, board in list(self.boards.items()):
+            period = category.rsplit(':', 1)[-1]
+            for playerId, value in list(board.takeDirty().items()):
+                documents['%s:%s' % (category, playerId)] = {
+                    'category': category,
+                    'period': period,
+                    'playerId': playerId,
+                    'name': self.playerId2name.get(playerId, ''),
+                    'value': value}
+                if len(documents) >= self.batchSize:
+                    self.__writeBatch(documents)
+                    documents = {}
+        if documents:
+            self.__writeBatch(documents)
+
+    def __writeBatch(self, documents: dict):
+        self.numBatches += 1
+
+        def callback(result, exception):
+            if exception is None:
+                self.numWritten += len(documents)
+                return
+            # Try them again with the next flush.
+            self.numFailed += len(documents)
+            for document in list(documents.values()):
+                board = self.boards.get(document['category'])
+                if board and board.getValue(document['playerId']) is not None:
+                    board.dirty.add(document['playerId'])
+
+        self.air.mongoInterface.updateMinimumsAsync(self.COLLECTION, documents, 'value', callback=callback)
+
+    def getRank(self, category: str, playerId: int) -> int:
+        board = self.boards.get(category)
+        if board is None:
+            return 0
+        return board.getRank(playerId)
+
+    def getTopTen(self, category: str) -> list:
+        """
+        The best of the board as leaderBoardRecord structs, like
+        LeaderBoard.getTopTen answers.
+        """
+        board = self.boards.get(category)
+        if board is None:
+            return []
+        return [[playerId, self.playerId2name.get(playerId, ''), value]
+                for playerId, value in board.getTop()]
+
+    def getValues(self, category: str, playerIds: List[int]) -> list:
+        # As leaderBoardRecordResponces, like LeaderBoard.getValues.
+        board = self.boards.get(category)
+        records = []
+        for playerId in playerIds:
+            value = board.getValue(playerId) if board else None
+            if value is None:
+                records.append([0, playerId, '', 0])
+            else:
+                records.append([1, playerId, self.playerId2name.get(playerId, ''), value])
+        return records
+
+    def getTopTenRespondTo(self, category: str, doId: int):
+        # Answers a LeaderBoardReceiver, e.g. the GuildManager.
+        self.air.sendUpdateToDoId('LeaderBoardReceiver', 'getTopTenResponce', doId,
+                                  [category, self.getTopTen(category)])
+
+    def getValuesRespondTo(self, category: str, playerIds: List[int], doId: int):
+        self.air.sendUpdateToDoId('LeaderBoardReceiver', 'getValuesResponce', doId,
+                                  [category, self.getValues(category, playerIds)])
+
+    def getStatsString(self):
+        entries = sum(len(board) for board in self.boards.values())
+        dirty = sum(len(board.dirty) for board in self.boards.values())
+        return ('leaderboards: %s boards, %s entries, %s results, %s loaded, %s dirty, '
+                '%s written in %s batches, %s failed' % (
+            len(self.boards), entries, self.numResults, self.numLoaded, dirty,
+            self.numWritten, self.numBatches, self.numFailed))
@@ -0,0 +1,108 @@
+from direct.directnotify.DirectNotifyGlobal import directNotify
+from direct.task.Task import Task
+from typing import Dict
+
+class RaceClock:
+    """
+    District-wide clock for running races.  Races read their times from
+    here on demand instead of running timer tasks of their own, and a
+    single task sends the place updates of every race at each race's own
+    cadence.  The task only runs while there are races to update.
+
+    It is also the output stage of the races: what a race sends during a
+    frame is queued on the race and goes out at the end of the frame,
+    with want-race-message-bundles as one message bundle per race (see
+    DistributedRaceAI.flushOutput).  Bundles are off by default, as it
+    hasn't been checked that otpgo handles message bundles.
+    """
+    notify = directNotify.newCategory("RaceClock")
+
+    # Run after the reader poll and the game tasks of the frame.
+    OutputSort = 40
+
+    def __init__(self, air):
+        self.air = air
+        self.tickPeriod = config.GetFloat('race-clock-tick-period', 0.1)
+        self.wantBundles = config.GetBool('want-race-message-bundles', 0)
+
+        # race doId -> [race, place update period, next place update time]
+        self.races: Dict[int, list] = {}
+        # race doId -> race, for the races with output waiting.
+        self.outputRaces: Dict[int, object] = {}
+
+        # Counters for the performance log.
+        self.numMessages = 0
+        self.numBytes = 0
+        self.numBundles = 0
+        self.numPlacesSent = 0
+        self.numPlacesSkipped = 0
+        self.numRacesDone = 0
+        self.doneMessages = 0
+        self.doneBytes = 0
+
+    def getTime(self) -> float:
+        return globalClock.getFrameTime()
+
+    def getElapsedMs(self, startTime: float) -> int:
+        return int((self.getTime() - startTime) * 1000)
+
+    def addRace(self, race, placeUpdatePeriod: float = 1.0):
+        self.races[race.doId] = [race, placeUpdatePeriod, self.getTime() + placeUpdatePeriod]
+
+        taskName = self.air.uniqueName('raceClock')
+        if not taskMgr.hasTaskNamed(taskName):
+            taskMgr.doMethodLater(self.tickPeriod, self.__tick, taskName)
+
+    def removeRace(self, race):
+        self.races.pop(race.doId, None)
+        if not self.races:
+            taskMgr.remove(self.air.uniqueName('raceClock'))
+
+    def raceDone(self, race):
+        # The race is being deleted, and has sent what it had queued.
+        self.removeRace(race)
+        self.outputRaces.pop(race.doId, None)
+        self.numRacesDone += 1
+        self.doneMessages += race.numMessages
+        self.doneBytes += race.numBytes
+
+    def __tick(self, task: Task):
+        now = self.getTime()
+        for entry in list(self.races.values()):
+            race, period, nextUpdate = entry
+            if now >= nextUpdate:
+                # Keep the cadence even if this tick was late.
+                entry[2] = max(nextUpdate + period, now)
+                race.sendPlaces()
+
+        if not self.races:
+            return task.done
+        return task.again
+
+    def queueOutput(self, race):
+        if race.doId in self.outputRaces:
+            return
+        self.outputRaces[race.doId] = race
+        if len(self.outputRaces) == 1:
+            taskMgr.add(self.__outputTask, self.air.uniqueName('raceOutput'),
+                        sort=self.OutputSort)
+
+    def __outputTask(self, task):
+        self.flushOutput()
+        return task.done
+
+    def flushOutput(self):
+        races = list(self.outputRaces.values())
+        self.outputRaces = {}
+        for race in races:
+            race.flushOutput()
+
+    def getStatsString(self):
+        messagesPerRace = bytesPerRace = 0.0
+        if self.numRacesDone:
+            messagesPerRace = float(self.doneMessages) / self.numRacesDone
+            bytesPerRace = float(self.doneBytes) / self.numRacesDone
+        return ('races: %s running, %s messages (%s bytes) in %s bundles, places sent %s, unchanged %s, '
+                '%.1f messages (%.0f bytes) per finished race' % (
+            len(self.races), self.numMessages, self.numBytes, self.numBundles,
+            self.numPlacesSent, self.numPlacesSkipped, messagesPerRace, bytesPerRace))
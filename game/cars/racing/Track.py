@@ -14,20 +14,12 @@ class Track():
         self.startingTrackSegment: int = 1
         self.totalLaps: int = 3
 
-        # Parse physics file.
-        self.notify.info(f"Parsing physics file: {physicsFile}")
-        tree = ET.parse(f"physics/{physicsFile}") # Assuming a symbolic link was placed to the physics xml files there.
-        segments = tree.getroot()[0]
-
-        for segment in segments:
-            data = segment.attrib
+        for segmentId, segmentType, parentIds, childrenIds in self.loadSegmentData(physicsFile):
             segment = TrackSegment()
-            segment.id = int(data['id'])
-            segment.type = int(data['type'])
-            for parentId in data['parents'].split(','):
-                segment.parentIds.append(int(parentId))
-            for childrenId in data['children'].split(','):
-                segment.childrenIds.append(int(childrenId))
+            segment.id = segmentId
+            segment.type = segmentType
+            segment.parentIds = parentIds
+            segment.childrenIds = childrenIds
             self.segments.append(segment)
             self.segmentById[segment.id] = segment
 
@@ -48,3 +40,84 @@ class Track():
                     continue
                 segment.children.append(children)
                 segment.childrenById[childrenId] = children
+
+        self.computeSegmentProgress()
+
+        # Tracks are shared between lobbies and races, nothing changes them
+        # from now on.
+        for segment in self.segments:
+            segment.freeze()
+
+    def computeSegmentProgress(self):
+        """
+        Computes TrackSegment.progress for every segment.  The segment graph
+        without the edges going back to the starting segment is walked in
+        topological order; a segment's progress is its longest distance
+        from the start divided by the length of the longest lap through
+        it, so segments on branches of different length still compare
+        correctly.
+        """
+        start = self.segmentById.get(self.startingTrackSegment)
+        if not start:
+            self.notify.warning(f'Starting segment {self.startingTrackSegment} missing!')
+            return
+
+        def forwardChildren(segment):
+            return [child for child in segment.children if child is not start]
+
+        # Kahn's algorithm over the forward edges.
+        inDegree: Dict[int, int] = {segment.id: 0 for segment in self.segments}
+        for segment in self.segments:
+            for child in forwardChildren(segment):
+                inDegree[child.id] += 1
+
+        order: List[TrackSegment] = [segment for segment in self.segments if inDegree[segment.id] == 0]
+        index = 0
+        while index < len(order):
+            for child in forwardChildren(order[index]):
+                inDegree[child.id] -= 1
+                if inDegree[child.id] == 0:
+                    order.append(child)
+            index += 1
+
+        if len(order) != len(self.segments):
+            # There is a loop that does not go through the start. Those
+            # segments are ordered by id, which is the best we can do.
+            self.notify.warning(f'Track {self.name} has {len(self.segments) - len(order)} segments in a loop!')
+            ordered = set(order)
+            order.extend(sorted((segment for segment in self.segments if segment not in ordered),
+                                key=lambda segment: segment.id))
+
+        distanceFromStart: Dict[int, int] = {segment.id: 0 for segment in self.segments}
+        for segment in order:
+            for child in forwardChildren(segment):
+                distanceFromStart[child.id] = max(distanceFromStart[child.id], distanceFromStart[segment.id] + 1)
+
+        distanceToEnd: Dict[int, int] = {segment.id: 0 for segment in self.segments}
+        for segment in reversed(order):
+            for child in forwardChildren(segment):
+                distanceToEnd[segment.id] = max(distanceToEnd[segment.id], distanceToEnd[child.id] + 1)
+
+        for segment in self.segments:
+            lapLength = distanceFromStart[segment.id] + distanceToEnd[segment.id]
+            if lapLength:
+                segment.progress = distanceFromStart[segment.id] / lapLength
+            else:
+                segment.progress = 0.0
+
+    def loadSegmentData(self, physicsFile) -> List[tuple]:
+        """
+        Returns (id, type, parentIds, childrenIds) for every segment of the
+        physics file.
+        """
+        # Parse physics file.
+        self.notify.info(f"Parsing physics file: {physicsFile}")
+        tree = ET.parse(f"physics/{physicsFile}") # Assuming a symbolic link was placed to the physics xml files there.
+        segmentData = []
+        for segment in tree.getroot()[0]:
+            data = segment.attrib
+            segmentData.append((int(data['id']),
+                                int(data['type']),
+                                tuple(int(parentId) for parentId in data['parents'].split(',')),
+                                tuple(int(childrenId) for childrenId in data['children'].split(','))))
+        return segmentData
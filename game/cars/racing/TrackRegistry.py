@@ -0,0 +1,23 @@
+from direct.directnotify.DirectNotifyGlobal import directNotify
+
+from .Track import Track
+from typing import Dict, Tuple
+
+class TrackRegistry:
+    """
+    Builds each Track once per process and hands the same instance to
+    every lobby and race that uses it.  Tracks must not be modified once
+    they are registered.
+    """
+    notify = directNotify.newCategory("TrackRegistry")
+
+    tracks: Dict[Tuple[str, str], Track] = {}
+
+    @classmethod
+    def getTrack(cls, name, physicsFile) -> Track:
+        key = (name, physicsFile)
+        track = cls.tracks.get(key)
+        if track is None:
+            track = Track(name, physicsFile)
+            cls.tracks[key] = track
+        return track
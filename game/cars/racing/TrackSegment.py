@@ -8,6 +8,9 @@ class SegmentType(IntEnum):
     DEFAULT = 5
 
 class TrackSegment():
+    __slots__ = ('id', 'type', 'parents', 'parentIds', 'parentById',
+                 'children', 'childrenIds', 'childrenById', 'progress')
+
     def __init__(self):
         self.id: int = 0
         self.type: SegmentType = SegmentType.DEFAULT_TYPE
@@ -19,3 +22,15 @@ class TrackSegment():
         self.children: List[TrackSegment] = []
         self.childrenIds: List[int] = []
         self.childrenById: Dict[int, TrackSegment] = {}
+
+        # How far along the lap this segment is, from 0 (starting segment)
+        # to 1 (last segment before the start).  Computed by Track.
+        self.progress: float = 0.0
+
+    def freeze(self):
+        # Lists become tuples once the track is built; they take less
+        # memory and make it clear the segment is shared.
+        self.parents = tuple(self.parents)
+        self.parentIds = tuple(self.parentIds)
+        self.children = tuple(self.children)
+        self.childrenIds = tuple(self.childrenIds)
@@ -1,4 +1,5 @@
 from direct.distributed.DistributedObjectAI import DistributedObjectAI
+from game.cars.zone.SpatialGrid import SpatialGrid
 
 class DistributedZoneAI(DistributedObjectAI):
     def __init__(self, air, name, mapId):
@@ -7,8 +8,11 @@ class DistributedZoneAI(DistributedObjectAI):
         self.mapId = mapId
         self.catalogItemId = mapId
         self.interactiveObjects = []
-        self.playersInZone = []
+        # The last player count we sent, see updatePlayerCount.
+        self.playerCount = 0
         self.mute = 0
+        # Where the cars in this zone are, fed by the TelemetryManager.
+        self.spatialGrid = SpatialGrid(config.GetInt('zone-spatial-cell-size', 100))
 
     def getName(self):
         return self.name
@@ -25,8 +29,34 @@ class DistributedZoneAI(DistributedObjectAI):
     def updateObjectCount(self):
         self.sendUpdate('setInteractiveObjectCount', [self.getInteractiveObjectCount()])
 
+    def getPlayersInZone(self):
+        return self.air.zoneMembership.getAvatarsInZone(self.doId)
+
     def getPlayerCount(self):
-        return len(self.playersInZone)
+        return self.air.zoneMembership.getZonePopulation(self.doId)
+
+    def updatePlayerCount(self):
+        # Called by ZoneMembership, returns whether the count was sent.
+        playerCount = self.getPlayerCount()
+        if playerCount == self.playerCount:
+            return False
+
+        self.playerCount = playerCount
+        self.sendUpdate('setPlayerCount', [playerCount])
+        return True
 
     def getMute(self):
         return self.mute
+
+    def getCarsInRadius(self, x, y, radius, exclude=None):
+        return self.spatialGrid.queryRadius(x, y, radius, exclude)
+
+    def getNearestCars(self, x, y, k, maxRadius=None, exclude=None):
+        return self.spatialGrid.queryNearest(x, y, k, maxRadius, exclude)
+
+    def getCarsNear(self, doId, radius):
+        # Returns the other cars within radius of the indicated one.
+        position = self.spatialGrid.getPosition(doId)
+        if position is None:
+            return []
+        return self.spatialGrid.queryRadius(position[0], position[1], radius, exclude=doId)
@@ -0,0 +1,179 @@
+import heapq
+import math
+
+class SpatialGrid:
+    """
+    Uniform grid over the positions of the cars in one zone, so proximity
+    questions only look at the cells around the point of interest instead
+    of at every car.  Moving a car only touches the grid when it crosses
+    into another cell.
+
+    Queries are in the x/y plane; z is kept for whoever needs it.
+    """
+
+    def __init__(self, cellSize=100):
+        self.cellSize = cellSize
+        # (cellX, cellY) -> set of doIds
+        self.cells = {}
+        # doId -> [x, y, z, cell]
+        self.positions = {}
+        # (minCellX, minCellY, maxCellX, maxCellY) of the occupied cells,
+        # worked out again when cells come or go.
+        self.bounds = None
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __contains__(self, doId):
+        return doId in self.positions
+
+    def getCell(self, x, y):
+        return (int(x // self.cellSize), int(y // self.cellSize))
+
+    def update(self, doId, x, y, z=0):
+        cell = (int(x // self.cellSize), int(y // self.cellSize))
+        position = self.positions.get(doId)
+        if position is None:
+            self.positions[doId] = [x, y, z, cell]
+            self.__addToCell(doId, cell)
+            return
+
+        position[0] = x
+        position[1] = y
+        position[2] = z
+        if position[3] != cell:
+            self.__removeFromCell(doId, position[3])
+            self.__addToCell(doId, cell)
+            position[3] = cell
+
+    def remove(self, doId):
+        position = self.positions.pop(doId, None)
+        if position is not None:
+            self.__removeFromCell(doId, position[3])
+
+    def getPosition(self, doId):
+        """
+        Returns (x, y, z), or None if the car isn't in the grid.
+        """
+        position = self.positions.get(doId)
+        if position is None:
+            return None
+        return tuple(position[:3])
+
+    def __addToCell(self, doId, cell):
+        members = self.cells.get(cell)
+        if members is None:
+            self.cells[cell] = {doId}
+            self.bounds = None
+        else:
+            members.add(doId)
+
+    def __removeFromCell(self, doId, cell):
+        members = self.cells[cell]
+        members.discard(doId)
+        if not members:
+            del self.cells[cell]
+            self.bounds = None
+
+    def getBounds(self):
+        if self.bounds is None and self.cells:
+            cellXs = [cell[0] for cell in self.cells]
+            cellYs = [cell[1] for cell in self.cells]
+            self.bounds = (min(cellXs), min(cellYs), max(cellXs), max(cellYs))
+        return self.bounds
+
+    def queryRadius(self, x, y, radius, exclude=None):
+        """
+        Returns the doIds of the cars within radius of (x, y).
+        """
+        cellSize = self.cellSize
+        minX = int((x - radius) // cellSize)
+        maxX = int((x + radius) // cellSize)
+        minY = int((y - radius) // cellSize)
+        maxY = int((y + radius) // cellSize)
+        radiusSquared = radius * radius
+
+        result = []
+        if (maxX - minX + 1) * (maxY - minY + 1) > len(self.cells):
+            # The circle covers more cells than are occupied.
+            cellItems = [(cell, members) for cell, members in self.cells.items()
+                         if minX <= cell[0] <= maxX and minY <= cell[1] <= maxY]
+        else:
+            cellItems = []
+            for cellX in range(minX, maxX + 1):
+                for cellY in range(minY, maxY + 1):
+                    members = self.cells.get((cellX, cellY))
+                    if members:
+                        cellItems.append(((cellX, cellY), members))
+
+        positions = self.positions
+        for cell, members in cellItems:
+            for doId in members:
+                position = positions[doId]
+                dx = position[0] - x
+                dy = position[1] - y
+                if dx * dx + dy * dy <= radiusSquared and doId != exclude:
+                    result.append(doId)
+
+        return result
+
+    def queryNearest(self, x, y, k, maxRadius=None, exclude=None):
+        """
+        Returns up to k (distance, doId) tuples of the cars nearest to
+        (x, y), nearest first.  Searches rings of cells outwards from the
+        cell of (x, y) until the ring is further away than the k-th
+        nearest car found so far.
+        """
+        if k <= 0 or not self.positions:
+            return []
+
+        cellSize = self.cellSize
+        centerX, centerY = self.getCell(x, y)
+        # Enough rings to reach every occupied cell.
+        minX, minY, maxX, maxY = self.getBounds()
+        maxRing = max(centerX - minX, maxX - centerX, centerY - minY, maxY - centerY, 0)
+        if maxRadius is not None:
+            maxRing = min(maxRing, int(maxRadius // cellSize) + 1)
+
+        positions = self.positions
+        # Max heap of the k nearest so far, as (-distanceSquared, doId).
+        nearest = []
+        for ring in range(maxRing + 1):
+            if len(nearest) == k:
+                # Every car in this ring is at least this far away.
+                ringDistance = (ring - 1) * cellSize
+                if ringDistance * ringDistance > -nearest[0][0]:
+                    break
+
+            for cell in self.__ringCells(centerX, centerY, ring):
+                members = self.cells.get(cell)
+                if not members:
+                    continue
+                for doId in members:
+                    if doId == exclude:
+                        continue
+                    position = positions[doId]
+                    dx = position[0] - x
+                    dy = position[1] - y
+                    distanceSquared = dx * dx + dy * dy
+                    if len(nearest) < k:
+                        heapq.heappush(nearest, (-distanceSquared, doId))
+                    elif distanceSquared < -nearest[0][0]:
+                        heapq.heapreplace(nearest, (-distanceSquared, doId))
+
+        result = sorted((math.sqrt(-negDistanceSquared), doId) for negDistanceSquared, doId in nearest)
+        if maxRadius is not None:
+            result = [entry for entry in result if entry[0] <= maxRadius]
+        return result
+
+    def __ringCells(self, centerX, centerY, ring):
+        if ring == 0:
+            yield (centerX, centerY)
+            return
+
+        for cellX in range(centerX - ring, centerX + ring + 1):
+            yield (cellX, centerY - ring)
+            yield (cellX, centerY + ring)
+        for cellY in range(centerY - ring + 1, centerY + ring):
+            yield (centerX - ring, cellY)
+            yield (centerX + ring, cellY)
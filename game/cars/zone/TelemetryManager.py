@@ -0,0 +1,152 @@
+from pandac.PandaModules import *
+from game.cars.ai.CarsAIMsgTypes import *
+from direct.directnotify.DirectNotifyGlobal import directNotify
+from direct.distributed.PyDatagram import PyDatagram
+from direct.task import Task
+from game.cars.zone.TelemetryZone import TelemetryZone, NUM_TIERS
+from game.cars.zone.DistributedZoneAI import DistributedZoneAI
+import struct
+
+# Wire format of setTelemetry(int16 x7, int32).
+TelemetryStruct = struct.Struct('<7hi')
+
+# A server header can address at most this many channels.
+MaxChannelsPerDatagram = 255
+
+class TelemetryManager:
+    """
+    Takes in the setTelemetry updates of the cars on this district and
+    keeps the latest one of every car in a TelemetryZone per zone.  The
+    positions also go to the spatial grid of the DistributedZoneAI the car
+    is in, if any.
+
+    With want-telemetry-rebroadcast, the AI also decides who gets to see
+    which update: cars near the sender get every update, cars further
+    away get one every few ticks (see TelemetryZone.planRebroadcast).
+    Every due update goes out as one datagram addressed to the puppet
+    channels of all its recipients.  This only saves anything when the
+    state server isn't broadcasting setTelemetry itself, so it is meant to
+    be used with a cars.dc where setTelemetry isn't broadcast.
+    """
+    notify = directNotify.newCategory('TelemetryManager')
+
+    def __init__(self, air):
+        self.air = air
+        self.wantRebroadcast = config.GetBool('want-telemetry-rebroadcast', 0)
+        self.rebroadcastPeriod = config.GetFloat('telemetry-rebroadcast-period', 0.1)
+        self.cellSize = config.GetInt('telemetry-near-distance', 250)
+        self.midCells = max(1, config.GetInt('telemetry-mid-distance', 1000) // self.cellSize)
+        self.midPeriod = config.GetInt('telemetry-mid-period', 2)
+        self.farPeriod = config.GetInt('telemetry-far-period', 5)
+
+        # zoneId -> TelemetryZone
+        self.zones = {}
+        # doId -> TelemetryZone
+        self.doId2zone = {}
+        self.tick = 0
+        self.fieldNumber = None
+
+        # Counters for the performance log.
+        self.numReceived = 0
+        self.numDatagrams = 0
+        self.numDelivered = 0
+        self.numDeliveredByTier = [0] * NUM_TIERS
+        # What the state server would have delivered if it broadcast them.
+        self.numBroadcastEquivalent = 0
+
+    def start(self):
+        if self.wantRebroadcast:
+            taskMgr.doMethodLater(self.rebroadcastPeriod, self.__rebroadcast,
+                                  self.air.uniqueName('telemetryRebroadcast'))
+
+    def stop(self):
+        taskMgr.remove(self.air.uniqueName('telemetryRebroadcast'))
+
+    def getZone(self, zoneId):
+        return self.zones.get(zoneId)
+
+    def getTelemetry(self, doId):
+        zone = self.doId2zone.get(doId)
+        if zone:
+            return zone.getTelemetry(doId)
+        return None
+
+    def handleTelemetry(self, av, values, timestamp):
+        self.numReceived += 1
+
+        zone = self.doId2zone.get(av.doId)
+        if zone is None or zone.zoneId != av.zoneId:
+            if zone:
+                self.removeAvatar(av.doId)
+            zone = self.zones.get(av.zoneId)
+            if zone is None:
+                zone = TelemetryZone(av.zoneId, self.cellSize, self.midCells,
+                                     self.midPeriod, self.farPeriod)
+                self.zones[av.zoneId] = zone
+            self.doId2zone[av.doId] = zone
+
+        zone.update(av.doId, values, timestamp)
+        self.numBroadcastEquivalent += len(zone) - 1
+
+        zoneObject = self.air.doId2do.get(av.zoneId)
+        if isinstance(zoneObject, DistributedZoneAI):
+            # The third value seems to be the height.
+            zoneObject.spatialGrid.update(av.doId, values[0], values[1], values[2])
+
+    def removeAvatar(self, doId):
+        zone = self.doId2zone.pop(doId, None)
+        if zone is None:
+            return
+
+        zone.remove(doId)
+        if not zone:
+            del self.zones[zone.zoneId]
+
+        zoneObject = self.air.doId2do.get(zone.zoneId)
+        if isinstance(zoneObject, DistributedZoneAI):
+            zoneObject.spatialGrid.remove(doId)
+
+    def __rebroadcast(self, task):
+        self.tick += 1
+        for zone in list(self.zones.values()):
+            plan = zone.planRebroadcast(self.tick)
+            for doId, tier, recipients in plan:
+                self.sendTelemetry(zone, doId, recipients)
+                self.numDeliveredByTier[tier] += len(recipients)
+
+        return Task.again
+
+    def sendTelemetry(self, zone, doId, recipients):
+        if self.fieldNumber is None:
+            dclass = self.air.dclassesByName['DistributedCarAvatar']
+            self.fieldNumber = dclass.getFieldByName('setTelemetry').getNumber()
+
+        values, timestamp = zone.getTelemetry(doId)
+        payload = TelemetryStruct.pack(*values, timestamp)
+        for i in range(0, len(recipients), MaxChannelsPerDatagram):
+            channels = recipients[i:i + MaxChannelsPerDatagram]
+            dg = PyDatagram()
+            dg.addUint8(len(channels))
+            for avId in channels:
+                # The puppet channel, like sendUpdateToAvatarId.
+                dg.addChannel((1 << 32) + avId)
+            dg.addChannel(self.air.ourChannel)
+            dg.addUint16(STATESERVER_OBJECT_UPDATE_FIELD)
+            dg.addUint32(doId)
+            dg.addUint16(self.fieldNumber)
+            dg.appendData(payload)
+            self.air.send(dg)
+            self.numDatagrams += 1
+
+        self.numDelivered += len(recipients)
+
+    def getStatsString(self):
+        numCars = len(self.doId2zone)
+        stats = 'telemetry: %s cars in %s zones, %s updates received' % (
+            numCars, len(self.zones), self.numReceived)
+        if self.wantRebroadcast:
+            stats += ', %s datagrams sent, %s delivered (near/mid/far %s, %s if broadcast)' % (
+                self.numDatagrams, self.numDelivered,
+                '/'.join(str(count) for count in self.numDeliveredByTier),
+                self.numBroadcastEquivalent)
+        return stats
@@ -0,0 +1,155 @@
+from array import array
+
+# Rebroadcast tiers, nearest first.
+NEAR = 0
+MID = 1
+FAR = 2
+NUM_TIERS = 3
+
+class TelemetryZone:
+    """
+    The latest setTelemetry of every car in one zone, kept in flat arrays
+    indexed by slot instead of one object per car.  Removing a car moves
+    the last slot into its place, so the arrays never have holes.
+    """
+    # The int16 arguments of setTelemetry; the int32 timestamp is kept apart.
+    NumValues = 7
+
+    def __init__(self, zoneId, cellSize=250, midCells=4, midPeriod=2, farPeriod=5):
+        self.zoneId = zoneId
+        self.cellSize = cellSize
+        self.midCells = midCells
+        self.midPeriod = midPeriod
+        self.farPeriod = farPeriod
+
+        self.doIds = []
+        self.doId2slot = {}
+        # x, y, unk0, unk1, unk2, angle, unk3 of every slot.
+        self.values = array('h')
+        self.timestamps = array('i')
+        # Bumped on every update, and the value last rebroadcast per tier.
+        self.seqs = array('I')
+        self.sentSeqs = array('I')
+
+    def __len__(self):
+        return len(self.doIds)
+
+    def update(self, doId, values, timestamp):
+        slot = self.doId2slot.get(doId)
+        if slot is None:
+            slot = len(self.doIds)
+            self.doIds.append(doId)
+            self.doId2slot[doId] = slot
+            self.values.extend(values)
+            self.timestamps.append(timestamp)
+            self.seqs.append(1)
+            self.sentSeqs.extend((0,) * NUM_TIERS)
+            return
+
+        index = slot * self.NumValues
+        self.values[index:index + self.NumValues] = array('h', values)
+        self.timestamps[slot] = timestamp
+        self.seqs[slot] = (self.seqs[slot] + 1) & 0xffffffff
+
+    def remove(self, doId):
+        slot = self.doId2slot.pop(doId, None)
+        if slot is None:
+            return
+
+        last = len(self.doIds) - 1
+        if slot != last:
+            lastDoId = self.doIds[last]
+            self.doIds[slot] = lastDoId
+            self.doId2slot[lastDoId] = slot
+            index = slot * self.NumValues
+            lastIndex = last * self.NumValues
+            self.values[index:index + self.NumValues] = self.values[lastIndex:lastIndex + self.NumValues]
+            self.timestamps[slot] = self.timestamps[last]
+            self.seqs[slot] = self.seqs[last]
+            self.sentSeqs[slot * NUM_TIERS:(slot + 1) * NUM_TIERS] = \
+                self.sentSeqs[last * NUM_TIERS:(last + 1) * NUM_TIERS]
+
+        self.doIds.pop()
+        del self.values[last * self.NumValues:]
+        self.timestamps.pop()
+        self.seqs.pop()
+        del self.sentSeqs[last * NUM_TIERS:]
+
+    def getTelemetry(self, doId):
+        """
+        Returns the latest (values, timestamp) of the car, or None.
+        """
+        slot = self.doId2slot.get(doId)
+        if slot is None:
+            return None
+        index = slot * self.NumValues
+        return tuple(self.values[index:index + self.NumValues]), self.timestamps[slot]
+
+    def getPosition(self, doId):
+        slot = self.doId2slot.get(doId)
+        if slot is None:
+            return None
+        index = slot * self.NumValues
+        return self.values[index], self.values[index + 1]
+
+    def planRebroadcast(self, tick):
+        """
+        Works out which updates are due on this tick.  Returns a list of
+        (doId, tier, recipient doIds).
+
+        Cars are bucketed into square cells of cellSize.  Cars in the same
+        or a neighbouring cell are NEAR and get every new update, cars up
+        to midCells cells away are MID and get the latest update every
+        midPeriod ticks, everybody else is FAR and gets it every farPeriod
+        ticks.  The decimated tiers are staggered by slot so they don't
+        all fall on the same tick.
+        """
+        numValues = self.NumValues
+        cellSize = self.cellSize
+        values = self.values
+
+        cells = {}
+        slotCells = []
+        for slot in range(len(self.doIds)):
+            index = slot * numValues
+            cell = (values[index] // cellSize, values[index + 1] // cellSize)
+            slotCells.append(cell)
+            members = cells.get(cell)
+            if members is None:
+                cells[cell] = [slot]
+            else:
+                members.append(slot)
+        cellItems = list(cells.items())
+
+        plan = []
+        for slot, (cx, cy) in enumerate(slotCells):
+            seq = self.seqs[slot]
+            base = slot * NUM_TIERS
+            due = [self.sentSeqs[base + NEAR] != seq,
+                   (tick + slot) % self.midPeriod == 0 and self.sentSeqs[base + MID] != seq,
+                   (tick + slot) % self.farPeriod == 0 and self.sentSeqs[base + FAR] != seq]
+            if not (due[NEAR] or due[MID] or due[FAR]):
+                continue
+
+            recipients = [[], [], []]
+            for (x, y), members in cellItems:
+                distance = max(abs(x - cx), abs(y - cy))
+                if distance <= 1:
+                    tier = NEAR
+                elif distance <= self.midCells:
+                    tier = MID
+                else:
+                    tier = FAR
+                if due[tier]:
+                    recipients[tier].extend(members)
+
+            doId = self.doIds[slot]
+            for tier in range(NUM_TIERS):
+                if not due[tier]:
+                    continue
+                self.sentSeqs[base + tier] = seq
+                recipientIds = [self.doIds[member] for member in recipients[tier] if member != slot]
+                if recipientIds:
+                    plan.append((doId, tier, recipientIds))
+
+        return plan
@@ -0,0 +1,96 @@
+from direct.directnotify.DirectNotifyGlobal import directNotify
+from direct.task import Task
+
+class ZoneMembership:
+    """
+    Which avatars are in which zone of this district.  The AI repository
+    keeps it up to date from storeObjectLocation and deleteObjectLocation,
+    which every enter, STATESERVER_OBJECT_SET_ZONE and exit goes through,
+    so nobody needs to scan doId2do to find out who is where.
+
+    Zones whose population changed are remembered, and the ones with a
+    DistributedZoneAI get their setPlayerCount sent together every
+    zone-player-count-period seconds rather than on every move.
+    """
+    notify = directNotify.newCategory('ZoneMembership')
+
+    def __init__(self, air):
+        self.air = air
+        self.updatePeriod = config.GetFloat('zone-player-count-period', 2.0)
+
+        # zoneId -> set of avIds
+        self.zoneId2avIds = {}
+        # avId -> zoneId
+        self.avId2zoneId = {}
+        # zoneIds whose population changed since the last update.
+        self.dirtyZoneIds = set()
+
+        # Counters for the performance log.
+        self.numMoves = 0
+        self.numCountUpdates = 0
+
+    def start(self):
+        taskMgr.doMethodLater(self.updatePeriod, self.__updatePlayerCounts,
+                              self.air.uniqueName('zonePlayerCounts'))
+
+    def stop(self):
+        taskMgr.remove(self.air.uniqueName('zonePlayerCounts'))
+
+    def addAvatar(self, avId, zoneId):
+        oldZoneId = self.avId2zoneId.get(avId)
+        if oldZoneId == zoneId:
+            return
+        if oldZoneId is not None:
+            self.removeAvatar(avId, oldZoneId)
+
+        self.avId2zoneId[avId] = zoneId
+        avIds = self.zoneId2avIds.get(zoneId)
+        if avIds is None:
+            self.zoneId2avIds[zoneId] = {avId}
+        else:
+            avIds.add(avId)
+        self.dirtyZoneIds.add(zoneId)
+        self.numMoves += 1
+
+    def removeAvatar(self, avId, zoneId=None):
+        if self.avId2zoneId.get(avId) is None:
+            return
+        if zoneId is not None and self.avId2zoneId[avId] != zoneId:
+            return
+
+        zoneId = self.avId2zoneId.pop(avId)
+        avIds = self.zoneId2avIds[zoneId]
+        avIds.discard(avId)
+        if not avIds:
+            del self.zoneId2avIds[zoneId]
+        self.dirtyZoneIds.add(zoneId)
+
+    def getAvatarsInZone(self, zoneId):
+        return frozenset(self.zoneId2avIds.get(zoneId, ()))
+
+    def getZonePopulation(self, zoneId):
+        return len(self.zoneId2avIds.get(zoneId, ()))
+
+    def getAvatarZoneId(self, avId):
+        return self.avId2zoneId.get(avId)
+
+    def isAvatarInZone(self, avId, zoneId):
+        return self.avId2zoneId.get(avId) == zoneId
+
+    def getZoneIds(self):
+        return list(self.zoneId2avIds.keys())
+
+    def __updatePlayerCounts(self, task):
+        dirtyZoneIds = self.dirtyZoneIds
+        self.dirtyZoneIds = set()
+        for zoneId in dirtyZoneIds:
+            zone = self.air.doId2do.get(zoneId)
+            if zone and hasattr(zone, 'updatePlayerCount'):
+                if zone.updatePlayerCount():
+                    self.numCountUpdates += 1
+
+        return Task.again
+
+    def getStatsString(self):
+        return 'zone membership: %s avatars in %s zones, %s moves, %s player count updates' % (
+            len(self.avId2zoneId), len(self.zoneId2avIds), self.numMoves, self.numCountUpdates)
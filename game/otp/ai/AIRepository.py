@@ -23,6 +23,10 @@ from direct.showbase.GarbageReportScheduler import GarbageReportScheduler
 from game.otp.avatar.DistributedPlayerAI import DistributedPlayerAI
 from game.otp.distributed import OtpDoGlobals
 from game.otp.ai.GarbageLeakServerEventAggregatorAI import GarbageLeakServerEventAggregatorAI
+from game.otp.ai.MessageProfiler import MessageProfiler
+from game.otp.ai.ServerEventLogger import ServerEventLogger
+from game.otp.ai.FieldRateLimiter import FieldRateLimiter
+from game.otp.ai.ChannelAllocator import ChannelAllocator
 import time
 import gc
 
@@ -88,6 +92,10 @@ class AIRepository(ConnectionRepository):
 
         self.notify.info("event server at %s." % (repr(self.esurl)))
 
+        # Messages added with addPostSocketClose, kept so they can be
+        # restored by setTransientPostSocketClose.
+        self._postSocketCloseMsgs = []
+
         # UDP socket for sending events to the event server.
         self.udpSock = None
 
@@ -99,6 +107,11 @@ class AIRepository(ConnectionRepository):
             self.udpSock = SocketUDPOutgoing()
             self.udpSock.InitToAddress(udpEventServer)
 
+        # Samples, rate limits and sends the server events.
+        self.eventLogger = None
+        if self.udpSock:
+            self.eventLogger = ServerEventLogger(self)
+
         # Save the ranges of channels that the AI controls
         self.minChannel = minChannel
         self.maxChannel = maxChannel
@@ -106,8 +119,12 @@ class AIRepository(ConnectionRepository):
             minChannel, maxChannel, maxChannel - minChannel + 1))
         assert maxChannel >= minChannel
 
-        # initialize the channel allocation
-        self.channelAllocator = UniqueIdAllocator(minChannel, maxChannel)
+        # initialize the channel allocation.  Freed channels aren't reused
+        # until they have been free for channel-reuse-cooldown seconds.
+        self.channelAllocator = ChannelAllocator(
+            minChannel, maxChannel, config.GetFloat('channel-reuse-cooldown', 60.0))
+        self.channelWarningFraction = config.GetFloat('channel-warning-fraction', 0.95)
+        self.channelWarned = False
 
         # Define the ranges of zones.
         self.minZone = self.getMinDynamicZone()
@@ -173,6 +190,15 @@ class AIRepository(ConnectionRepository):
 
         self.garbageLeakLogger = GarbageLeakServerEventAggregatorAI(self)
 
+        # Times message and field handlers while set; see MessageProfiler.
+        self.messageProfiler = None
+        if config.GetBool('want-message-profiler', 0):
+            self.messageProfiler = MessageProfiler(self)
+
+        self.fieldRateLimiter = None
+        if config.GetBool('want-clsend-rate-limits', 1):
+            self.fieldRateLimiter = FieldRateLimiter(self)
+
         taskMgr.add(self._checkBundledMsgs, 'checkBundledMsgs', priority=-100)
 
         # skip a bit so we miss the startup sequence (it has very long frames as things are set up)
@@ -220,6 +246,15 @@ class AIRepository(ConnectionRepository):
         self.notify.info(
             'avg frame duration=%fs, max frame duration=%fs, num Python objects=%s' % (
             avgFrameDur, maxFrameDur, self._numPyObjs))
+        self.writeServerEvent('ai-performance', self.ourChannel, '%f|%f|%s' % (
+            avgFrameDur, maxFrameDur, self._numPyObjs))
+        if self.messageProfiler:
+            self.notify.info(self.messageProfiler.getStatsString())
+        if self.eventLogger:
+            self.notify.info(self.eventLogger.getStatsString())
+        if self.fieldRateLimiter:
+            self.notify.info(self.fieldRateLimiter.getStatsString())
+        self.notify.info(self.channelAllocator.getStatsString())
         return Task.again
 
     def startLeakDetector(self):
@@ -240,6 +275,18 @@ class AIRepository(ConnectionRepository):
         #self.messageTypesLeakDetector = LeakDetectors.MessageTypesLeakDetector()
         return True
 
+    def setMessageProfiling(self, enabled):
+        """
+        Turns the message profiler on or off at runtime.
+        """
+        if enabled and not self.messageProfiler:
+            self.messageProfiler = MessageProfiler(self)
+            if self.handler == self.handlePlayGame:
+                self.messageProfiler.start()
+        elif not enabled and self.messageProfiler:
+            self.messageProfiler.stop()
+            self.messageProfiler = None
+
     def getTrackClsends(self):
         return False
 
@@ -302,36 +349,8 @@ class AIRepository(ConnectionRepository):
             if hasattr(av, 'getAccess'):
                 description = '%s|%s' % (description, av.getAccess())
 
-        # break it up into chunks that will fit in a UDP packet (max 1024 bytes)
-        # leave some room for the header/eventType/who
-        maxLen = 900
-        breakCount = 0
-        # always run this loop at least once
-        while True:
-            if breakCount > 0:
-                eventType = '%s-continued%s' % (eventType, breakCount)
-
-            # Count up the number of bytes in the packet
-            length = 2 + 2 + 4 + 2 + len(eventType) + 2 + len(who) + 2 + len(description)
-            dg = PyDatagram()
-            dg.addUint16(length)
-            dg.addUint16(1)  # message type 1: server event
-            dg.addUint16(6)  # server type 6: AI server
-            dg.addUint32(self.ourChannel)
-            dg.addString(eventType)
-            dg.addString(who)
-            dg.addString(description[:maxLen])
-            description = description[maxLen:]
-
-            self.notify.debug('%s|AIevent:%s|%s|%s' % (eventType, self.serverId, who, description))
-
-            if not self.udpSock.Send(dg.getMessage()):
-                self.notify.warning("Unable to log server event: %s" % (self.udpSock.GetLastError()))
-
-            if len(description) == 0:
-                break
-            breakCount += 1
-
+        self.notify.debug('%s|AIevent:%s|%s|%s' % (eventType, self.serverId, who, description))
+        self.eventLogger.log(eventType, who, description)
 
     def writeServerStatus(self, who, avatar_count, object_count):
         """
@@ -432,6 +451,10 @@ class AIRepository(ConnectionRepository):
 
     def enterPlayGame(self):
         self.handler = self.handlePlayGame
+        if self.messageProfiler:
+            self.messageProfiler.start()
+        if self.eventLogger:
+            self.eventLogger.start()
         self.createObjects()
 
     def handleConnect(self, msgType, di):
@@ -618,10 +641,16 @@ class AIRepository(ConnectionRepository):
     def exitPlayGame(self):
         self.handler = None
         self.stopReaderPollTask()
+        if self.messageProfiler:
+            self.messageProfiler.stop()
 
         self.deleteDistributedObjects()
         cleanupAsyncRequests()
 
+        if self.eventLogger:
+            # Send whatever the objects logged on their way out.
+            self.eventLogger.stop()
+
         # Make sure there are no leftover tasks that shouldn't be here.
         for task in taskMgr.getTasks():
             if (task.name in ("igLoop",
@@ -874,9 +903,15 @@ class AIRepository(ConnectionRepository):
         doId = di.getUint32()
         # Find the do
         do = self.doId2do[doId]
-        print(do)
         # Let the dclass finish the job
-        do.dclass.receiveUpdate(do, di)
+        if self.fieldRateLimiter and self.getMsgSender() >> 32:
+            # Sent by a client (the client agent puts the account id in
+            # the high bits of the sender).
+            self.fieldRateLimiter.handleClientUpdate(do, di, self.getMsgSender())
+        elif self.messageProfiler:
+            self.messageProfiler.profileUpdate(do, di)
+        else:
+            do.dclass.receiveUpdate(do, di)
 
     def _handleObjectChangeZone(self, di):
         # Get the Do Id
@@ -1023,6 +1058,26 @@ class AIRepository(ConnectionRepository):
         self.send(datagram)
 
     def addPostSocketClose(self, themessage):
+        self._postSocketCloseMsgs.append(themessage)
+        self._sendPostSocketClose(themessage)
+
+    def setTransientPostSocketClose(self, messages):
+        """
+        Replaces the post remove messages given to the previous call of
+        this function with the indicated list.  This is meant for state
+        that changes while the AI is running (e.g. unsaved database
+        values); messages added with addPostSocketClose are kept.
+        """
+        datagram = PyDatagram()
+        datagram.addInt8(1)
+        datagram.addChannel(CONTROL_MESSAGE)
+        datagram.addUint16(CONTROL_CLEAR_POST_REMOVE)
+        self.send(datagram)
+
+        for message in self._postSocketCloseMsgs + list(messages):
+            self._sendPostSocketClose(message)
+
+    def _sendPostSocketClose(self, themessage):
         # Time to send a register for channel message to the msgDirector
         datagram = PyDatagram()
 #        datagram.addServerControlHeader(CONTROL_ADD_POST_REMOVE)
@@ -1212,23 +1267,20 @@ class AIRepository(ConnectionRepository):
     def allocateChannel(self):
         channel=self.channelAllocator.allocate()
         if channel==-1:
-            raise RuntimeError("channelAllocator.allocate() is out of channels")
-        if self.channelAllocator.fractionUsed()>0.75:
-            # There is some debate about how bad it is to run out of
-            # channels.  Being ignorant about what exactly will happen
-            # if a channel is reused too quickly, we decided to bail
-            # out if we got low on channels.  By the way, being low on
-            # channels is not the real problem.  The problem is reusing
-            # a channel too soon after it's freed.  There is an assumption
-            # here that if there are a lot of free channels and the
-            # channels are reused in the same order that they are freed,
-            # then there is a good chance that any allocated channel has
-            # "aged" properly.
-            # Schuyler has daydreamed about a system that will track the age
-            # of freed ids and sleep or flag an error as apropriate.  See him
-            # for details (esp. if you want to write a cross-platform version
-            # of said feature).
-            raise RuntimeError("Dangerously low on channels.")
+            # Being low on channels is not the real problem, reusing a
+            # channel too soon after it's freed is.  The allocator keeps
+            # track of the age of freed channels and only gives out the
+            # ones that have aged properly, so we only fail when there
+            # are none of those left.
+            raise RuntimeError("channelAllocator.allocate() is out of channels: %s" % (
+                self.channelAllocator.getStatsString()))
+        fractionUsed = self.channelAllocator.fractionUsed()
+        if fractionUsed > self.channelWarningFraction:
+            if not self.channelWarned:
+                self.notify.warning("Low on channels: %s" % self.channelAllocator.getStatsString())
+                self.channelWarned = True
+        elif self.channelWarned and fractionUsed < self.channelWarningFraction - 0.05:
+            self.channelWarned = False
         # Sanity check
         assert (channel >= self.minChannel) and (channel <= self.maxChannel)
 
@@ -1518,6 +1570,8 @@ class AIRepository(ConnectionRepository):
         channel=self.getMsgChannel()
         if channel in self.netMessenger.channels:
             self.netMessenger.handle(di.getBlob())
+        elif self.messageProfiler:
+            self.messageProfiler.profileMessage(self.handler, self.getMsgType(), di)
         else:
             self.handler(self.getMsgType(), di)
 
@@ -1879,6 +1933,17 @@ class AIRepository(ConnectionRepository):
     def getSenderReturnChannel(self):
         return self.getMsgSender()
 
+    def ejectClient(self, clientChannel, reasonCode, reason):
+        """
+        Asks the client agent to disconnect the client on the indicated
+        channel, e.g. getMsgSender() of one of its updates.
+        """
+        dg = PyDatagram()
+        dg.addServerHeader(clientChannel, self.ourChannel, CLIENTAGENT_EJECT)
+        dg.addUint16(reasonCode)
+        dg.addString(reason)
+        self.send(dg)
+
 
     ########################################
     #  Network reading and time device.. for ai's
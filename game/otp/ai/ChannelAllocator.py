@@ -0,0 +1,90 @@
+from collections import deque
+import time
+
+class ChannelAllocator:
+    """
+    Hands out the channels (doIds) in [minId, maxId] like
+    UniqueIdAllocator, except that a freed id isn't given out again until
+    it has been free for cooldown seconds.  Until then messages that were
+    on their way to the old object could still reach a new one.
+
+    Ids that were never used go first.  After that, freed ids wait in a
+    quarantine queue in the order they were freed, and allocate takes the
+    oldest one if it has aged enough.  So the whole range is usable; only
+    the ids freed in the last cooldown seconds are not.
+    """
+
+    def __init__(self, minId, maxId, cooldown, getTime=time.monotonic):
+        assert maxId >= minId
+        self.minId = minId
+        self.maxId = maxId
+        self.size = maxId - minId + 1
+        self.cooldown = cooldown
+        self.getTime = getTime
+
+        # The next id that has never been handed out.
+        self.nextFresh = minId
+        # (time freed, id), oldest first
+        self.quarantine = deque()
+        # 1 for every id that is out
+        self.allocated = bytearray(self.size)
+        self.numAllocated = 0
+
+        # Counters for the performance log.
+        self.maxAllocated = 0
+        self.numReused = 0
+        self.numRefused = 0
+
+    def allocate(self):
+        """
+        Returns a free id, or -1 if every id is out or still cooling down.
+        """
+        if self.nextFresh <= self.maxId:
+            id = self.nextFresh
+            self.nextFresh += 1
+        elif self.quarantine and self.quarantine[0][0] <= self.getTime() - self.cooldown:
+            id = self.quarantine.popleft()[1]
+            self.numReused += 1
+        else:
+            self.numRefused += 1
+            return -1
+
+        self.allocated[id - self.minId] = 1
+        self.numAllocated += 1
+        if self.numAllocated > self.maxAllocated:
+            self.maxAllocated = self.numAllocated
+        return id
+
+    def free(self, id):
+        index = id - self.minId
+        if index < 0 or index >= self.size or not self.allocated[index]:
+            raise ValueError("Freeing id %s, which isn't allocated." % id)
+        self.allocated[index] = 0
+        self.numAllocated -= 1
+        self.quarantine.append((self.getTime(), id))
+
+    def isAllocated(self, id):
+        index = id - self.minId
+        return 0 <= index < self.size and bool(self.allocated[index])
+
+    def fractionUsed(self):
+        return float(self.numAllocated) / self.size
+
+    def getNumQuarantined(self):
+        # Freed, but not old enough to give out yet.
+        cutoff = self.getTime() - self.cooldown
+        count = 0
+        for freeTime, id in reversed(self.quarantine):
+            if freeTime <= cutoff:
+                break
+            count += 1
+        return count
+
+    def getNumAvailable(self):
+        return (self.maxId - self.nextFresh + 1) + len(self.quarantine) - self.getNumQuarantined()
+
+    def getStatsString(self):
+        return ('channels: %s of %s out (%.1f%%, max %s), %s cooling down, %s available, '
+                '%s reused, %s refused' % (
+            self.numAllocated, self.size, 100. * self.fractionUsed(), self.maxAllocated,
+            self.getNumQuarantined(), self.getNumAvailable(), self.numReused, self.numRefused))
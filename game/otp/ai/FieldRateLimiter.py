@@ -0,0 +1,176 @@
+from pandac.PandaModules import *
+from .AIMsgTypes import *
+from direct.directnotify.DirectNotifyGlobal import directNotify
+import time
+
+# CLIENT_DISCONNECT_FIELD_CONSTRAINT, see config/CarsClient.lua
+ClsendAbuseDisconnectCode = 127
+
+class ClientSendState:
+    """
+    What the FieldRateLimiter knows about one avatar.
+    """
+    __slots__ = ('buckets', 'windowStart', 'cpuTime', 'numDropped', 'lastTime', 'reported')
+
+    def __init__(self, now):
+        # fieldIndex -> [tokens, last refill time]
+        self.buckets = {}
+        self.windowStart = now
+        self.cpuTime = 0.
+        self.numDropped = 0
+        self.lastTime = now
+        self.reported = False
+
+class FieldRateLimiter:
+    """
+    Rate limits and accounts for the field updates that clients send
+    (clsend and ownsend fields), per avatar and field.
+
+    Every (avatar, field) pair gets a token bucket.  The rates come from
+    clsend-rate-limits, a list of "field:rate:burst" entries where field
+    is either a field name or dclass.field; fields that aren't listed get
+    clsend-default-rate per second, clsend-default-burst at once.  An
+    update that finds its bucket empty is dropped.
+
+    The time spent handling every client update is added up per field
+    for the performance log, and per avatar over windows of
+    clsend-budget-window seconds.  This is wall time around the handler
+    (perf_counter), so it includes whatever else the process was doing,
+    e.g. a garbage collection or a database callback the handler waited
+    on, not just the CPU time of the update.  An avatar that has more
+    than clsend-max-dropped updates dropped or spends more than
+    clsend-cpu-budget seconds of handler time in one window is logged as
+    suspicious.  The thresholds haven't been measured against real
+    traffic yet, so avatars are only ejected with want-clsend-kick,
+    which is off by default.
+    """
+    notify = directNotify.newCategory('FieldRateLimiter')
+
+    DefaultRateLimits = ('invokeRuleRequest:5:20 persistRequest:2:10 '
+                         'sendEventLog:5:20 onSegmentEnter:10:30')
+
+    def __init__(self, air):
+        self.air = air
+        self.defaultRate = config.GetFloat('clsend-default-rate', 30.)
+        self.defaultBurst = config.GetFloat('clsend-default-burst', 60.)
+        self.budgetWindow = config.GetFloat('clsend-budget-window', 10.)
+        self.cpuBudget = config.GetFloat('clsend-cpu-budget', .5)
+        self.maxDropped = config.GetInt('clsend-max-dropped', 100)
+        self.wantKick = config.GetBool('want-clsend-kick', 0)
+
+        # fieldName or dclassName.fieldName -> (rate, burst)
+        self.rateLimits = {}
+        for entry in config.GetString('clsend-rate-limits', self.DefaultRateLimits).split():
+            fieldName, rate, burst = entry.rsplit(':', 2)
+            self.rateLimits[fieldName] = (float(rate), float(burst))
+        # (dclassName, fieldIndex) -> (rate, burst), filled in as we go.
+        self.fieldLimits = {}
+
+        # avId -> ClientSendState
+        self.avatars = {}
+        # (dclassName, fieldIndex) -> [count, total time, dropped]
+        self.fieldCosts = {}
+
+        self.numKicked = 0
+
+    def getFieldLimit(self, dclass, fieldIndex):
+        key = (dclass.getName(), fieldIndex)
+        limit = self.fieldLimits.get(key)
+        if limit is None:
+            limit = (self.defaultRate, self.defaultBurst)
+            field = dclass.getFieldByIndex(fieldIndex)
+            if field:
+                limit = self.rateLimits.get(
+                    '%s.%s' % (dclass.getName(), field.getName()),
+                    self.rateLimits.get(field.getName(), limit))
+            self.fieldLimits[key] = limit
+        return limit
+
+    def handleClientUpdate(self, do, di, sender):
+        """
+        Called instead of dclass.receiveUpdate for updates sent by a
+        client.
+        """
+        # Peek at the field index without consuming it.
+        fieldIndex = DatagramIterator(di.getDatagram(), di.getCurrentIndex()).getUint16()
+        avId = sender & 0xffffffff
+        now = globalClock.getRealTime()
+
+        state = self.avatars.get(avId)
+        if state is None:
+            state = self.avatars[avId] = ClientSendState(now)
+        elif now - state.windowStart >= self.budgetWindow:
+            state.windowStart = now
+            state.cpuTime = 0.
+            state.numDropped = 0
+        state.lastTime = now
+
+        key = (do.dclass.getName(), fieldIndex)
+        cost = self.fieldCosts.get(key)
+        if cost is None:
+            cost = self.fieldCosts[key] = [0, 0., 0]
+
+        rate, burst = self.getFieldLimit(do.dclass, fieldIndex)
+        bucket = state.buckets.get(fieldIndex)
+        if bucket is None:
+            bucket = state.buckets[fieldIndex] = [burst, now]
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens < 1.:
+            bucket[0] = tokens
+            cost[2] += 1
+            state.numDropped += 1
+            if state.numDropped > self.maxDropped:
+                self.handleAbuse(avId, sender, state, 'dropped %s updates, last %s' % (
+                    state.numDropped, self.getFieldName(key)))
+            return
+        bucket[0] = tokens - 1.
+
+        start = time.perf_counter()
+        if self.air.messageProfiler:
+            self.air.messageProfiler.profileUpdate(do, di)
+        else:
+            do.dclass.receiveUpdate(do, di)
+        duration = time.perf_counter() - start
+
+        cost[0] += 1
+        cost[1] += duration
+        state.cpuTime += duration
+        if state.cpuTime > self.cpuBudget:
+            self.handleAbuse(avId, sender, state, 'used %.3fs of handler time, last %s' % (
+                state.cpuTime, self.getFieldName(key)))
+
+    def handleAbuse(self, avId, sender, state, reason):
+        if state.reported:
+            return
+
+        # Only report once per avatar.
+        state.reported = True
+        self.notify.warning('Avatar %s %s in %ss.' % (avId, reason, self.budgetWindow))
+        self.air.writeServerEvent('suspicious', avId, 'clsend abuse: %s' % reason)
+        if self.wantKick:
+            self.numKicked += 1
+            self.air.ejectClient(sender, ClsendAbuseDisconnectCode,
+                                 'You have been disconnected for sending too many messages.')
+
+    def getFieldName(self, key):
+        dclassName, fieldIndex = key
+        field = self.air.dclassesByName[dclassName].getFieldByIndex(fieldIndex)
+        if field:
+            return '%s.%s' % (dclassName, field.getName())
+        return '%s.%s' % (dclassName, fieldIndex)
+
+    def getStatsString(self, numEntries=3):
+        # Forget the avatars that have been quiet for a whole window.
+        now = globalClock.getRealTime()
+        for avId, state in list(self.avatars.items()):
+            if now - state.lastTime > self.budgetWindow:
+                del self.avatars[avId]
+
+        numUpdates = sum(cost[0] for cost in self.fieldCosts.values())
+        numDropped = sum(cost[2] for cost in self.fieldCosts.values())
+        costs = sorted(self.fieldCosts.items(), key=lambda item: item[1][1], reverse=True)
+        top = ', '.join('%s %s/%.1fms/%s dropped' % (self.getFieldName(key), count, total * 1000., dropped)
+                        for key, (count, total, dropped) in costs[:numEntries])
+        return 'clsend: %s updates, %s dropped, %s kicked, %s avatars; top: %s' % (
+            numUpdates, numDropped, self.numKicked, len(self.avatars), top or 'none')
@@ -4,7 +4,7 @@ from direct.directnotify.DirectNotifyGlobal import directNotify
 class MagicWordManagerAI(DistributedObjectAI):
     notify = directNotify.newCategory('MagicWordManagerAI')
 
-    def setMagicWord(self, magicWord, avId, zoneId):
+    def setMagicWord(self, magicWord, avId, zoneId, signature=None):
         invokerId = self.air.getAvatarIdFromSender()
         invoker = self.air.doId2do.get(invokerId)
 
@@ -18,6 +18,87 @@ class MagicWordManagerAI(DistributedObjectAI):
             self.sendUpdateToAvatarId(invokerId, 'setMagicWordResponse', ['Missing target!'])
             return
 
+        if not config.GetBool('want-magic-words', __dev__):
+            return
+
+        args = magicWord.split()
+        if args and not self.hasAccess(invoker):
+            self.notify.warning('%s tried to use %s without access!' % (invokerId, args[0]))
+            return
+
+        if args and args[0] == '~profile':
+            self.sendUpdateToAvatarId(invokerId, 'setMagicWordResponse', [self.doProfile(args[1:])])
+        elif args and args[0] == '~zone':
+            self.sendUpdateToAvatarId(invokerId, 'setMagicWordResponse', [self.doZone(target, args[1:])])
+
+    def hasAccess(self, invoker):
+        """
+        Only avatars of a magic-word-dclasses dclass, or one inheriting
+        from it, may use magic words.  The client agent picks the dclass
+        from the account, DistributedCarPuppet (a DistributedCarGM) for
+        staff accounts, so clients can't choose it.
+        """
+        allowed = config.GetString('magic-word-dclasses', 'DistributedCarGM').split()
+        dclasses = [invoker.dclass]
+        while dclasses:
+            dclass = dclasses.pop()
+            if dclass.getName() in allowed:
+                return True
+            dclasses.extend(dclass.getParent(i) for i in range(dclass.getNumParents()))
+        return False
+
+    def doProfile(self, args):
+        """
+        ~profile [on|off|reset|fields|messages] [numEntries]
+        """
+        if args and args[0] in ('on', 'off'):
+            self.air.setMessageProfiling(args[0] == 'on')
+            return 'Message profiling is %s.' % args[0]
+
+        profiler = self.air.messageProfiler
+        if not profiler:
+            return 'Message profiling is off, use ~profile on.'
+
+        numEntries = 10
+        if args and args[-1].isdigit():
+            numEntries = int(args.pop())
+
+        if args and args[0] == 'reset':
+            profiler.reset()
+            return 'Message profile reset.'
+
+        fields = not args or args[0] == 'fields'
+        messages = not args or args[0] == 'messages'
+        return profiler.getReport(numEntries, fields, messages)
+
+    def doZone(self, target, args):
+        """
+        ~zone [zoneId|all]
+        """
+        if not hasattr(self.air, 'zoneMembership'):
+            return 'Zone membership is not tracked on this district.'
+
+        membership = self.air.zoneMembership
+        if args and args[0] == 'all':
+            zoneIds = sorted(membership.getZoneIds())
+            lines = ['%s avatars in %s zones:' % (len(membership.avId2zoneId), len(zoneIds))]
+            for zoneId in zoneIds:
+                lines.append('%s: %s' % (zoneId, membership.getZonePopulation(zoneId)))
+            return '\n'.join(lines)
+
+        if args and args[0].isdigit():
+            zoneId = int(args[0])
+        else:
+            zoneId = membership.getAvatarZoneId(target.doId)
+            if zoneId is None:
+                zoneId = target.zoneId
+
+        names = []
+        for avId in sorted(membership.getAvatarsInZone(zoneId)):
+            av = self.air.doId2do.get(avId)
+            names.append('%s (%s)' % (getattr(av, 'DISLname', '') or '?', avId))
+        return '%s avatars in zone %s: %s' % (len(names), zoneId, ', '.join(names))
+
     def setWho(self, avIds = []):
         avId = self.air.getAvatarIdFromSender()
         av = self.air.doId2do.get(avId)
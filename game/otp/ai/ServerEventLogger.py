@@ -0,0 +1,207 @@
+from pandac.PandaModules import *
+from direct.directnotify.DirectNotifyGlobal import directNotify
+from direct.distributed.PyDatagram import PyDatagram
+from direct.task import Task
+import collections
+import random
+
+class ServerEventLogger:
+    """
+    Sends writeServerEvent's events to the event server.
+
+    With want-server-event-batching, events are put in a ring buffer and
+    sent out by a task every server-event-flush-period seconds, packed
+    together in datagrams of up to server-event-max-datagram bytes.
+    Every event keeps its own length prefix, so the event server can
+    read them one after the other.  When the buffer is full the oldest
+    events are dropped.  Batching is off by default until the event
+    server is known to read more than one event per datagram; then every
+    event goes straight out in a datagram of its own, as it always has.
+
+    Before an event is buffered it has to get past:
+      - server-event-sample-rates, "type:fraction" pairs, e.g.
+        "ai-profile:0.5" keeps about half of the ai-profile events;
+      - server-event-type-rates, "type:rate:burst" token buckets per
+        event type;
+      - a token bucket per who of server-event-who-rate events per second
+        (server-event-who-burst at once), so one client sending a lot of
+        events can't flood the event server.
+
+    Everything that doesn't make it is counted for the performance log.
+    Sampling and rate limits apply whether batching is on or not.
+    """
+    notify = directNotify.newCategory('ServerEventLogger')
+
+    def __init__(self, air):
+        self.air = air
+        self.wantBatching = config.GetBool('want-server-event-batching', 0)
+        self.flushPeriod = config.GetFloat('server-event-flush-period', 0.25)
+        self.maxDatagramSize = config.GetInt('server-event-max-datagram', 1024)
+        self.whoRate = config.GetFloat('server-event-who-rate', 20.)
+        self.whoBurst = config.GetFloat('server-event-who-burst', 100.)
+
+        # eventType -> fraction of the events to keep
+        self.sampleRates = {}
+        for entry in config.GetString('server-event-sample-rates', '').split():
+            eventType, fraction = entry.rsplit(':', 1)
+            self.sampleRates[eventType] = float(fraction)
+
+        # eventType -> (rate, burst)
+        self.typeRates = {}
+        for entry in config.GetString('server-event-type-rates', '').split():
+            eventType, rate, burst = entry.rsplit(':', 2)
+            self.typeRates[eventType] = (float(rate), float(burst))
+
+        self.buffer = collections.deque(maxlen=config.GetInt('server-event-buffer-size', 4096))
+        # key -> [tokens, last refill time]
+        self.typeBuckets = {}
+        self.whoBuckets = {}
+        self.running = False
+
+        # Counters for the performance log.
+        self.numLogged = 0
+        self.numSent = 0
+        self.numDatagrams = 0
+        self.numOverflowed = 0
+        self.numSampledOut = 0
+        self.numTypeLimited = 0
+        self.numWhoLimited = 0
+        self.numSendErrors = 0
+        # whos that went over their rate since the last performance log.
+        self.limitedWhos = set()
+
+    def start(self):
+        if not self.wantBatching:
+            return
+        self.running = True
+        taskMgr.doMethodLater(self.flushPeriod, self.__flushTask,
+                              self.air.uniqueName('serverEventFlush'))
+
+    def stop(self):
+        taskMgr.remove(self.air.uniqueName('serverEventFlush'))
+        self.running = False
+        self.flush()
+
+    def log(self, eventType, who, description):
+        fraction = self.sampleRates.get(eventType)
+        if fraction is not None and random.random() >= fraction:
+            self.numSampledOut += 1
+            return
+
+        now = globalClock.getRealTime()
+        typeRate = self.typeRates.get(eventType)
+        if typeRate and not self.__takeToken(self.typeBuckets, eventType, typeRate[0], typeRate[1], now):
+            self.numTypeLimited += 1
+            return
+
+        if self.whoRate > 0 and not self.__takeToken(self.whoBuckets, who, self.whoRate, self.whoBurst, now):
+            self.numWhoLimited += 1
+            self.limitedWhos.add(who)
+            return
+
+        if not self.wantBatching:
+            for message in self.packEvent(eventType, who, description):
+                self.__send(message)
+            self.numLogged += 1
+            self.numSent += 1
+            return
+
+        if len(self.buffer) == self.buffer.maxlen:
+            # The deque drops the oldest one.
+            self.numOverflowed += 1
+        self.buffer.append((eventType, who, description))
+        self.numLogged += 1
+
+        if not self.running:
+            # Nobody is going to flush it for us.
+            self.flush()
+
+    def __takeToken(self, buckets, key, rate, burst, now):
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [burst - 1., now]
+            return True
+
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens < 1.:
+            bucket[0] = tokens
+            return False
+
+        bucket[0] = tokens - 1.
+        return True
+
+    def packEvent(self, eventType, who, description):
+        """
+        Returns the event as a list of messages for the event server.
+        Long descriptions are broken up into chunks that fit in a UDP
+        packet (max 1024 bytes), leaving some room for the header,
+        eventType and who.
+        """
+        messages = []
+        maxLen = 900
+        breakCount = 0
+        # always run this loop at least once
+        while True:
+            if breakCount > 0:
+                eventType = '%s-continued%s' % (eventType, breakCount)
+
+            # Count up the number of bytes in the packet
+            length = 2 + 2 + 4 + 2 + len(eventType) + 2 + len(who) + 2 + len(description)
+            dg = PyDatagram()
+            dg.addUint16(length)
+            dg.addUint16(1)  # message type 1: server event
+            dg.addUint16(6)  # server type 6: AI server
+            dg.addUint32(self.air.ourChannel)
+            dg.addString(eventType)
+            dg.addString(who)
+            dg.addString(description[:maxLen])
+            description = description[maxLen:]
+            messages.append(dg.getMessage())
+
+            if len(description) == 0:
+                break
+            breakCount += 1
+
+        return messages
+
+    def flush(self):
+        bundle = PyDatagram()
+        while self.buffer:
+            eventType, who, description = self.buffer.popleft()
+            for message in self.packEvent(eventType, who, description):
+                if bundle.getLength() and bundle.getLength() + len(message) > self.maxDatagramSize:
+                    self.__send(bundle.getMessage())
+                    bundle = PyDatagram()
+                bundle.appendData(message)
+            self.numSent += 1
+
+        if bundle.getLength():
+            self.__send(bundle.getMessage())
+
+    def __send(self, data):
+        self.numDatagrams += 1
+        if not self.air.udpSock.Send(data):
+            self.numSendErrors += 1
+            self.notify.warning("Unable to log server event: %s" % (self.air.udpSock.GetLastError()))
+
+    def __flushTask(self, task):
+        self.flush()
+        return Task.again
+
+    def getStatsString(self):
+        # Forget the buckets of whos that have been quiet long enough to
+        # have filled up again.
+        now = globalClock.getRealTime()
+        for who, bucket in list(self.whoBuckets.items()):
+            if bucket[0] + (now - bucket[1]) * self.whoRate >= self.whoBurst:
+                del self.whoBuckets[who]
+
+        stats = ('server events: %s logged, %s sent in %s datagrams, dropped %s overflowed, '
+                 '%s sampled out, %s type limited, %s who limited, %s send errors' % (
+            self.numLogged, self.numSent, self.numDatagrams, self.numOverflowed,
+            self.numSampledOut, self.numTypeLimited, self.numWhoLimited, self.numSendErrors))
+        if self.limitedWhos:
+            stats += ', limited: %s' % ', '.join(sorted(self.limitedWhos)[:10])
+            self.limitedWhos = set()
+        return stats
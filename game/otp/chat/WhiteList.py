@@ -1,9 +1,10 @@
 from bisect import bisect_left
-import string
-import sys
-import os
+import re
 
 class WhiteList:
+    # What the chat filters count as a word: anything between whitespace.
+    wordPattern = re.compile(r'\S+')
+
     def __init__(self, wordlist):
         self.words = []
         for line in wordlist:
@@ -12,6 +13,17 @@ class WhiteList:
         self.words.sort()
         self.numWords = len(self.words)
 
+        # Decoded once, so checking a word is a single hash lookup.
+        self.wordSet = frozenset(word.decode() for word in self.words)
+
+    @classmethod
+    def fromFile(cls, filename):
+        f = open(filename, 'rb')
+        try:
+            return cls(f)
+        finally:
+            f.close()
+
     def cleanText(self, text):
         if isinstance(text, bytes):
             text = text.decode().strip('.,?!')
@@ -21,34 +33,61 @@ class WhiteList:
         text = text.lower().encode()
         return text
 
-    def isWord(self, text):
+    def _prefixRange(self, text):
+        # No UTF-8 sequence has a 0xff byte, so everything starting with
+        # text sorts before text + 0xff.
         text = self.cleanText(text)
         i = bisect_left(self.words, text)
-        if i == self.numWords:
-            return False
+        j = bisect_left(self.words, text + b'\xff', i)
+        return i, j
 
-        return self.words[i] == text
+    def _isLowerWord(self, word):
+        # Like filterWhitelist in TalkFilter.lua, the word as typed first,
+        # then without the punctuation.
+        return word in self.wordSet or word.strip('.,?!') in self.wordSet
 
-    def isPrefix(self, text):
-        text = self.cleanText(text)
-        i = bisect_left(self.words, text)
-        if i == self.numWords:
-            return False
+    def isWord(self, text):
+        if isinstance(text, bytes):
+            text = text.decode()
+        return self._isLowerWord(text.lower())
 
-        return self.words[i].startswith(text)
+    def isPrefix(self, text):
+        i, j = self._prefixRange(text)
+        return i < j
 
     def prefixCount(self, text):
-        text = self.cleanText(text)
-        i = bisect_left(self.words, text)
-        j = i
-        while j < self.numWords and self.words[j].startswith(text):
-            j += 1
+        i, j = self._prefixRange(text)
         return j - i
 
     def prefixList(self, text):
-        text = self.cleanText(text)
-        i = bisect_left(self.words, text)
-        j = i
-        while j < self.numWords and self.words[j].startswith(text):
-            j += 1
+        i, j = self._prefixRange(text)
         return self.words[i:j]
+
+    def getModifications(self, message):
+        """
+        Checks a whole message, returns the words that aren't on the list
+        as (start, end) offsets, end included, the same modifications
+        filterWhitelist in TalkFilter.lua sends with setTalk.
+        """
+        if isinstance(message, bytes):
+            message = message.decode()
+
+        lowered = message.lower()
+        wordSet = self.wordSet
+        for word in lowered.split():
+            if word not in wordSet and word.strip('.,?!') not in wordSet:
+                break
+        else:
+            # all good, most messages are
+            return []
+
+        if len(lowered) != len(message):
+            # A few characters lower to more than one, then the offsets
+            # don't line up and each word has to be lowered by itself.
+            return [(match.start(), match.end() - 1)
+                    for match in self.wordPattern.finditer(message)
+                    if not self._isLowerWord(match.group().lower())]
+
+        return [(match.start(), match.end() - 1)
+                for match in self.wordPattern.finditer(lowered)
+                if not self._isLowerWord(match.group())]
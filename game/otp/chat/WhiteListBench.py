@@ -0,0 +1,148 @@
+import sys
+import time
+import getopt
+import random
+import string
+from bisect import bisect_left
+
+from game.otp.chat.WhiteList import WhiteList
+
+# Define a usage string
+helpString ="""
+python -m game.otp.chat.WhiteListBench [--whitelist=<file>] [--words=<number>] [--messages=<number>] [--unknown=<fraction>] [--seed=<number>]
+
+Times the chat whitelist on the kind of messages the chat manager gets.
+Whole messages are checked with getModifications and compared with the
+old way, a bisect into the sorted word list per word, and the prefix
+lookups the whitelist chat input does while typing are timed as well.
+
+Uses the words in --whitelist, one per line like chat_whitelist.xml, or
+else makes up --words of them with English-like lengths.  Messages are
+1 to 12 words, mostly lower case with some capitals and punctuation,
+with --unknown of the words not on the list.
+
+Example:
+
+python -m game.otp.chat.WhiteListBench --words=30000 --messages=100000
+python -m game.otp.chat.WhiteListBench --whitelist=../assets/chat_whitelist.xml
+"""
+
+# Get the options
+try:
+    opts, pargs = getopt.getopt(sys.argv[1:], '', [
+        'whitelist=',
+        'words=',
+        'messages=',
+        'unknown=',
+        'seed=',
+        ])
+except Exception as e:
+    print(e)
+    print(helpString)
+    sys.exit(1)
+
+# Default values
+whitelistFile = None
+numWords = 30000
+numMessages = 100000
+unknown = 0.1
+seed = 1
+
+for opt in opts:
+    flag, value = opt
+    if (flag == '--whitelist'):
+        whitelistFile = value
+    elif (flag == '--words'):
+        numWords = int(value)
+    elif (flag == '--messages'):
+        numMessages = int(value)
+    elif (flag == '--unknown'):
+        unknown = float(value)
+    elif (flag == '--seed'):
+        seed = int(value)
+    else:
+        print("Error: Illegal option: " + flag)
+        print(helpString)
+        sys.exit(1)
+
+rng = random.Random(seed)
+
+def makeWord():
+    # Short words are the common ones, like in real chat.
+    length = min(2 + int(rng.expovariate(0.35)), 14)
+    return ''.join(rng.choice(string.ascii_lowercase) for i in range(length))
+
+def makeMessage(words):
+    message = []
+    for i in range(rng.randint(1, 12)):
+        if rng.random() < unknown:
+            word = makeWord() + 'zz'
+        else:
+            # Zipf-ish, a few words make up most of the chat.
+            word = words[min(int(rng.paretovariate(1.2)) - 1, len(words) - 1)]
+        if rng.random() < 0.1:
+            word = word.capitalize()
+        if rng.random() < 0.1:
+            word += rng.choice('.,?!')
+        message.append(word)
+    return ' '.join(message)
+
+def oldModifications(whitelist, message):
+    # What the chat manager did before getModifications.
+    modifications = []
+    offset = 0
+    for word in message.split(' '):
+        if word:
+            text = whitelist.cleanText(word)
+            i = bisect_left(whitelist.words, text)
+            if i == whitelist.numWords or whitelist.words[i] != text:
+                modifications.append((offset, offset + len(word) - 1))
+        offset += len(word) + 1
+    return modifications
+
+def report(name, count, duration):
+    print('  %-26s %8d in %7.3fs, %10.0f/sec' % (name, count, duration, count / duration))
+
+if whitelistFile:
+    start = time.perf_counter()
+    whitelist = WhiteList.fromFile(whitelistFile)
+    print('Loaded %d words from %s in %.3fs' % (whitelist.numWords, whitelistFile, time.perf_counter() - start))
+else:
+    wordSet = set()
+    while len(wordSet) < numWords:
+        wordSet.add(makeWord())
+    start = time.perf_counter()
+    whitelist = WhiteList([(word + '\n').encode() for word in wordSet])
+    print('Made up %d words, loaded in %.3fs' % (whitelist.numWords, time.perf_counter() - start))
+
+# The order picks which words makeMessage uses most.
+words = [word.decode() for word in whitelist.words]
+rng.shuffle(words)
+messages = [makeMessage(words) for i in range(numMessages)]
+numMessageWords = sum(len(message.split()) for message in messages)
+print('%d messages, %d words' % (numMessages, numMessageWords))
+
+start = time.perf_counter()
+old = [oldModifications(whitelist, message) for message in messages]
+report('per word bisect', numMessages, time.perf_counter() - start)
+
+start = time.perf_counter()
+new = [whitelist.getModifications(message) for message in messages]
+report('getModifications', numMessages, time.perf_counter() - start)
+
+# The old check didn't look at the word as typed, so it can only have
+# starred more.
+differ = sum(1 for a, b in zip(old, new) if not set(b) <= set(a))
+if differ:
+    print('  %d messages starred words the old check allowed!' % differ)
+
+prefixes = [word[:rng.randint(1, len(word))] for word in rng.sample(words, min(len(words), 10000))]
+start = time.perf_counter()
+for prefix in prefixes:
+    whitelist.isPrefix(prefix)
+report('isPrefix', len(prefixes), time.perf_counter() - start)
+
+start = time.perf_counter()
+for prefix in prefixes:
+    whitelist.prefixCount(prefix)
+report('prefixCount', len(prefixes), time.perf_counter() - start)
@@ -1,5 +1,6 @@
 from pandac.PandaModules import StringStream
 from direct.distributed.PyDatagram import PyDatagram
+import collections
 import random
 
 
@@ -20,7 +21,7 @@ class ClsendTracker:
         if self._logClsendOverflow:
             ClsendTracker.NumTrackersLoggingOverflow += 1
 
-        self._clsendMsgs = []
+        self._clsendMsgs = collections.deque()
         self._clsendBufLimit = 100
         self._clsendFlushNum = 20
         self._clsendCounter = 0
@@ -40,10 +41,10 @@ class ClsendTracker:
 
     def _trimClsend(self):
         for i in range(self._clsendFlushNum):
+            msg = self._clsendMsgs.popleft()
             if self._logClsendOverflow:
-                self._logClsend(*self._clsendMsgs[0])
+                self._logClsend(*msg)
 
-            self._clsendMsgs = self._clsendMsgs[1:]
             self._clsendCounter += 1
 
     def _logClsend(self, senderId, dataStr):
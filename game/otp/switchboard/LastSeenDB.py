@@ -1,159 +1,174 @@
-import MySQLdb
-import _mysql_exceptions
-import MySQLdb.constants.CR
-import datetime
+import threading
 from game.otp.friends.FriendInfo import FriendInfo
+import game.otp.switchboard.sbConfig as sbConfig
 import game.otp.switchboard.sbSQL as sbSQL
 
-SERVER_GONE_ERROR = MySQLdb.constants.CR.SERVER_GONE_ERROR
-SERVER_LOST = MySQLdb.constants.CR.SERVER_LOST
-
 class LastSeenDB:
     """
     DB wrapper class for last seen info!  All SQL and SOAP code for last seen info should be in here.
+
+    setInfo doesn't write right away.  Rows are kept per player, so a
+    player that moves around a lot only gets written once, and flush()
+    writes them all with one REPLACE and one commit.  The node calls
+    flush() from its executor every lastSeenFlushPeriod seconds, or
+    sooner when setInfo says lastSeenBatchSize players are waiting.
+    getInfo looks at the waiting rows before it asks the db.
+
+    Everything here blocks on MySQL, so the node only calls it from its
+    executor.  pool can be anything with sbDBPool's methods, the tests
+    use one on SQLite.
     """
-    def __init__(self,log,host,port,user,passwd,dbname):
-        self.sqlAvailable = True
+    def __init__(self,log,host,port,user,passwd,dbname,pool=None):
+        self.log = log
+        if pool is None:
+            from game.otp.switchboard.sbDBPool import sbDBPool
+            pool = sbDBPool(log,host,port,user,passwd,dbname)
+        self.pool = pool
+        self.sqlAvailable = self.pool.available
         if not self.sqlAvailable:
-            return
+            self.log.warning("LastSeenDB is disabled.")
 
-        self.log = log
-        self.host = host
-        self.port = port
-        self.user = user
-        self.passwd = passwd
-        self.dbname = dbname
-        try:
-            self.db = MySQLdb.connect(host=host,
-                                      port=port,
-                                      user=user,
-                                      passwd=passwd)
-        except _mysql_exceptions.OperationalError,e:
-            self.log.warning("Failed to connect to MySQL at %s:%d.  LastSeenDB is disabled."%(host,port))
-            self.sqlAvailable = 0
-            return
-
-        self.log.info("Connected to lastseen MySQL db at %s:%d."%(host,port))
-
-        
-        try:
-            cursor = self.db.cursor()
-            cursor.execute("USE `%s`"%self.dbname)
-            self.log.debug("Using database '%s'"%self.dbname)
-        except:
-            self.log.debug("%s database not found, lastseen not active." %self.dbname)
-            self.sqlAvailable = False
-
-    def reconnect(self):
-        self.log.debug("MySQL server was missing, attempting to reconnect.")
-        try: self.db.close()
-        except: pass
-        self.db = MySQLdb.connect(host=self.host,
-                                  port=self.port,
-                                  user=self.user,
-                                  passwd=self.passwd)
-        cursor = self.db.cursor()
-        cursor.execute("USE `%s`"%self.dbname)
-        self.log.debug("Reconnected to MySQL server at %s:%d."%(self.host,self.port))
+        # playerId -> row, written by the next flush
+        self.pending = {}
+        # playerId -> row, being written by the current flush
+        self.flushing = {}
+        self.lock = threading.Lock()
+
+        self.numFlushes = 0
+        self.numFlushedRows = 0
 
     def disconnect(self):
-        if not self.sqlAvailable:
-            return
-        self.db.close()
-        self.db = None
+        self.flush()
+        self.pool.close()
+
+    def _rowInfo(self,row):
+        return FriendInfo(avatarName = row[1],
+                          playerName = row[2],
+                          openChatEnabledYesNo = row[3],
+                          location = row[4],
+                          sublocation = row[5])
+
+    def _selectedInfo(self,info):
+        return FriendInfo(avatarName = info['avatarName'],
+                          playerName = info['playerName'],
+                          openChatEnabledYesNo = info['openChatEnabledYesNo'],
+                          location = info['location'],
+                          sublocation = info['sublocation'],
+                          timestamp = info['lastupdate'])
 
-    def getInfo(self,playerId,isRetry=False):
+    def getInfo(self,playerId):
         if not self.sqlAvailable:
             return FriendInfo(playerName="NotFound")
 
-        cursor = MySQLdb.cursors.DictCursor(self.db)
-        try:
-            cursor.execute("USE `%s`"%self.dbname)
-            cursor.execute(sbSQL.getInfoSELECT,(playerId))
-            info = cursor.fetchone()
-
-            if info is None:
-                return FriendInfo(playerName="NotFound")
-            else:
-                return FriendInfo(avatarName = info['avatarName'],
-                                  playerName = info['playerName'],
-                                  openChatEnabledYesNo = info['openChatEnabledYesNo'],
-                                  location = info['location'],
-                                  sublocation = info['sublocation'],
-                                  timestamp = info['lastupdate'])
-            
-        except _mysql_exceptions.OperationalError,e:
-            if isRetry == True:
-                self.log.error("Error on getInfo retry, giving up:\n%s" % str(e))
-                return FriendInfo(playerName="NotFound")
-            elif e[0] == SERVER_GONE_ERROR or e[0] == SERVER_LOST:
-                self.reconnect()
-                return self.getInfo(playerId,True)
-            else:
-                self.log.error("Unknown error on getInfo, retrying:\n%s" % str(e))
-                self.reconnect()
-                return self.getInfo(playerId,True)
-        except Exception,e:
-            self.log.error("Unknown error on getInfo, giving up:\n%s" % str(e))
+        with self.lock:
+            row = self.pending.get(playerId) or self.flushing.get(playerId)
+        if row is not None:
+            return self._rowInfo(row)
+
+        def select(conn):
+            cursor = self.pool.cursor(conn)
+            cursor.execute(sbSQL.getInfoSELECT,(playerId,))
+            return cursor.fetchone()
+        info = self.pool.run("getInfo",select)
+
+        if info is None:
             return FriendInfo(playerName="NotFound")
+        else:
+            return self._selectedInfo(info)
+
+    def getInfos(self,playerIds):
+        """
+        getInfo for a bunch of players at once, returns {playerId:FriendInfo}.
+        The ones not in the db come back as NotFound.
+        """
+        infos = {}
+        if not self.sqlAvailable:
+            for playerId in playerIds:
+                infos[playerId] = FriendInfo(playerName="NotFound")
+            return infos
+
+        missing = []
+        with self.lock:
+            for playerId in playerIds:
+                row = self.pending.get(playerId) or self.flushing.get(playerId)
+                if row is not None:
+                    infos[playerId] = self._rowInfo(row)
+                else:
+                    missing.append(playerId)
+
+        def select(conn):
+            cursor = self.pool.cursor(conn)
+            rows = []
+            for i in range(0,len(missing),sbConfig.lastSeenBatchSize):
+                chunk = missing[i:i+sbConfig.lastSeenBatchSize]
+                cursor.execute(sbSQL.getInfosSELECT%",".join(["%s"]*len(chunk)),chunk)
+                rows.extend(cursor.fetchall())
+            return rows
+        if missing:
+            for info in self.pool.run("getInfos",select,()):
+                infos[info['playerId']] = self._selectedInfo(info)
 
+        for playerId in missing:
+            if playerId not in infos:
+                infos[playerId] = FriendInfo(playerName="NotFound")
+        return infos
 
-    def setInfo(self,playerId,info,isRetry=False):
+    def setInfo(self,playerId,info):
+        """
+        Returns True when the batch is full and should be flushed.
+        """
         if not self.sqlAvailable:
-            return
-        cursor = MySQLdb.cursors.DictCursor(self.db)
-        rows = 0
-        try:
-            cursor.execute("USE `%s`"%self.dbname)
-            cursor.execute(sbSQL.setInfoREPLACE,
-                           (playerId,
-                            info.avatarName,
-                            info.playerName,
-                            info.openChatEnabledYesNo,
-                            info.location,
-                            info.sublocation))
-
-            self.db.commit()
-            
-        except _mysql_exceptions.OperationalError,e:
-            if isRetry == True:
-                self.log.error("Error on setInfo retry, giving up:\n" % str(e))
-                return
-            elif e[0] == SERVER_GONE_ERROR or e[0] == SERVER_LOST:
-                self.reconnect()
-                self.setInfo(playerId,info,True)
-                return
-            else:
-                self.log.error("Unknown error on setInfo, retrying:\n%s" % str(e))
-                self.reconnect()
-                self.setInfo(playerId,info,True)
+            return False
+
+        with self.lock:
+            self.pending[playerId] = (playerId,
+                                      info.avatarName,
+                                      info.playerName,
+                                      info.openChatEnabledYesNo,
+                                      info.location,
+                                      info.sublocation)
+            return len(self.pending) >= sbConfig.lastSeenBatchSize
+
+    def flush(self):
+        with self.lock:
+            if not self.pending or self.flushing:
+                # nothing to do, or another flush is on it
                 return
-        except Exception,e:
-            self.log.error("Unknown error on setInfo, giving up:\n%s" % str(e))
-            return
-                           
+            self.flushing = self.pending
+            self.pending = {}
+            rows = list(self.flushing.values())
+
+        def replace(conn):
+            cursor = conn.cursor()
+            # MySQLdb turns this into a single multi-row REPLACE
+            cursor.executemany(sbSQL.setInfoREPLACE,rows)
+            return True
+        done = self.pool.run("setInfo flush",replace,False)
+
+        with self.lock:
+            if not done:
+                # try again next time, unless there's something newer
+                for playerId,row in self.flushing.items():
+                    self.pending.setdefault(playerId,row)
+            self.flushing = {}
 
-    def getTableStatus(self,isRetry=False):
+        if done:
+            self.numFlushes += 1
+            self.numFlushedRows += len(rows)
+
+    def getTableStatus(self):
         if not self.sqlAvailable:
             return None
 
-        cursor = MySQLdb.cursors.DictCursor(self.db)
-        rows = 0
-        try:
-            cursor.execute("USE `%s`"%self.dbname)
+        def status(conn):
+            cursor = self.pool.cursor(conn)
             cursor.execute("show table status")
-            return cursor.fetchallDict()
-        except _mysql_exceptions.OperationalError,e:
-            if isRetry == True:
-                self.log.error("Error on getTableStatus retry, giving up:\n" % str(e))
-                return None
-            elif e[0] == SERVER_GONE_ERROR or e[0] == SERVER_LOST:
-                self.reconnect()
-                return self.getTableStatus(True)
-            else:
-                self.log.error("Unknown error on getTableStatus, retrying:\n%s" % str(e))
-                self.reconnect()
-                return self.getTableStatus(True)
-        except Exception,e:
-            self.log.error("Unknown error on getTableStatus, giving up:\n%s" % str(e))
-            return None
+            return cursor.fetchall()
+        return self.pool.run("getTableStatus",status)
+
+    def statCheck(self):
+        stats = {'lastSeenPending':len(self.pending),
+                 'lastSeenFlushes':self.numFlushes,
+                 'lastSeenFlushedRows':self.numFlushedRows}
+        stats.update(self.pool.statCheck())
+        return stats
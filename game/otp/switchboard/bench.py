@@ -1,57 +1,310 @@
-import sys,os
+import sys
 import time
+import random
+import asyncio
+import getopt
 
+import game.otp.switchboard.sbConfig as sbConfig
+from game.otp.switchboard.sbNode import sbNode
+from game.otp.switchboard.sbWedge import sbWedge
 
-import Pyro.util
-import Pyro.core
-import Pyro.naming
+# Define a usage string
+helpString ="""
+python -m game.otp.switchboard.bench [--nodes=<count,count,...>] [--players=<per node>] [--friends=<per player>] [--whispers=<number>] [--routing=<broadcast,friends>] [--locality=<fraction>]
 
-Pyro.core.initClient()
+Starts node/wedge pairs in this process, talking to each other over the
+bus on localhost, and times:
+  - presence: every player logs in and gets a friends list from a random
+    social graph, which the other nodes hear about, then half of them log
+    out.  --locality is the fraction of friends that are on the same node;
+  - whispers: players whisper to friends on other nodes.
+Throughput is counted in messages delivered to the receiving wedges.  For
+presence it also counts the messages sent over the bus and the remote
+players each node keeps track of, to compare the presence routings.  The
+databases are replaced by in-memory stand-ins and there's no DISL, friends
+lists are handed straight to the nodes.
 
-ns=Pyro.naming.NameServerLocator().getNS()
+Example:
 
-wedge1 = Pyro.core.getProxyForURI("PYRONAME://:sb.wedge.bench")
-wedge2 = Pyro.core.getProxyForURI("PYRONAME://:sb.wedge.tt")
+python -m game.otp.switchboard.bench --nodes=2,4,8 --players=500 --whispers=20000
+python -m game.otp.switchboard.bench --nodes=8 --players=2000 --friends=30 --routing=friends
+"""
 
-iters = 5000
+# Get the options
+try:
+    opts, pargs = getopt.getopt(sys.argv[1:], '', [
+        'nodes=',
+        'players=',
+        'friends=',
+        'whispers=',
+        'routing=',
+        'locality=',
+        ])
+except Exception as e:
+    print(e)
+    print(helpString)
+    sys.exit(1)
 
-players = []
+# Default values
+nodeCounts = [2, 4, 8]
+numPlayers = 500
+numFriends = 20
+numWhispers = 20000
+routings = ['broadcast', 'friends']
+locality = 0.8
 
-wedge2.enterPlayer(1,0)
-#for i in range(iters):
-#    wedge2.enterPlayer(i,0)
-#    #time.sleep(0.025)
+for opt in opts:
+    flag, value = opt
+    if (flag == '--nodes'):
+        nodeCounts = [int(count) for count in value.split(',')]
+    elif (flag == '--players'):
+        numPlayers = int(value)
+    elif (flag == '--friends'):
+        numFriends = int(value)
+    elif (flag == '--whispers'):
+        numWhispers = int(value)
+    elif (flag == '--routing'):
+        routings = value.split(',')
+    elif (flag == '--locality'):
+        locality = float(value)
+    else:
+        print("Error: Illegal option: " + flag)
+        print(helpString)
+        sys.exit(1)
 
-time.sleep(5)
+# Keep the per message logging quiet.
+sbConfig.logInfo = False
+sbConfig.logDebug = False
+sbConfig.logChat = False
 
-print '-------- BENCHMARK REMOTE OBJECT ---------'
-begin = time.time()
-#for f in funcs:
-voor = time.time()
-#wedge1._setOneway(["sendWhisper"])
-for i in range(iters):
-    #wedge._setOneway("sendWhisper")
-    wedge1.sendWhisper(1,1,"test")
-    #players.append(Pyro.core.getProxyForURI("PYRONAME://:sb.player.%d"%i))
-    #print i
-    #sys.stdout.flush()
-    ##testP = Pyro.core.getProxyForURI("PYRONAME://:sb.player.%d"%i)
-    #players[i]._setOneway("recvWhisper")
-    ##players[i].recvWhisper(5678,"Hey it's me")
 
-try:
-    duration = time.time()-begin
-    print 'total time %.4f seconds' % duration
-    print 'total method calls',iters
-    avg_pyro_msec = 1000.0*duration/(iters)
-    print 'avg. time per method call: %.4f' % avg_pyro_msec ,"msec"
-    print 'msg/sec: %.4f' % (iters/duration)
-except:
+class BenchInfo:
+    def __init__(self, playerName):
+        self.playerName = playerName
+        self.openChatFriendshipYesNo = 0
+        self.understandableYesNo = 0
+
+class BenchFriendsDB:
     pass
-sys.stdout.flush()
-time.sleep(5)
-wedge2.exitPlayer(1)
-#for i in range(iters):
-#    wedge2.exitPlayer(i)
 
+class BenchLastSeenDB:
+    def __init__(self):
+        self.info = {}
+
+    def setInfo(self, playerId, info):
+        self.info[playerId] = info
+
+    def getInfo(self, playerId):
+        return self.info.get(playerId) or BenchInfo("NotFound")
+
+    def getInfos(self, playerIds):
+        return dict((playerId, self.getInfo(playerId)) for playerId in playerIds)
+
+    def flush(self):
+        pass
+
+    def statCheck(self):
+        return {}
+
+class BenchMailDB:
+    def getMail(self, recipientId):
+        return ()
+
+class BenchWedge(sbWedge):
+    """
+    Counts what the node delivers, and wakes up whoever is waiting for a
+    number of them.
+    """
+    def __init__(self, wedgeName, nodeHost, nodePort, loop):
+        self.counts = {}
+        self.waiting = {}
+        self.lastTime = 0.
+        sbWedge.__init__(self, wedgeName, nodeHost=nodeHost, nodePort=nodePort,
+                         allowUnfilteredChat=1, loop=loop)
+
+    def count(self, name):
+        self.lastTime = time.perf_counter()
+        self.counts[name] = self.counts.get(name, 0) + 1
+        waiting = self.waiting.get(name)
+        if waiting and self.counts[name] >= waiting[0]:
+            waiting[1].set()
+
+    def expect(self, name, count):
+        event = asyncio.Event()
+        if self.counts.get(name, 0) >= count:
+            event.set()
+        self.waiting[name] = (count, event)
+        return event.wait()
+
+    def recvEnterRemotePlayer(self, playerId, playerInfo, friendsList):
+        self.count('enter')
+
+    def recvExitRemotePlayer(self, playerId, friendsList):
+        self.count('exit')
+
+    def recvFriendsUpdate(self, playerId, friends):
+        self.count('friends')
+
+    def recvWhisper(self, recipientId, senderId, msgText):
+        self.count('whisper')
+
+async def waitUntil(condition, timeout=10.):
+    end = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > end:
+            raise Exception("Timed out waiting for the cluster.")
+        await asyncio.sleep(0.01)
+
+async def pace(wedge):
+    # Backpressure: wait for the wedge's queue instead of letting it overflow.
+    if wedge.bus.isBacklogged():
+        await wedge.bus.drain()
+
+def report(name, count, duration):
+    print('  %-9s %8d messages in %7.3fs, %10.0f msg/sec' % (name, count, duration, count / duration))
+
+def countSent(nodes, wedges):
+    return sum(peer.numSent for obj in nodes + wedges for peer in obj.bus.peers.values())
+
+async def settle(nodes, wedges):
+    # Until every queue is empty and nothing has come in for a while.
+    buses = [obj.bus for obj in nodes + wedges]
+    received = None
+    while True:
+        await asyncio.sleep(0.02)
+        if any(peer.queue.qsize() for bus in buses for peer in bus.peers.values()):
+            continue
+        newReceived = sum(bus.numReceived for bus in buses)
+        if newReceived == received:
+            return
+        received = newReceived
+
+async def runCluster(numNodes, routing):
+    loop = asyncio.get_running_loop()
+    rng = random.Random(numNodes)
+    sbConfig.presenceRouting = routing
+
+    nodes = []
+    wedges = []
+    for i in range(numNodes):
+        name = 'bench%d' % i
+        node = sbNode(name, friendsDB=BenchFriendsDB(), lastSeenDB=BenchLastSeenDB(),
+                      mailDB=BenchMailDB(), loop=loop)
+        await node.start()
+        # Like startNode --peer, the others hear about us from the first.
+        if nodes:
+            node.recvNodeDirectory({nodes[0].nodeName: nodes[0].bus.getAddress()})
+        nodes.append(node)
+
+        wedge = BenchWedge(name, node.bus.host, node.bus.port, loop)
+        await wedge.start()
+        wedges.append(wedge)
+
+    await waitUntil(lambda: all(len(node.nodeList) == numNodes - 1 and node.wedge for node in nodes))
+    await settle(nodes, wedges)
+
+    # players[i] are the playerIds on node i
+    players = [list(range(i * numPlayers + 1, (i + 1) * numPlayers + 1)) for i in range(numNodes)]
+    allPlayers = sum(players, [])
+    playerNode = {}
+    for i in range(numNodes):
+        for playerId in players[i]:
+            playerNode[playerId] = i
+
+    # A random social graph, friendships go both ways.  With --locality
+    # most friends play on the same node.
+    friends = dict((playerId, {}) for playerId in allPlayers)
+    for playerId in allPlayers:
+        for n in range(numFriends // 2):
+            if rng.random() < locality:
+                friendId = rng.choice(players[playerNode[playerId]])
+            else:
+                friendId = rng.choice(allPlayers)
+            if friendId != playerId:
+                secret = rng.randint(0, 1)
+                friends[playerId][friendId] = secret
+                friends[friendId][playerId] = secret
+
+    for i, wedge in enumerate(wedges):
+        for playerId in players[i]:
+            wedge.enterPlayer(playerId, BenchInfo('player%d' % playerId))
+    await waitUntil(lambda: all(len(node.localPlayers) == numPlayers for node in nodes))
+    await settle(nodes, wedges)
+
+    print('%d nodes, %d players each, about %d friends per player (%d%% local), %s routing:' % (
+        numNodes, numPlayers, numFriends, locality * 100, routing))
+
+    # Presence: what DISL would do after each login.  Every node hears
+    # about every player, or about the players with a friend there.
+    expected = [0] * numNodes
+    for playerId in allPlayers:
+        if routing == 'friends':
+            hearing = set(playerNode[friendId] for friendId in friends[playerId])
+        else:
+            hearing = set(range(numNodes))
+        hearing.discard(playerNode[playerId])
+        for i in hearing:
+            expected[i] += 1
+    waits = [wedge.expect('enter', expected[i]) for i, wedge in enumerate(wedges)]
+    sent = countSent(nodes, wedges)
+    start = time.perf_counter()
+    for i, node in enumerate(nodes):
+        for playerId in players[i]:
+            node.recvFriendsList(playerId, [[friendId, secret] for friendId, secret in friends[playerId].items()])
+            if node.bus.isBacklogged():
+                await node.bus.drain()
+    await asyncio.gather(*waits)
+    report('enter', sum(expected), time.perf_counter() - start)
+    await settle(nodes, wedges)
+    print('            %d bus messages, %.0f remote players kept per node' % (
+        countSent(nodes, wedges) - sent, sum(len(node.remotePlayerLoc) for node in nodes) / float(numNodes)))
+
+    # Whispers to friends on other nodes.
+    pairs = [(playerId, friendId) for playerId in allPlayers for friendId in friends[playerId]
+             if playerNode[playerId] != playerNode[friendId]]
+    targets = [0] * numNodes
+    whispers = []
+    for n in range(numWhispers):
+        senderId, recipientId = rng.choice(pairs)
+        targets[playerNode[recipientId]] += 1
+        whispers.append((playerNode[senderId], recipientId, senderId))
+    waits = [wedge.expect('whisper', targets[i]) for i, wedge in enumerate(wedges)]
+    start = time.perf_counter()
+    for sender, recipientId, senderId in whispers:
+        wedges[sender].sendWhisper(recipientId, senderId, 'Hey, what\'s up?')
+        await pace(wedges[sender])
+    await asyncio.gather(*waits)
+    report('whisper', numWhispers, time.perf_counter() - start)
+
+    # Half of the players log out.  Who still hears about an exit depends
+    # on who has left already, so just wait for things to quiet down.
+    exiting = rng.sample(allPlayers, len(allPlayers) // 2)
+    sent = countSent(nodes, wedges)
+    start = time.perf_counter()
+    for playerId in exiting:
+        wedge = wedges[playerNode[playerId]]
+        wedge.exitPlayer(playerId)
+        await pace(wedge)
+    await settle(nodes, wedges)
+    report('exit', sum(wedge.counts.get('exit', 0) for wedge in wedges),
+           max(wedge.lastTime for wedge in wedges) - start)
+    print('            %d bus messages' % (countSent(nodes, wedges) - sent))
+
+    stats = [node.statCheck() for node in nodes]
+    print('  bus: %d sent in %d batches, %d dropped, %d failed' % (
+        sum(s['busSent'] for s in stats), sum(s['busBatches'] for s in stats),
+        sum(s['busDropped'] for s in stats), sum(s['busFailed'] for s in stats)))
+
+    for node in nodes:
+        node.bus.close()
+    for wedge in wedges:
+        wedge.bus.close()
+    # Let the connections see they're closed.
+    await asyncio.sleep(0.1)
+
+async def main():
+    for numNodes in nodeCounts:
+        for routing in routings:
+            await runCluster(numNodes, routing)
 
+asyncio.run(main())
@@ -0,0 +1,344 @@
+import asyncio
+import pickle
+import struct
+import traceback
+
+import game.otp.switchboard.sbConfig as sbConfig
+
+# Every frame is a 4 byte big endian length followed by a pickled
+# (method,args,callId,replyTo) tuple.  callId is None for one-way sends.
+frameHeader = struct.Struct("!I")
+
+def nodeBusName(nodeName):
+    return ":sb.node.%s"%nodeName
+
+def wedgeBusName(wedgeName):
+    return ":sb.wedge.%s"%wedgeName
+
+def encodeFrame(method,args,callId=None,replyTo=None):
+    data = pickle.dumps((method,args,callId,replyTo),pickle.HIGHEST_PROTOCOL)
+    return frameHeader.pack(len(data)) + data
+
+
+class sbPeer:
+    """
+    Outgoing link to one node or wedge on the bus.
+
+    Sends are one-way: post() encodes the message and puts it on this
+    peer's queue, and a writer task sends whatever is queued in one go
+    and only then waits for the socket to drain, so many messages are in
+    flight at once.  The queue holds at most sbConfig.busQueueSize
+    messages; when it is full, post() drops new messages for this peer
+    and counts them, and send() waits for room.  Past
+    sbConfig.busHighWater the peer counts as backlogged until it is back
+    under sbConfig.busLowWater, for callers that would rather wait than
+    have their messages dropped (see bench.py); the bus itself keeps
+    reading.  A write that doesn't drain within sbConfig.busCallTimeout
+    counts as a lost connection, so a peer that hangs only loses its own
+    messages.
+    """
+    def __init__(self,bus,name,address):
+        self.bus = bus
+        self.log = bus.log
+        self.name = name
+        self.address = address
+
+        self.queue = asyncio.Queue(sbConfig.busQueueSize)
+        self.drained = asyncio.Event()
+        self.drained.set()
+        self.writer = None
+        self.retryTime = 0.0
+        self.task = bus.loop.create_task(self._run())
+
+        self.numSent = 0
+        self.numBatches = 0
+        self.numDropped = 0
+        self.numFailed = 0
+
+    def close(self):
+        self.task.cancel()
+        self._disconnect()
+        self.drained.set()
+
+    def post(self,frame):
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            self.numDropped += 1
+            if self.numDropped % 1000 == 1:
+                self.log.warning("Queue to %s is full, dropped %d messages so far."%(self.name,self.numDropped))
+            return False
+
+        if self.queue.qsize() >= sbConfig.busHighWater:
+            self.drained.clear()
+        return True
+
+    async def send(self,frame):
+        # Like post, but waits for room in the queue instead of dropping.
+        await self.queue.put(frame)
+        if self.queue.qsize() >= sbConfig.busHighWater:
+            self.drained.clear()
+
+    def isBacklogged(self):
+        return not self.drained.is_set()
+
+    async def _connect(self):
+        if self.bus.loop.time() < self.retryTime:
+            return False
+        host,port = self.address
+        try:
+            reader,self.writer = await asyncio.wait_for(asyncio.open_connection(host,port),
+                                                        sbConfig.busConnectTimeout)
+        except (OSError,asyncio.TimeoutError) as e:
+            self.log.warning("Couldn't connect to %s at %s:%d (%s), retrying in %ss."%(
+                self.name,host,port,e,sbConfig.busReconnectDelay))
+            self.retryTime = self.bus.loop.time() + sbConfig.busReconnectDelay
+            return False
+
+        self.log.debug("Connected to %s at %s:%d."%(self.name,host,port))
+        return True
+
+    def _disconnect(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    async def _run(self):
+        while True:
+            frames = [await self.queue.get()]
+            while len(frames) < sbConfig.busMaxBatch and not self.queue.empty():
+                frames.append(self.queue.get_nowait())
+            if self.queue.qsize() < sbConfig.busLowWater:
+                self.drained.set()
+
+            try:
+                if self.writer is None and not await self._connect():
+                    self.numFailed += len(frames)
+                    continue
+
+                try:
+                    self.writer.write(b"".join(frames))
+                    await asyncio.wait_for(self.writer.drain(),sbConfig.busCallTimeout)
+                except (OSError,ConnectionError,asyncio.TimeoutError) as e:
+                    self.log.warning("Lost connection to %s (%r), %d messages not sent."%(self.name,e,len(frames)))
+                    self.numFailed += len(frames)
+                    self._disconnect()
+                    continue
+
+                self.numSent += len(frames)
+                self.numBatches += 1
+            finally:
+                for frame in frames:
+                    self.queue.task_done()
+
+
+class sbBus:
+    """
+    asyncio replacement for the Pyro daemon and name server.
+
+    Every node and wedge has a bus with a name (":sb.node.<name>" or
+    ":sb.wedge.<name>") that listens on a TCP port.  The directory maps
+    names to (host,port); it starts out as sbConfig.busDirectory and
+    nodes and wedges add themselves as they announce their entry.
+
+    Incoming messages are dispatched to methods of obj named in
+    obj.busMethods, one at a time, in the order they were sent.
+    call() is there for the few requests that want an answer (statCheck
+    and friends); everything else is one-way.
+    """
+    def __init__(self,name,obj,log,host=None,port=None,loop=None):
+        self.name = name
+        self.obj = obj
+        self.log = log
+        self.host = host or sbConfig.busHost
+        self.port = port or 0
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+
+        self.directory = dict(sbConfig.busDirectory)
+        self.peers = {}
+        self.server = None
+        # writers of the connections coming in
+        self.connections = set()
+
+        self.nextCallId = 0
+        self.pendingCalls = {}
+
+        self.numReceived = 0
+        self.numErrors = 0
+
+    def getAddress(self):
+        return (self.host,self.port)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handleConnection,self.host,self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.log.info("Accepting %s requests on %s:%d."%(self.name,self.host,self.port))
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        for writer in self.connections:
+            writer.close()
+        for peer in self.peers.values():
+            peer.close()
+        self.peers = {}
+        for future in self.pendingCalls.values():
+            future.cancel()
+        self.pendingCalls = {}
+
+    #---------------------------------
+    # Directory
+    #---------------------------------
+
+    def register(self,name,address):
+        address = tuple(address)
+        if self.directory.get(name) == address:
+            return
+        self.directory[name] = address
+        peer = self.peers.pop(name,None)
+        if peer is not None:
+            peer.close()
+
+    def unregister(self,name):
+        self.directory.pop(name,None)
+        peer = self.peers.pop(name,None)
+        if peer is not None:
+            peer.close()
+
+    def list(self,prefix):
+        return [name[len(prefix):] for name in self.directory if name.startswith(prefix)]
+
+    def getPeer(self,name):
+        peer = self.peers.get(name)
+        if peer is None:
+            address = self.directory.get(name)
+            if address is None:
+                return None
+            peer = self.peers[name] = sbPeer(self,name,address)
+        return peer
+
+    #---------------------------------
+    # Sending
+    #---------------------------------
+
+    def post(self,name,method,*args):
+        peer = self.getPeer(name)
+        if peer is None:
+            self.log.warning("%s is not on the bus, %s not sent."%(name,method))
+            return False
+        return peer.post(encodeFrame(method,args))
+
+    def broadcast(self,names,method,*args):
+        # Encoded once for everybody.
+        frame = encodeFrame(method,args)
+        for name in names:
+            peer = self.getPeer(name)
+            if peer is None:
+                self.log.warning("%s is not on the bus, %s not sent."%(name,method))
+            else:
+                peer.post(frame)
+
+    async def send(self,name,method,*args):
+        peer = self.getPeer(name)
+        if peer is None:
+            self.log.warning("%s is not on the bus, %s not sent."%(name,method))
+            return
+        await peer.send(encodeFrame(method,args))
+
+    async def call(self,name,method,*args):
+        peer = self.getPeer(name)
+        if peer is None:
+            raise KeyError(name)
+
+        self.nextCallId += 1
+        callId = self.nextCallId
+        future = self.pendingCalls[callId] = self.loop.create_future()
+        await peer.send(encodeFrame(method,args,callId,(self.name,self.getAddress())))
+        try:
+            return await asyncio.wait_for(future,sbConfig.busCallTimeout)
+        finally:
+            self.pendingCalls.pop(callId,None)
+
+    def isBacklogged(self):
+        # For senders that can wait, the bus doesn't stop reading for it.
+        for peer in self.peers.values():
+            if peer.isBacklogged():
+                return True
+        return False
+
+    async def drain(self):
+        for peer in list(self.peers.values()):
+            await peer.drained.wait()
+
+    async def flush(self,timeout=None):
+        # Waits until everything queued so far has been written out.
+        try:
+            await asyncio.wait_for(asyncio.gather(*[peer.queue.join() for peer in self.peers.values()]),
+                                   timeout)
+        except asyncio.TimeoutError:
+            self.log.warning("Timed out flushing %s."%self.name)
+
+    #---------------------------------
+    # Receiving
+    #---------------------------------
+
+    async def _handleConnection(self,reader,writer):
+        self.connections.add(writer)
+        try:
+            while True:
+                header = await reader.readexactly(frameHeader.size)
+                data = await reader.readexactly(frameHeader.unpack(header)[0])
+                # Never waits on our own outgoing queues: a full queue only
+                # drops messages for its own peer.
+                self._dispatch(*pickle.loads(data))
+        except (asyncio.IncompleteReadError,ConnectionError):
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    def _dispatch(self,method,args,callId,replyTo):
+        self.numReceived += 1
+
+        if method == "__reply__":
+            callId,result = args
+            future = self.pendingCalls.get(callId)
+            if future is not None and not future.done():
+                future.set_result(result)
+            return
+
+        if method not in self.obj.busMethods:
+            self.numErrors += 1
+            self.log.warning("%s has no bus method %s, ignored."%(self.name,method))
+            return
+
+        try:
+            result = getattr(self.obj,method)(*args)
+        except Exception:
+            self.numErrors += 1
+            self.log.error("Error handling %s:\n%s"%(method,traceback.format_exc()))
+            result = None
+
+        if callId is not None:
+            # replyTo is (name,address), the caller might not be in our directory yet.
+            self.register(*replyTo)
+            self.post(replyTo[0],"__reply__",callId,result)
+
+    def statCheck(self):
+        stats = {'busReceived':self.numReceived,
+                 'busErrors':self.numErrors,
+                 'busSent':0,
+                 'busBatches':0,
+                 'busDropped':0,
+                 'busFailed':0,
+                 'busQueued':0}
+        for peer in self.peers.values():
+            stats['busSent'] += peer.numSent
+            stats['busBatches'] += peer.numBatches
+            stats['busDropped'] += peer.numDropped
+            stats['busFailed'] += peer.numFailed
+            stats['busQueued'] += peer.queue.qsize()
+        return stats
@@ -26,6 +26,16 @@ lastSeenDBuser = "switchboard_user"
 lastSeenDBpasswd = "0bhctiws"
 lastSeenDBdb = "switchboard"
 
+# MySQL connections kept open per database
+dbPoolSize = 4
+# last seen rows are written every lastSeenFlushPeriod seconds, or as soon
+# as lastSeenBatchSize players are waiting
+lastSeenFlushPeriod = 5
+lastSeenBatchSize = 500
+# FriendInfo of players that aren't online here, kept for friends lists
+friendInfoCacheSize = 20000
+friendInfoCacheTTL = 60
+
 
 # SB name server
 nsHost = "localhost"
@@ -33,6 +43,28 @@ nsPort = 6053
 
 webMonitorPort = 8888
 
+# SB message bus
+busHost = "localhost"
+# name -> (host,port) of nodes and wedges we know about before they announce
+# themselves, e.g. {":sb.node.pirates":("sbhost",6110)}
+busDirectory = {}
+# messages queued per peer; past the high water mark the peer is backlogged
+# until the queue is back under the low water mark, when it's full we drop
+busQueueSize = 10000
+busHighWater = 5000
+busLowWater = 1000
+# messages written per socket write
+busMaxBatch = 512
+busConnectTimeout = 10
+busReconnectDelay = 5
+busCallTimeout = 10
+
+# Who hears about players entering and exiting.  "broadcast" sends every
+# enter/exit to every node.  "friends" only sends them to nodes that have a
+# friend of the player online, through the player's home node.  Every node
+# in a cluster has to use the same one.
+presenceRouting = "broadcast"
+
 # Chat logger
 chatLogHost = "vrops73.starwave.com"
 chatLogPort = 6060
@@ -0,0 +1,135 @@
+import queue
+import threading
+
+import MySQLdb
+import MySQLdb.cursors
+import MySQLdb.constants.CR
+
+import game.otp.switchboard.sbConfig as sbConfig
+
+SERVER_GONE_ERROR = MySQLdb.constants.CR.SERVER_GONE_ERROR
+SERVER_LOST = MySQLdb.constants.CR.SERVER_LOST
+
+class sbDBPool:
+    """
+    A few MySQL connections to one database, shared by whoever needs
+    them, from the node's thread or its executor.  Connections are opened
+    with the database selected, so there's no USE per query.
+
+    run() hands a connection to a function and commits after it.  If
+    the server went away the connection is thrown out and the function
+    is tried once more on a fresh one; any other error is logged and
+    the default is returned, like the old per-call retry code did.
+    """
+    def __init__(self,log,host,port,user,passwd,db,size=None):
+        self.log = log
+        self.host = host
+        self.port = port
+        self.user = user
+        self.passwd = passwd
+        self.dbname = db
+        self.size = size or sbConfig.dbPoolSize
+
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.numOpen = 0
+
+        self.numQueries = 0
+        self.numRetries = 0
+        self.numErrors = 0
+
+        try:
+            self.release(self._connect())
+        except MySQLdb.OperationalError as e:
+            self.log.warning("Failed to connect to MySQL db %s at %s:%d: %s"%(db,host,port,str(e)))
+            self.available = False
+            return
+
+        self.available = True
+        self.log.info("Connected to MySQL db %s at %s:%d."%(db,host,port))
+
+    def _connect(self):
+        conn = MySQLdb.connect(host=self.host,
+                               port=self.port,
+                               user=self.user,
+                               passwd=self.passwd,
+                               db=self.dbname)
+        with self.lock:
+            self.numOpen += 1
+        return conn
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            full = self.numOpen >= self.size
+        if full:
+            return self.idle.get(timeout=sbConfig.busCallTimeout)
+        return self._connect()
+
+    def release(self,conn):
+        self.idle.put(conn)
+
+    def discard(self,conn):
+        with self.lock:
+            self.numOpen -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(conn)
+
+    def run(self,name,func,default=None):
+        if not self.available:
+            return default
+
+        for attempt in range(2):
+            try:
+                conn = self.acquire()
+            except (MySQLdb.OperationalError,queue.Empty) as e:
+                self.numErrors += 1
+                self.log.error("No connection for %s, giving up:\n%s" % (name,str(e)))
+                return default
+
+            try:
+                self.numQueries += 1
+                result = func(conn)
+                conn.commit()
+            except MySQLdb.OperationalError as e:
+                self.discard(conn)
+                if attempt == 0 and e.args[0] in (SERVER_GONE_ERROR,SERVER_LOST):
+                    self.numRetries += 1
+                    self.log.debug("MySQL server was missing in %s, retrying on a new connection."%name)
+                    continue
+                self.numErrors += 1
+                self.log.error("Error in %s, giving up:\n%s" % (name,str(e)))
+                return default
+            except Exception as e:
+                self.discard(conn)
+                self.numErrors += 1
+                self.log.error("Unknown error in %s, giving up:\n%s" % (name,str(e)))
+                return default
+
+            self.release(conn)
+            return result
+
+        return default
+
+    def cursor(self,conn):
+        return conn.cursor(MySQLdb.cursors.DictCursor)
+
+    def statCheck(self):
+        return {'dbConnections':self.numOpen,
+                'dbQueries':self.numQueries,
+                'dbRetries':self.numRetries,
+                'dbErrors':self.numErrors}
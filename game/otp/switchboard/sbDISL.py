@@ -0,0 +1,34 @@
+from game.otp.switchboard.xd.ChannelManager import ChannelListener
+from game.otp.switchboard.xd.ChannelManager import ChannelMessage
+import game.otp.switchboard.sbConfig as sbConfig
+
+class sbDISLListener(ChannelListener):
+    """
+    Connects an sbNode to the DISL MD.  Messages from DISL are handed to
+    the node's rcvMessage.
+    """
+    def __init__(self,node,chanMgr):
+        ChannelListener.__init__(self,node.nodeName,chanMgr)
+        self.node = node
+        self.log = node.log
+        self.channelList = [sbConfig.DISL2SBChannel,sbConfig.DISL2SBChannel+node.nodeName]
+        self.joinChannels()
+
+    def joinChannels(self):
+        self.log.debug("Joining channels: %s" % str(self.channelList))
+        for channel in self.channelList:
+            self.startChannelListen(channel)
+
+    def rcvMessage(self,message):
+        self.node.rcvMessage(message)
+
+    def requestFriends(self,playerId):
+        # DISL will send the list back and hit handleDISLSendFriendsList
+        self.log.debug("Sending msg to DISL: %s %s %s %s" % (sbConfig.SB2DISLChannel,
+                                                             sbConfig.DISL2SBChannel+self.node.nodeName,
+                                                             sbConfig.FC_DISLGetFriends,
+                                                             "%d"%playerId))
+        self.broadcastMessage(ChannelMessage(sbConfig.SB2DISLChannel,
+                                             sbConfig.DISL2SBChannel+self.node.nodeName,
+                                             sbConfig.FC_DISLGetFriends,
+                                             "%d"%playerId))
@@ -0,0 +1,81 @@
+import time
+from collections import OrderedDict
+
+import game.otp.switchboard.sbConfig as sbConfig
+
+class sbInfoCache:
+    """
+    FriendInfo of players that aren't on this node or in remotePlayerInfo,
+    so a friends list only costs a query for the ones we haven't seen
+    lately.  Least recently used entries go once there are
+    friendInfoCacheSize of them, and nothing is kept for more than
+    friendInfoCacheTTL seconds since players can log in and out on nodes
+    we don't hear from.  The node invalidates a player when it sees them
+    enter or exit.
+
+    The cache doesn't load anything itself: the node looks players up
+    here and loads the missing ones from LastSeenDB in its executor.
+    """
+    def __init__(self,size=None,ttl=None):
+        self.size = size or sbConfig.friendInfoCacheSize
+        self.ttl = ttl or sbConfig.friendInfoCacheTTL
+
+        # playerId -> (expiry time,FriendInfo), oldest use first
+        self.entries = OrderedDict()
+
+        self.numHits = 0
+        self.numMisses = 0
+        self.numLoads = 0
+
+    def _lookup(self,playerId,now):
+        entry = self.entries.get(playerId)
+        if entry is None:
+            return None
+        if entry[0] < now:
+            del self.entries[playerId]
+            return None
+        self.entries.move_to_end(playerId)
+        return entry[1]
+
+    def put(self,playerId,info):
+        self.entries[playerId] = (time.monotonic() + self.ttl,info)
+        self.entries.move_to_end(playerId)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self,playerId):
+        self.entries.pop(playerId,None)
+
+    def lookup(self,playerIds):
+        """
+        Returns ({playerId:FriendInfo},missing playerIds).
+        """
+        now = time.monotonic()
+        infos = {}
+        missing = []
+        for playerId in set(playerIds):
+            info = self._lookup(playerId,now)
+            if info is None:
+                missing.append(playerId)
+            else:
+                infos[playerId] = info
+        self.numHits += len(infos)
+        self.numMisses += len(missing)
+        return infos,missing
+
+    def putMany(self,infos):
+        # What the node loaded for the missing ones.
+        self.numLoads += 1
+        for playerId,info in infos.items():
+            self.put(playerId,info)
+
+    def statCheck(self):
+        lookups = self.numHits + self.numMisses
+        hitRate = 0.0
+        if lookups > 0:
+            hitRate = float(self.numHits) / lookups
+        return {'infoCacheSize':len(self.entries),
+                'infoCacheHits':self.numHits,
+                'infoCacheMisses':self.numMisses,
+                'infoCacheLoads':self.numLoads,
+                'infoCacheHitRate':hitRate}
@@ -1,8 +1,8 @@
 import sys
 import time
 import socket
-import Queue
-import sbConfig
+import collections
+import game.otp.switchboard.sbConfig as sbConfig
 
 class sbLog:
     def __init__(self,name,clHost=None,clPort=6060):
@@ -10,7 +10,7 @@ class sbLog:
         self.clHost = clHost
         self.clPort = clPort
 
-        self.inMemLog = Queue.Queue()
+        self.inMemLog = collections.deque(maxlen=sbConfig.logMaxLinesInMemory)
 
         if clHost:
             # init UDP stuff
@@ -22,27 +22,23 @@ class sbLog:
 
     def output(self,level,msg):
         str = "%s %s(%s): %s"%(self.timeString(),self.name,level,msg)
-        print str
+        print(str)
         self.memLog(str)
         sys.stdout.flush()
 
     def chatoutput(self,msg):
         str = "%s %s(chat): %s"%(self.timeString(),self.name,msg)
-        print str
+        print(str)
         self.memLog(str)
         sys.stdout.flush()
 
     def memLog(self,str):
-        self.inMemLog.put(str)
-        while self.inMemLog.qsize() > sbConfig.logMaxLinesInMemory:
-            self.inMemLog.get()
+        self.inMemLog.append(str)
 
     def getMemLog(self):
         res = ""
-        for i in xrange(self.inMemLog.qsize()):
-            s = self.inMemLog.get()
+        for s in self.inMemLog:
             res += s + "\n"
-            self.inMemLog.put(s)
         return res
 
     def remoteLog(self,
@@ -61,7 +57,7 @@ class sbLog:
                                                     destSys,destAcctId,destAvId,chatType,filtered,
                                                     chatText)
         self.debug("Remote log entry sent: %s"%outstr)
-        self.sock.sendto(outstr,(self.clHost,self.clPort))
+        self.sock.sendto(outstr.encode('utf-8'),(self.clHost,self.clPort))
 
     def fatal(self,message):
         if sbConfig.logFatal:
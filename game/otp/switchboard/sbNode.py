@@ -1,40 +1,64 @@
-import Pyro.core
-import Pyro.naming
-import Pyro.errors
+import asyncio
 import sys
 import time
+import zlib
 
-from sbLog import sbLog
-import sbConfig
-
-from Pyro.errors import ConnectionClosedError
-from Pyro.errors import ProtocolError
-
-from game.otp.switchboard.xd.ChannelManager import ChannelListener
-from game.otp.switchboard.xd.ChannelManager import ChannelMessage
+from game.otp.switchboard.sbLog import sbLog
+from game.otp.switchboard.sbBus import sbBus,nodeBusName,wedgeBusName
+from game.otp.switchboard.sbInfoCache import sbInfoCache
+import game.otp.switchboard.sbConfig as sbConfig
 
 if sbConfig.scrubMessages:
-    import badwordpy
+    from game.otp.switchboard import badwordpy
     badwordpy.init("","")
 
-class sbNode(Pyro.core.SynchronizedObjBase,ChannelListener):
+class sbNode:
+    # Methods other nodes and our wedge may call over the bus.
+    busMethods = frozenset(["shutdown",
+                            "healthCheck",
+                            "statCheck",
+                            "getLogTail",
+                            "recvEnterNode",
+                            "recvExitNode",
+                            "recvNodeDirectory",
+                            "recvEnterWedge",
+                            "recvExitWedge",
+                            "recvEnterLocalPlayer",
+                            "recvExitLocalPlayer",
+                            "recvEnterRemotePlayer",
+                            "recvExitRemotePlayer",
+                            "recvSubscribe",
+                            "recvUnsubscribe",
+                            "recvPublishEnter",
+                            "recvPublishExit",
+                            "recvPresenceList",
+                            "addFriendship",
+                            "removeFriendship",
+                            "recvSecretRequest",
+                            "recvSecretRedeem",
+                            "sendWhisper",
+                            "recvWhisper",
+                            "sendSCWhisper",
+                            "recvSCWhisper",
+                            "sendMail",
+                            "sendSCMail",
+                            "recvMailUpdate",
+                            "getMail",
+                            "deleteMail"])
+
     def __init__(self,
                  nodeName,
                  wedgeName="",
-                 nsHost=None,
-                 nsPort=None,
+                 listenHost=None,
                  listenPort=None,
                  clHost=None,
                  clPort=None,
                  chanMgr=None,
-                 dislURL=None):
-        
-        ChannelListener.__init__(self,nodeName,chanMgr)
-
-        Pyro.config.PYRO_MULTITHREADED = 0
-
-        Pyro.core.SynchronizedObjBase.__init__(self)
-        Pyro.core.initServer(banner=0)
+                 dislURL=None,
+                 friendsDB=None,
+                 lastSeenDB=None,
+                 mailDB=None,
+                 loop=None):
 
         self.log = sbLog(":sb.node.%s"%nodeName,clHost,clPort)
 
@@ -44,43 +68,94 @@ class sbNode(Pyro.core.SynchronizedObjBase,ChannelListener):
         else:
             self.wedgeName = wedgeName
 
+        # bus name of our wedge, or None
         self.wedge = None
         self.nodeList = []
-        self.nodeProxy = {}
 
         self.id2Friends = {}
 
+        self.localPlayers = {}
+        self.remotePlayerLoc = {}
+        self.remotePlayerInfo = {}
+
+        # presenceRouting "friends" only, see getHomeNode
+        self.presenceRouting = sbConfig.presenceRouting
+        # local players whose enter has gone out
+        self.publishedPlayers = set()
+        # friendId -> set of local playerIds who are friends with them
+        self.friendInterest = {}
+        # players whose home we are: playerId -> (nodeName,playerInfo,friendsList)
+        self.homeLoc = {}
+        # players whose home we are: playerId -> set of nodes to tell
+        self.homeSubscribers = {}
+
+        self.servedLogins = 0
+        self.servedChat = 0
+        self.servedChatSC = 0
+        self.servedMail = 0
+        self.servedMailSC = 0
+
         self.log.info("Starting.")
 
         # DISL SOAP init (temporary)
-        from PlayerFriendsDB import PlayerFriendsDB
-        self.friendsDB = PlayerFriendsDB(self.log,dislURL)
+        if friendsDB is None:
+            from game.otp.switchboard.PlayerFriendsDB import PlayerFriendsDB
+            friendsDB = PlayerFriendsDB(self.log,dislURL)
+        self.friendsDB = friendsDB
 
         # DISL MD init
-        self.channelList = [sbConfig.DISL2SBChannel,sbConfig.DISL2SBChannel+self.nodeName]
-        self.joinChannels()
-        
+        self.disl = None
+        if chanMgr is not None:
+            from game.otp.switchboard.sbDISL import sbDISLListener
+            self.disl = sbDISLListener(self,chanMgr)
+
         # db init
 
-        from LastSeenDB import LastSeenDB
-        self.lastSeenDB = LastSeenDB(log=self.log,
-                                     host=sbConfig.lastSeenDBhost,
-                                     port=sbConfig.lastSeenDBport,
-                                     user=sbConfig.lastSeenDBuser,
-                                     passwd=sbConfig.lastSeenDBpasswd,
-                                     dbname=sbConfig.lastSeenDBdb)
-
-        from sbMaildb import sbMaildb
-        self.mailDB = sbMaildb(log=self.log,
-                               host=sbConfig.mailDBhost,
-                               port=sbConfig.mailDBport,
-                               user=sbConfig.mailDBuser,
-                               passwd=sbConfig.mailDBpasswd,
-                               db=sbConfig.mailDBdb)
-                               
-        # pyro init
-        
-        self.initPyro(nsHost,nsPort,listenPort)
+        if lastSeenDB is None:
+            from game.otp.switchboard.LastSeenDB import LastSeenDB
+            lastSeenDB = LastSeenDB(log=self.log,
+                                    host=sbConfig.lastSeenDBhost,
+                                    port=sbConfig.lastSeenDBport,
+                                    user=sbConfig.lastSeenDBuser,
+                                    passwd=sbConfig.lastSeenDBpasswd,
+                                    dbname=sbConfig.lastSeenDBdb)
+        self.lastSeenDB = lastSeenDB
+        self.infoCache = sbInfoCache()
+
+        if mailDB is None:
+            from game.otp.switchboard.sbMaildb import sbMaildb
+            mailDB = sbMaildb(log=self.log,
+                              host=sbConfig.mailDBhost,
+                              port=sbConfig.mailDBport,
+                              user=sbConfig.mailDBuser,
+                              passwd=sbConfig.mailDBpasswd,
+                              db=sbConfig.mailDBdb)
+        self.mailDB = mailDB
+
+        # bus init
+
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+        self.loop = loop
+        self.bus = sbBus(nodeBusName(nodeName),self,self.log,listenHost,listenPort,loop)
+        self.stopped = asyncio.Event()
+        # set when lastSeenDB has a full batch waiting
+        self.lastSeenFull = asyncio.Event()
+        # requests waiting on the databases, see _startTask
+        self.tasks = set()
+
+        if not loop.is_running():
+            loop.run_until_complete(self.start())
+
+    async def start(self):
+        """
+        Starts listening and announces us to our wedge and the other
+        nodes.  Called by the constructor unless the event loop is
+        already running, in which case the caller awaits it.
+        """
+        await self.bus.start()
+        self.flushTask = self.loop.create_task(self.flushLastSeen())
 
         self.updateWedge()
         self.updateNodes()
@@ -89,59 +164,56 @@ class sbNode(Pyro.core.SynchronizedObjBase,ChannelListener):
         self.sendEnterNode()
         self.log.debug("Exit sendEnterNode")
 
-        self.localPlayers = {}
-        self.remotePlayerLoc = {}
-        self.remotePlayerInfo = {}
-
-        self.servedLogins = 0        
-        self.servedChat = 0
-        self.servedChatSC = 0
-        self.servedMail = 0
-        self.servedMailSC = 0
-
         self.log.info("-- sb.node.%s is ready. --" %self.nodeName)
 
     def joinChannels(self):
-        self.log.debug("Joining channels: %s" % str(self.channelList))
-        for channel in self.channelList:
-            self.startChannelListen(channel)
+        if self.disl is not None:
+            self.disl.joinChannels()
 
     def shutdown(self):
-        self.pyroDaemon.disconnect(self)
         self.sendExitNode()
         self.log.info("shutdown() called.  Shutting down cleanly.")
-        self.pyroDaemon.shutdown(True)
-
-
-    def initPyro(self,nsHost,nsPort,listenPort):
-        if nsHost is None:
-            self.log.warning("No NS host/port specified, trying location via broadcast.")
-            self.nameServer = Pyro.naming.NameServerLocator().getNS()
-        else:
-            self.log.info("Connecting to NS at %s:%d." % (nsHost,nsPort))
-            self.nameServer = Pyro.naming.NameServerLocator().getNS(host=nsHost,port=nsPort)
-
-        if listenPort is not None:
-            self.log.info("Accepting Pyro requests on port %d."%listenPort)
-            Pyro.config.PYRO_PORT = listenPort
-            Pyro.config.PYRO_PORT_RANGE = 1
-            
-        self.pyroDaemon = Pyro.core.Daemon()
-        self.pyroDaemon.useNameServer(self.nameServer)
-        try:
-            self.nameServer.createGroup(":sb")
-            self.nameServer.createGroup(":sb.node")
-            self.nameServer.createGroup(":sb.player")
-            self.nameServer.createGroup(":sb.wedge")
-        except Pyro.errors.NamingError:
-            pass
-        try:
-            self.pyroDaemon.connectPersistent(self,":sb.node.%s"%self.nodeName)
-        except Pyro.errors.NamingError:
-            self.log.debug(":sb.node.%s was already registered, overwriting old entry."%self.nodeName)
-            self.nameServer.unregister(":sb.node.%s"%self.nodeName)
-            self.pyroDaemon.connectPersistent(self,":sb.node.%s"%self.nodeName)
-
+        self.loop.create_task(self._shutdown())
+
+    async def _shutdown(self):
+        await self.bus.flush(sbConfig.busCallTimeout)
+        self.bus.close()
+        self.flushTask.cancel()
+        await asyncio.gather(*self.tasks,return_exceptions=True)
+        await self.loop.run_in_executor(None,self.lastSeenDB.flush)
+        self.stopped.set()
+
+    async def flushLastSeen(self):
+        # The writes are batched up in lastSeenDB, send them off now and
+        # then without holding up the loop.
+        while True:
+            try:
+                await asyncio.wait_for(self.lastSeenFull.wait(),sbConfig.lastSeenFlushPeriod)
+            except asyncio.TimeoutError:
+                pass
+            self.lastSeenFull.clear()
+            await self.loop.run_in_executor(None,self.lastSeenDB.flush)
+
+    def _startTask(self,coro):
+        # The databases block, so bus methods that need them hand the
+        # work to a task that waits on the executor, and return.
+        task = self.loop.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self._taskDone)
+
+    def _taskDone(self,task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.log.error("Error in %s: %r"%(task.get_coro().__qualname__,task.exception()))
+
+    async def _runDB(self,func,*args):
+        return await self.loop.run_in_executor(None,func,*args)
+
+    def sendToWedge(self,method,*args):
+        if self.wedge is None:
+            self.log.warning("%s: No wedge connected!"%method)
+            return
+        self.bus.post(self.wedge,method,*args)
 
 
     # ---------------------------
@@ -184,37 +256,45 @@ class sbNode(Pyro.core.SynchronizedObjBase,ChannelListener):
                                                                       message.otherData))
         else:
             # we should not be here!
-            self.log.warning("Got an MD message with a weird target channel:" % message.targetChannel)
+            self.log.warning("Got an MD message with a weird target channel: %s" % message.targetChannel)
             self.log.warning("Offending message:  %s %s %s %s" % (message.targetChannel,
                                                                 message.responseChannel,
                                                                 message.functionCode,
                                                                 message.otherData))
 
+    def parseDISLFriends(self,message):
+        # "playerId|friendId|secret|friendId|secret..."
+        tempVals = str(message.otherData).split('|')
+        friendOne = int(tempVals[0])
+
+        friends = []
+
+        for i in range(1,len(tempVals)-1,2):
+            friends.append([int(tempVals[i]),int(tempVals[i+1])])
+
+        return friendOne,friends
+
     def handleDISLSendFriendsList(self,message):
         """
         Handle a "here are your friends" message (DISL -> SB).
-        Add the friendships to users' in-memory friends lists.
-        Let users know about the friendships.
         """
         try:
-            # parse the message
-            tempVals = str(message.otherData).split('|')
-            #self.log.debug(str(tempVals))
-            friendOne = int(tempVals[0])
-
-            friends = []
-
-            for i in xrange(1,len(tempVals)-1,2):
-                friends.append([int(tempVals[i]),int(tempVals[i+1])])
-            #self.log.debug(str(friends))
-        except Exception,e:
+            friendOne,friends = self.parseDISLFriends(message)
+        except Exception as e:
             self.parsingError(message)
-            self.log.error(str(e))   
+            self.log.error(str(e))
             return
 
+        self.recvFriendsList(friendOne,friends)
+
+    def recvFriendsList(self,friendOne,friends):
+        """
+        Add the friendships to users' in-memory friends lists.
+        Let users know about the friendships.
+        """
         #self.log.debug("localPlayers: %s"%self.localPlayers)
 
-        if self.localPlayers.has_key(friendOne):
+        if friendOne in self.localPlayers:
             # add the new friendships
             for friend in friends:
                 friendTwo = friend[0]
@@ -240,17 +320,8 @@ class sbNode(Pyro.core.SynchronizedObjBase,ChannelListener):
         """
         #self.log.debug("handleDISLSendNewFriendship")
         try:
-            # parse the message
-            tempVals = str(message.otherData).split('|')
-            #self.log.debug(str(tempVals))
-            friendOne = int(tempVals[0])
-
-            friends = []
-
-            for i in xrange(1,len(tempVals)-1,2):
-                friends.append([int(tempVals[i]),int(tempVals[i+1])])
-            #self.log.debug(str(friends))
-        except Exception,e:
+            friendOne,friends = self.parseDISLFriends(message)
+        except Exception as e:
             self.parsingError(message)
             self.log.error(str(e))
             return
@@ -265,12 +336,14 @@ class sbNode(Pyro.core.SynchronizedObjBase,ChannelListener):
         else:
             secret = False
 
-        if self.id2Friends.has_key(friendOne):
+        if friendOne in self.id2Friends:
             self.id2Friends[friendOne][friendTwo] = secret
+            self.subscribeFriends(friendOne,[friendTwo])
             self.sendLocalFriendsUpdate(friendOne,[[friendTwo,secret],])
 
-        if self.id2Friends.has_key(friendTwo):
+        if friendTwo in self.id2Friends:
             self.id2Friends[friendTwo][friendOne] = secret
+            self.subscribeFriends(friendTwo,[friendOne])
             self.sendLocalFriendsUpdate(friendTwo,[[friendOne,secret],])
 
 
@@ -294,16 +367,18 @@ class sbNode(Pyro.core.SynchronizedObjBase,ChannelListener):
         #self.log.debug("Friends before removal: %s" % str(self.id2Friends))
 
         # update my in-memory lists
-        if self.id2Friends.has_key(friendOne):
+        if friendOne in self.id2Friends:
             self.id2Friends[friendOne].pop(friendTwo,None)
+            self.unsubscribeFriends(friendOne,[friendTwo])
 
-        if self.id2Friends.has_key(friendTwo):
+        if friendTwo in self.id2Friends:
             self.id2Friends[friendTwo].pop(friendOne,None)
+            self.unsubscribeFriends(friendTwo,[friendOne])
 
         #self.log.debug("Friends after removal: %s" % str(self.id2Friends))
 
         # notify both friends
-        if self.localPlayers.has_key(friendOne) or self.localPlayers.has_key(friendTwo):
+        if friendOne in self.localPlayers or friendTwo in self.localPlayers:
             self.sendLocalFriendshipRemoved(friendOne,friendTwo)
 
 
@@ -311,7 +386,7 @@ class sbNode(Pyro.core.SynchronizedObjBase,ChannelListener):
         self.log.error("Couldn't parse MD message: %s %s %s %s" % (message.targetChannel,
                                                                    message.responseChannel,
                                                                    message.functionCode,
-                                                                   message.otherData))        
+                                                                   message.otherData))
 
 
     #---------------------------------
@@ -327,110 +402,94 @@ class sbNode(Pyro.core.SynchronizedObjBase,ChannelListener):
             for key in self.id2Friends:
                 avgFriends += len(self.id2Friends[key])
             avgFriends /= len(self.id2Friends)
-        return {'onlinePlayers':len(self.localPlayers),
-                'avgFriends':avgFriends,
-                'servedLogins':self.servedLogins,
-                'servedChat':self.servedChat,
-                'servedChatSC':self.servedChatSC,
-                'servedMail':self.servedMail,
-                'servedMailSC':self.servedMailSC}
+        stats = {'onlinePlayers':len(self.localPlayers),
+                 'avgFriends':avgFriends,
+                 'servedLogins':self.servedLogins,
+                 'servedChat':self.servedChat,
+                 'servedChatSC':self.servedChatSC,
+                 'servedMail':self.servedMail,
+                 'servedMailSC':self.servedMailSC,
+                 'remotePlayers':len(self.remotePlayerLoc),
+                 'homePlayers':len(self.homeLoc),
+                 'friendSubscriptions':len(self.friendInterest)}
+        stats.update(self.bus.statCheck())
+        stats.update(self.lastSeenDB.statCheck())
+        stats.update(self.infoCache.statCheck())
+        return stats
+
+    def getNodeDirectory(self):
+        directory = {self.nodeName:self.bus.getAddress()}
+        for node in self.nodeList:
+            directory[node] = self.bus.directory[nodeBusName(node)]
+        return directory
 
     def sendEnterNode(self):
         if self.wedge:
             self.log.debug("poking wedge")
-            try:
-                self.wedge.recvEnterNode(self.nodeName)
-            except Exception,e:
-                self.log.info("Couldn't contact sb.wedge.%s, wedge is None." % self.nodeName)
-                self.wedge = None
+            self.bus.post(self.wedge,"recvEnterNode",self.nodeName,self.bus.getAddress())
 
-        for node in self.nodeList:
-            self.log.debug("poking node %s" % node)
-            try:
-                proxy = self.nodeProxy[node]
-                proxy.recvEnterNode(self.nodeName)
-            except Exception,e:
-                self.log.info("Couldn't contact sb.node.%s, removing from nodelist." % node)
-                self.nodeList.remove(node)
-                del self.nodeProxy[node]
+        self.log.debug("poking nodes %s" % self.nodeList)
+        self.bus.broadcast([nodeBusName(node) for node in self.nodeList],
+                           "recvEnterNode",self.nodeName,self.bus.getAddress())
 
     def sendExitNode(self):
-        try:
-            if self.wedge:
-                self.wedge.recvExitNode(self.nodeName)
+        if self.wedge:
+            self.bus.post(self.wedge,"recvExitNode",self.nodeName)
 
-            for node in self.nodeList:
-                proxy = self.nodeProxy[node]
-                proxy._setOneway(["recvExitNode"])
-                proxy.recvExitNode(self.nodeName)
-        except:
-            pass
+        self.bus.broadcast([nodeBusName(node) for node in self.nodeList],
+                           "recvExitNode",self.nodeName)
 
-    def recvEnterNode(self,nodeName):
+    def recvEnterNode(self,nodeName,address):
         self.log.debug("Received enterNode(%s)"%nodeName)
-        # clear all players present on the remote node
+        isNew = nodeName not in self.nodeList
+        self.bus.register(nodeBusName(nodeName),address)
+        self.updateNodes()
+        if isNew:
+            # let it know about the nodes it may not have heard of
+            self.bus.post(nodeBusName(nodeName),"recvNodeDirectory",self.getNodeDirectory())
+
+    def recvNodeDirectory(self,directory):
+        for nodeName,address in directory.items():
+            if nodeName != self.nodeName and nodeName not in self.nodeList:
+                self.log.debug("Heard of node %s"%nodeName)
+                self.bus.register(nodeBusName(nodeName),address)
+                self.bus.post(nodeBusName(nodeName),"recvEnterNode",self.nodeName,self.bus.getAddress())
         self.updateNodes()
 
     def recvExitNode(self,nodeName):
         self.log.debug("Received exitNode(%s)"%nodeName)
-        # clear all players present on the remote node
+        self.bus.unregister(nodeBusName(nodeName))
+        if self.presenceRouting == "friends":
+            self.dropNodePresence(nodeName)
         self.updateNodes()
 
-    def recvEnterWedge(self,wedgeName):
+    def recvEnterWedge(self,wedgeName,address):
         self.log.debug("Received enterWedge(%s)."%wedgeName)
         self.wedgeName = wedgeName
+        self.bus.register(wedgeBusName(wedgeName),address)
         # clear all local players?
         self.updateWedge()
 
     def recvExitWedge(self,wedgeName):
         self.log.debug("Received exitWedge(%s)."%wedgeName)
+        self.bus.unregister(wedgeBusName(wedgeName))
         # clear all local players?
         self.updateWedge()
-    
+
     def updateWedge(self):
-        try:
-            self.wedge = Pyro.core.getProxyForURI(self.nameServer.resolve(":sb.wedge.%s"%self.wedgeName))
-            self.wedge._setOneway(["recvEnterNode",
-                                   "recvExitNode",
-                                   "recvEnterRemotePlayer",
-                                   "recvExitRemotePlayer",
-                                   "recvFriendsUpdate",
-                                   "recvFriendshipRemoved",
-                                   "recvWhisper",
-                                   "recvSCWhisper",       
-                                   "recvWhisperFailed",
-                                   "recvSCWhisperFailed",
-                                   "recvMailUpdate",
-                                   "recvMail",
-                                   "recvSecretGenerated",
-                                   "recvSecretRequestError",
-                                   "recvSecretRedeemError"])
-            self.wedge._setTimeout(10)
+        if wedgeBusName(self.wedgeName) in self.bus.directory:
+            self.wedge = wedgeBusName(self.wedgeName)
             self.log.info("-- Connected to sb.wedge.%s. --" % self.wedgeName)
-        except Pyro.errors.NamingError:
+        else:
             self.wedge = None
-            self.log.info("sb.wedge.%s not found on name server, wedge is None." % self.wedgeName)
-        
-    def updateNodes(self):
-        nodelist = self.nameServer.list(":sb.node")
-        self.nodeList = []
-        self.nodeProxy = {}
-        for node in nodelist:
-            if node[0] != self.nodeName:
-                self.log.debug("Getting proxy for node %s"%node[0])
-                self.nodeList.append(node[0])
-                self.nodeProxy[node[0]] = Pyro.core.getProxyForURI(self.nameServer.resolve(":sb.node.%s" % node[0]))
-
-                self.nodeProxy[node[0]]._setOneway(["recvEnterNode",     
-                                                    "recvExitNode",         
-                                                    "recvEnterRemotePlayer",     
-                                                    "recvExitRemotePlayer",     
-                                                    "recvWhisper",
-                                                    "recvSCWhisper",             
-                                                    "recvMailUpdate"]) 
-                self.nodeProxy[node[0]]._setTimeout(10)
+            self.log.info("sb.wedge.%s not found on the bus, wedge is None." % self.wedgeName)
 
+    def updateNodes(self):
+        oldNodeList = self.nodeList
+        self.nodeList = sorted([node for node in self.bus.list(":sb.node.") if node != self.nodeName])
         self.log.debug("Updated node list: %s"%str(self.nodeList))
+        if self.presenceRouting == "friends" and self.nodeList != oldNodeList:
+            self.resyncPresence()
 
 
     #---------------------------------------
@@ -439,7 +498,7 @@ class sbNode(Pyro.core.SynchronizedObjBase,ChannelListener):
 
     #wedge->node
     def recvEnterLocalPlayer(self,playerId,playerInfo):
-        if self.localPlayers.has_key(playerId):
+        if playerId in self.localPlayers:
             self.log.warning("Warning: enterPlayer(%d) called, but I already have this player."%(playerId))
 
         self.log.debug("Player %d entered." % (playerId))
@@ -449,37 +508,33 @@ class sbNode(Pyro.core.SynchronizedObjBase,ChannelListener):
 
         self.localPlayers[playerId] = playerInfo
         self.id2Friends[playerId] = {}
+        self.infoCache.invalidate(playerId)
 
         # get friends list asynchronously, DISL will send it back
-        # and hit handleDISLSendFriendAdd
-        try:
-            self.log.debug("Sending msg to DISL: %s %s %s %s" % (sbConfig.SB2DISLChannel,
-                                                                 sbConfig.DISL2SBChannel+self.nodeName,
-                                                                 sbConfig.FC_DISLGetFriends,
-                                                                 "%d"%playerId))
-            self.broadcastMessage(ChannelMessage(sbConfig.SB2DISLChannel,
-                                                 sbConfig.DISL2SBChannel+self.nodeName,
-                                                 sbConfig.FC_DISLGetFriends,
-                                                 "%d"%playerId))
-        except Exception,e:
-            self.log.error("Error sending friends request to DISL:")
-            self.log.error(''.join(Pyro.util.getPyroTraceback(e)))
-
-        if playerInfo:
-            self.lastSeenDB.setInfo(playerId,playerInfo)
-        
+        # and hit handleDISLSendFriendsList
+        if self.disl is not None:
+            try:
+                self.disl.requestFriends(playerId)
+            except Exception as e:
+                self.log.error("Error sending friends request to DISL: %s" % str(e))
+
+        if playerInfo and self.lastSeenDB.setInfo(playerId,playerInfo):
+            self.lastSeenFull.set()
+
 
     #wedge->node
     def recvExitLocalPlayer(self,playerId,playerInfo=None):
-        if not self.localPlayers.has_key(playerId):
+        if playerId not in self.localPlayers:
             self.log.warning("Warning: exitPlayer(%d) called, but I don't have this one."%playerId)
-        
+
         self.log.debug("Player %d exited." % playerId)
 
-        if playerInfo:
-            self.lastSeenDB.setInfo(playerId,playerInfo)
+        if playerInfo and self.lastSeenDB.setInfo(playerId,playerInfo):
+            self.lastSeenFull.set()
+        self.infoCache.invalidate(playerId)
 
         self.localPlayers.pop(playerId,None)
+        self.publishedPlayers.discard(playerId)
         friends = self.id2Friends.pop(playerId,None)
 
         #announce exit to other nodes
@@ -488,204 +543,309 @@ class sbNode(Pyro.core.SynchronizedObjBase,ChannelListener):
 
     #node->node
     def sendEnterRemotePlayer(self,playerId,playerInfo,friendsList):
-        try:
-            for node in self.nodeList:
-                self.nodeProxy[node].recvEnterRemotePlayer(playerId,self.nodeName,playerInfo,friendsList)
-        except ConnectionClosedError,e:
-            self.log.error("ConnectionClosedError in sendEnterRemotePlayer.  Refreshing all nodes.")
-            self.updateNodes()
-        except ProtocolError,e:
-            self.log.error("ProtocolError (%s) in sendEnterRemotePlayer.  Refreshing all nodes."%str(e))
-            self.updateNodes()
-        except Exception,e:
-            self.log.error("Error sending enterRemotePlayer to sb.node.%s: %s" % (node,''.join(Pyro.util.getPyroTraceback(e))))
-        
+        if self.presenceRouting == "friends":
+            self.publishedPlayers.add(playerId)
+            self.subscribeFriends(playerId,friendsList)
+            self.sendToNode(self.getHomeNode(playerId),"recvPublishEnter",
+                            playerId,self.nodeName,playerInfo,friendsList)
+            return
+
+        self.bus.broadcast([nodeBusName(node) for node in self.nodeList],
+                           "recvEnterRemotePlayer",playerId,self.nodeName,playerInfo,friendsList)
 
     #node->node
     def sendExitRemotePlayer(self,playerId,friendsList):
-        try:
-            for node in self.nodeList:
-                self.nodeProxy[node].recvExitRemotePlayer(playerId,self.nodeName,friendsList)
-        except ConnectionClosedError,e:
-            self.log.error("ConnectionClosedError in sendExitRemotePlayer.  Refreshing all nodes.")
-            self.updateNodes()
-        except ProtocolError,e:
-            self.log.error("ProtocolError (%s) in sendExitRemotePlayer.  Refreshing all nodes."%str(e))
-            self.updateNodes()
-        except Exception,e:
-            self.log.error("Error sending exitRemotePlayer to sb.node.%s: %s" % (node,''.join(Pyro.util.getPyroTraceback(e))))
+        if self.presenceRouting == "friends":
+            if friendsList:
+                self.unsubscribeFriends(playerId,friendsList)
+            self.sendToNode(self.getHomeNode(playerId),"recvPublishExit",
+                            playerId,self.nodeName,friendsList)
+            return
+
+        self.bus.broadcast([nodeBusName(node) for node in self.nodeList],
+                           "recvExitRemotePlayer",playerId,self.nodeName,friendsList)
 
 
     #node->node
     def recvEnterRemotePlayer(self,playerId,nodeName,playerInfo,friendsList):
-        if self.remotePlayerLoc.has_key(playerId):
+        if playerId in self.remotePlayerLoc:
             self.log.warning("Warning: enterRemotePlayer(%d) called, but I already see this player."%(playerId))
-            
+
         self.log.debug("Saw player %d enter at :sb.node.%s."%(playerId,nodeName))
 
         self.remotePlayerLoc[playerId] = nodeName
         self.remotePlayerInfo[playerId] = playerInfo
+        self.infoCache.invalidate(playerId)
 
         #self.log.debug("Current locations: %s" % str(self.remotePlayerLoc))
 
-        if self.wedge is not None:
-            try:
-                self.wedge.recvEnterRemotePlayer(playerId,playerInfo,friendsList)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in recvEnterRemotePlayer.  Reconnecting to wedge.")
-                self.updateWedge()
-            except ProtocolError,e:
-                self.log.error("ProtocolError in recvEnterRemotePlayer.  Reconnecting to wedge.")
-                self.updateWedge()
-            except Exception,e:
-                self.log.error("Couldn't send player enter notice to my wedge, had an error: %s"%''.join(Pyro.util.getPyroTraceback(e)))
-                self.log.error("I sent: %s, %s, %s"%(str(playerId),str(playerInfo),str(friendsList)))
-        else:
-            self.log.warning("EnterRemotePlayer: No wedge connected!")
+        self.sendToWedge("recvEnterRemotePlayer",playerId,playerInfo,friendsList)
 
     #node->node
     def recvExitRemotePlayer(self,playerId,nodeName,friendsList):
-        if not self.remotePlayerLoc.has_key(playerId):
-            self.log.warning("Warning: exitRemotePlayer(%d) called, but I don't see this player.  Ignoring."%(playerId))
+        if playerId not in self.remotePlayerLoc:
+            if self.presenceRouting != "friends":
+                # with friends routing we may just have unsubscribed
+                self.log.warning("Warning: exitRemotePlayer(%d) called, but I don't see this player.  Ignoring."%(playerId))
             return
 
         self.log.debug("Saw player %d exit."%playerId)
 
         self.remotePlayerLoc.pop(playerId,None)
         self.remotePlayerInfo.pop(playerId,None)
+        self.infoCache.invalidate(playerId)
 
         #self.log.debug("Current locations: %s" % str(self.remotePlayerLoc))
 
-        if self.wedge is not None:
-            try:
-                self.wedge.recvExitRemotePlayer(playerId,friendsList)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in recvExitRemotePlayer.  Reconnecting to wedge.")
-                self.updateWedge()
-            except ProtocolError,e:
-                self.log.error("ProtocolError in recvExitRemotePlayer.  Reconnecting to wedge.")
-                self.updateWedge()
-            except Exception,e:
-                self.log.error("Couldn't send player exit notice to my wedge, had an error: %s"%''.join(Pyro.util.getPyroTraceback(e)))
+        self.sendToWedge("recvExitRemotePlayer",playerId,friendsList)
+
+
+    #---------------------------------------
+    # Friend Presence Routing
+    #---------------------------------------
+
+    # With presenceRouting "friends" every player has a home node, picked
+    # by rendezvous hashing over all the nodes.  The home knows where the
+    # player is and which nodes have friends of theirs online, and passes
+    # their enters and exits on to just those nodes.  Nodes subscribe at
+    # the homes of the friends of their local players, and only keep
+    # remotePlayerLoc/remotePlayerInfo for those friends.
+
+    def getHomeNode(self,playerId):
+        homeNode = None
+        homeHash = -1
+        for nodeName in [self.nodeName] + self.nodeList:
+            h = zlib.crc32(("%s:%d"%(nodeName,playerId)).encode('utf-8'))
+            if h > homeHash or (h == homeHash and nodeName < homeNode):
+                homeNode = nodeName
+                homeHash = h
+        return homeNode
+
+    def groupByHome(self,playerIds):
+        homes = {}
+        for playerId in playerIds:
+            homes.setdefault(self.getHomeNode(playerId),[]).append(playerId)
+        return homes
+
+    def sendToNode(self,nodeName,method,*args):
+        if nodeName == self.nodeName:
+            getattr(self,method)(*args)
         else:
-            self.log.warning("ExitRemotePlayer: No wedge connected!")
+            self.bus.post(nodeBusName(nodeName),method,*args)
+
+    def sendToNodes(self,nodeNames,method,*args):
+        if self.nodeName in nodeNames:
+            getattr(self,method)(*args)
+        self.bus.broadcast([nodeBusName(node) for node in nodeNames if node != self.nodeName],
+                           method,*args)
+
+    def subscribeFriends(self,playerId,friendIds):
+        if self.presenceRouting != "friends":
+            return
+
+        newIds = []
+        for friendId in friendIds:
+            interested = self.friendInterest.get(friendId)
+            if interested is None:
+                interested = self.friendInterest[friendId] = set()
+                newIds.append(friendId)
+            interested.add(playerId)
+
+        for homeNode,playerIds in self.groupByHome(newIds).items():
+            self.sendToNode(homeNode,"recvSubscribe",self.nodeName,playerIds)
+
+    def unsubscribeFriends(self,playerId,friendIds):
+        if self.presenceRouting != "friends":
+            return
+
+        goneIds = []
+        for friendId in friendIds:
+            interested = self.friendInterest.get(friendId)
+            if interested is None:
+                continue
+            interested.discard(playerId)
+            if not interested:
+                # nobody here cares where they are anymore
+                del self.friendInterest[friendId]
+                self.remotePlayerLoc.pop(friendId,None)
+                self.remotePlayerInfo.pop(friendId,None)
+                goneIds.append(friendId)
+
+        for homeNode,playerIds in self.groupByHome(goneIds).items():
+            self.sendToNode(homeNode,"recvUnsubscribe",self.nodeName,playerIds)
+
+    #node->home
+    def recvSubscribe(self,nodeName,playerIds):
+        online = []
+        for playerId in playerIds:
+            self.homeSubscribers.setdefault(playerId,set()).add(nodeName)
+            loc = self.homeLoc.get(playerId)
+            if loc is not None and loc[0] != nodeName:
+                online.append((playerId,) + loc)
+
+        # the ones already online won't be published again
+        if online:
+            self.sendToNode(nodeName,"recvPresenceList",online)
+
+    #node->home
+    def recvUnsubscribe(self,nodeName,playerIds):
+        for playerId in playerIds:
+            subscribers = self.homeSubscribers.get(playerId)
+            if subscribers is not None:
+                subscribers.discard(nodeName)
+                if not subscribers:
+                    del self.homeSubscribers[playerId]
+
+    #node->home
+    def recvPublishEnter(self,playerId,nodeName,playerInfo,friendsList):
+        oldLoc = self.homeLoc.get(playerId)
+        self.homeLoc[playerId] = (nodeName,playerInfo,friendsList)
+        if oldLoc is not None and oldLoc[0] == nodeName:
+            # already told everybody
+            return
+
+        subscribers = [node for node in self.homeSubscribers.get(playerId,()) if node != nodeName]
+        self.sendToNodes(subscribers,"recvEnterRemotePlayer",playerId,nodeName,playerInfo,friendsList)
+
+    #node->home
+    def recvPublishExit(self,playerId,nodeName,friendsList):
+        loc = self.homeLoc.get(playerId)
+        if loc is None or loc[0] != nodeName:
+            # they've shown up somewhere else since
+            return
+        del self.homeLoc[playerId]
+
+        subscribers = [node for node in self.homeSubscribers.get(playerId,()) if node != nodeName]
+        self.sendToNodes(subscribers,"recvExitRemotePlayer",playerId,nodeName,friendsList)
+
+    #home->node
+    def recvPresenceList(self,presence):
+        for playerId,nodeName,playerInfo,friendsList in presence:
+            if self.remotePlayerLoc.get(playerId) != nodeName:
+                self.recvEnterRemotePlayer(playerId,nodeName,playerInfo,friendsList)
+
+    def dropNodePresence(self,nodeName):
+        # the players there are gone, and so are its subscriptions
+        for playerId,loc in list(self.homeLoc.items()):
+            if loc[0] == nodeName:
+                self.recvPublishExit(playerId,nodeName,loc[2])
+        for playerId in list(self.homeSubscribers):
+            self.recvUnsubscribe(nodeName,[playerId])
+        for playerId,loc in list(self.remotePlayerLoc.items()):
+            if loc == nodeName:
+                self.recvExitRemotePlayer(playerId,nodeName,None)
+
+    def resyncPresence(self):
+        """
+        Homes move when nodes come and go.  Forget the players that
+        aren't homed here anymore and send the new homes our subscriptions
+        and local players.
+        """
+        for playerId in list(self.homeLoc):
+            if self.getHomeNode(playerId) != self.nodeName:
+                del self.homeLoc[playerId]
+        for playerId in list(self.homeSubscribers):
+            if self.getHomeNode(playerId) != self.nodeName:
+                del self.homeSubscribers[playerId]
+
+        for homeNode,playerIds in self.groupByHome(list(self.friendInterest)).items():
+            self.sendToNode(homeNode,"recvSubscribe",self.nodeName,playerIds)
+
+        for playerId in self.publishedPlayers:
+            self.sendToNode(self.getHomeNode(playerId),"recvPublishEnter",
+                            playerId,self.nodeName,self.localPlayers[playerId],self.id2Friends[playerId])
+
 
-    
     #---------------------------------------------
     # Friends
     #---------------------------------------------
 
+    def _getSoapError(self,e):
+        err = None
+        for d in e.fault.detail:
+            if d.nodeName.find("errcode") != -1:
+                err = d.childNodes[0].get_data()
+        return err
+
     def addFriendship(self,playerId1,playerId2):
         err = None
         try:
             self.friendsDB.addFriendship(playerId1,playerId2)
-        except Exception,e:
-            try:                                           
-                for d in e.fault.detail:
-                    if d.nodeName.find("errcode") != -1:
-                        err = d.childNodes[0].get_data()
-            except Exception,ex:
-                self.log.error("Unknown exception in removeFriendship: %s" % str(e))
+        except Exception as e:
+            try:
+                err = self._getSoapError(e)
+            except Exception:
+                self.log.error("Unknown exception in addFriendship: %s" % str(e))
         if err is not None:
-            try:           
-                self.wedge.recvAddFriendshipError(playerId,err)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in recvSecretRequestError.  Reconnecting to wedge.")
-                self.updateWedge()
-            except ProtocolError,e:
-                self.log.error("ProtocolError in recvSecretRequestError.  Reconnecting to wedge.")
-                self.updateWedge()
-            except Exception,e:
-                self.log.error("Couldn't send recvAddFriendshipError to my wedge")
-        
+            self.sendToWedge("recvAddFriendshipError",playerId1,err)
+
 
     def removeFriendship(self,playerId1,playerId2):
         self.log.debug("Got removeFriendship request")
         try:
             self.friendsDB.removeFriendship(playerId1,playerId2)
-        except Exception,e:           
+        except Exception as e:
             try:
-                for d in e.fault.detail:
-                    if d.nodeName.find("errcode") != -1:
-                        err = d.childNodes[0].get_data()
-            except Exception,ex:
+                self._getSoapError(e)
+            except Exception:
                 self.log.error("Unknown exception in removeFriendship: %s" % str(e))
-            
+
 
     def recvSecretRequest(self,playerId,parentUsername,parentPassword):
         self.log.debug("Got recvSecretRequest!")
-        info = self._getFriendInfo(playerId)
         err = None
         try:
             secret = self.friendsDB.getToken(playerId)
-        except Exception,e:
+        except Exception as e:
             try:
-                for d in e.fault.detail:
-                    if d.nodeName.find("errcode") != -1:
-                        err = d.childNodes[0].get_data()
-            except Exception,e:
+                err = self._getSoapError(e)
+            except Exception:
                 self.log.error("Unknown exception in generateToken: %s" % str(e))
 
         if err is None:
-            try:
-                self.wedge.recvSecretGenerated(playerId,secret)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in recvSecretGenerated.  Reconnecting to wedge.")
-                self.updateWedge()
-            except ProtocolError,e:
-                self.log.error("ProtocolError in recvSecretGenerated.  Reconnecting to wedge.")
-                self.updateWedge()
-            except Exception,e:
-                self.log.error("Couldn't send recvSecretGenerated to my wedge, had an error: %s"%''.join(Pyro.util.getPyroTraceback(e)))
+            self.sendToWedge("recvSecretGenerated",playerId,secret)
         else:
-            try:
-                self.wedge.recvSecretRequestError(playerId,err)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in recvSecretRequestError.  Reconnecting to wedge.")
-                self.updateWedge()
-            except ProtocolError,e:
-                self.log.error("ProtocolError in recvSecretRequestError.  Reconnecting to wedge.")
-                self.updateWedge()
-            except Exception,e:
-                self.log.error("Couldn't send recvSecretRequestError to my wedge, had an error: %s"%''.join(Pyro.util.getPyroTraceback(e)))
-        
+            self.sendToWedge("recvSecretRequestError",playerId,err)
+
     def recvSecretRedeem(self,playerId,secret,parentUsername,parentPassword):
-        info = self._getFriendInfo(playerId)
         err = None
         try:
-            res = self.friendsDB.redeemToken(playerId,secret)
-        except Exception,e:
+            self.friendsDB.redeemToken(playerId,secret)
+        except Exception as e:
             try:
-                for d in e.fault.detail:
-                    if d.nodeName.find("errcode") != -1:
-                        err = d.childNodes[0]._get_data()
-            except Exception,e:
+                err = self._getSoapError(e)
+            except Exception:
                 self.log.error("Unknown exception in redeemToken: %s" % str(e))
 
         if err is not None:
-            try:
-                self.wedge.recvSecretRedeemError(playerId,err)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in recvSecretRedeemError.  Reconnecting to wedge.")
-                self.updateWedge()
-            except ProtocolError,e:
-                self.log.error("ProtocolError in recvSecretRedeemError.  Reconnecting to wedge.")
-                self.updateWedge()
-            except Exception,e:
-                self.log.error("Couldn't send recvSecretRedeemError to my wedge, had an error: %s"%''.join(Pyro.util.getPyroTraceback(e)))
-
-    def _getFriendInfo(self,playerId):
-        if self.localPlayers.has_key(playerId):
-            return self.localPlayers[playerId]
-        elif self.remotePlayerInfo.has_key(playerId):
-            return self.remotePlayerInfo[playerId]
-        else:
-            return self.lastSeenDB.getInfo(playerId)
+            self.sendToWedge("recvSecretRedeemError",playerId,err)
 
-    def _getFriendView(self,viewerId,friendId):
-        info = self._getFriendInfo(friendId)
-        assert self.id2Friends.has_key(viewerId)
-        if self.id2Friends[viewerId][friendId] is True:
+    async def _loadFriendInfo(self,playerIds):
+        """
+        Returns {playerId:FriendInfo}.  Online players come from what we
+        know about them, the rest from infoCache, and the ones it doesn't
+        have are loaded with one query in the executor.
+        """
+        infos = {}
+        others = []
+        for playerId in set(playerIds):
+            if playerId in self.localPlayers:
+                infos[playerId] = self.localPlayers[playerId]
+            elif playerId in self.remotePlayerInfo:
+                infos[playerId] = self.remotePlayerInfo[playerId]
+            else:
+                others.append(playerId)
+
+        cached,missing = self.infoCache.lookup(others)
+        infos.update(cached)
+        if missing:
+            loaded = await self._runDB(self.lastSeenDB.getInfos,missing)
+            self.infoCache.putMany(loaded)
+            infos.update(loaded)
+        return infos
+
+    def _getFriendView(self,viewerId,friendId,info):
+        if self.id2Friends[viewerId].get(friendId) is True:
             info.openChatFriendshipYesNo = 1
         else:
             info.openChatFriendshipYesNo = 0
@@ -693,202 +853,116 @@ class sbNode(Pyro.core.SynchronizedObjBase,ChannelListener):
         info.understandableYesNo = info.openChatFriendshipYesNo
 
         return info
-        
-    
+
+
     def sendLocalFriendsUpdate(self,friendOne,friends):
         #self.log.debug("sendLocalFriendsUpdate %d: %s"%(friendOne,str(friends)))
         if self.wedge is not None:
-            for friend in friends:
-                friend[1] = self._getFriendView(friendOne,friend[0])
-            try:
-                self.wedge.recvFriendsUpdate(friendOne,friends)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in sendLocalFriendsUpdate.  Reconnecting to wedge.")
-                self.updateWedge()
-            except ProtocolError,e:
-                self.log.error("ProtocolError (%s) in sendLocalFriendsUpdate.  Reconnecting to wedge."%str(e))
-                self.updateWedge()
-            except Exception,e:
-                self.log.error("Couldn't sendLocalFriendsUpdate to my wedge, had an error: %s"%''.join(Pyro.util.getPyroTraceback(e)))
-                self.log.error("I sent: %d, %s"%(friendOne,friends))
+            self._startTask(self._sendLocalFriendsUpdate(friendOne,friends))
         else:
             self.log.warning("sendFriendshipUpdated: No wedge connected!")
 
+    async def _sendLocalFriendsUpdate(self,friendOne,friends):
+        infos = await self._loadFriendInfo([friend[0] for friend in friends])
+        if self.wedge is None or friendOne not in self.id2Friends:
+            # gone while we were loading
+            return
+        for friend in friends:
+            friend[1] = self._getFriendView(friendOne,friend[0],infos[friend[0]])
+        self.bus.post(self.wedge,"recvFriendsUpdate",friendOne,friends)
+
     def sendLocalFriendshipRemoved(self,friendOne,friendTwo):
         self.log.debug("sendLocalFriendshipRemoved on %d,%d"%(friendOne,friendTwo))
-        if self.wedge is not None:
-            try:
-                self.wedge.recvFriendshipRemoved(friendOne,friendTwo)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in sendFriendshipRemoved.  Reconnecting to wedge.")
-                self.updateWedge()
-            except ProtocolError,e:
-                self.log.error("ProtocolError in sendLocalFriendshipRemoved.  Reconnecting to wedge.")
-                self.updateWedge()
-            except Exception,e:
-                self.log.error("Couldn't sendFriendshipRemoved to my wedge, had an error: %s"%''.join(Pyro.util.getPyroTraceback(e)))
-                self.log.error("I sent: %d, %d"%(friendOne,friendTwo))
-        else:
-            self.log.warning("sendFriendshipRemoved: No wedge connected!")
+        self.sendToWedge("recvFriendshipRemoved",friendOne,friendTwo)
 
 
 
     #---------------------------------------------
     # Whispers
     #---------------------------------------------
-        
+
 
     def sendWhisper(self,recipientId,senderId,msgText):
         if sbConfig.scrubMessages:
             msgText = badwordpy.scrub(msgText)
-        #if self.localPlayers.has_key(recipientId):
+        #if recipientId in self.localPlayers:
         #    self.log("Warning: I own %d.  Ignoring whisper." % (recipientId))
-        #    self.wedge.recvWhisperFailed(recipientId,senderId,msgText)
-        if not self.remotePlayerLoc.has_key(recipientId):
+        #    self.sendToWedge("recvWhisperFailed",recipientId,senderId,msgText)
+        if recipientId not in self.remotePlayerLoc:
             self.log.warning("I don't see %d anywhere!  Whisper not delivered."%recipientId)
             return
         #CHECK FRIENDSHIP, permissions, ignore list, etc?
         # wedge is doing this right now, not worrying about it
         loc = self.remotePlayerLoc[recipientId]
         self.log.debug("Delivering whisper to :sb.node.%s."%loc)
-        #self.nodeProxy[loc]._setOneway(["recvWhisper"])
-        try:
-            self.servedChat = self.servedChat + 1
-            self.nodeProxy[loc].recvWhisper(recipientId,senderId,msgText)
-        except ConnectionClosedError,e:
-            self.log.error("ConnectionClosedError in sendWhisper.  Reconnecting to nodes.")
-            self.updateNodes()
-        except ProtocolError,e:
-            self.log.error("ProtocolError in sendWhisper.  Reconnecting to nodes.")
-            self.updateNodes()
-        except Exception,e:
-            self.log.error("Couldn't send whisper to sb.node.%s, had an error: %s"%(loc,''.join(Pyro.util.getPyroTraceback(e))))
+        self.servedChat = self.servedChat + 1
+        self.bus.post(nodeBusName(loc),"recvWhisper",recipientId,senderId,msgText)
 
     def recvWhisper(self,recipientId,senderId,msgText):
         #msgText = badwordpy.scrub(msgText)
         self.log.debug("WHISPER %d to %d: %s"%(senderId,recipientId,msgText))
-        #self.wedge._setOneway(["recvWhisper"])
-        if self.wedge is not None:
-            try:
-                self.wedge.recvWhisper(recipientId,senderId,msgText)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in recvWhisper.  Reconnecting to wedge.")
-                self.updateWedge()
-            except ProtocolError,e:
-                self.log.error("ProtocolError in recvWhisper.  Reconnecting to wedge.")
-                self.updateWedge()
-            except Exception,e:
-                self.log.error("Couldn't send whisper to my wedge, had an error: %s"%''.join(Pyro.util.getPyroTraceback(e)))
-                self.log.error("I sent: %d, %d, %s"%(recipientId,senderId,msgText))
-        else:
-            self.log.warning("recvWhisper: No wedge connected!")
+        self.sendToWedge("recvWhisper",recipientId,senderId,msgText)
 
 
     def sendSCWhisper(self,recipientId,senderId,msgText):
         self.log.debug("sbNode.sendSCWHISPER %d to %d: %s" % (senderId,recipientId,msgText))
-        #if self.localPlayers.has_key(recipientId):
+        #if recipientId in self.localPlayers:
         #    self.log("Warning: I own %d.  Ignoring whisper." % (recipientId))
-        #    self.wedge.recvWhisperFailed(recipientId,senderId,msgText)
-        if not self.remotePlayerLoc.has_key(recipientId):
+        #    self.sendToWedge("recvWhisperFailed",recipientId,senderId,msgText)
+        if recipientId not in self.remotePlayerLoc:
             self.log.warning("I don't see %d anywhere!  Whisper not delivered."%recipientId)
-            #self.wedge.recvSCWhisperFailed(recipientId,senderId,msgText)
+            #self.sendToWedge("recvSCWhisperFailed",recipientId,senderId,msgText)
             return
         self.log.debug("Found recipient %d." % recipientId)
         #CHECK FRIENDSHIP, permissions, ignore list, etc?
         loc = self.remotePlayerLoc[recipientId]
         self.log.debug("Delivering SCwhisper to :sb.node.%s."%loc)
-        #self.nodeProxy[loc]._setOneway(["recvWhisper"])
-        try:
-            self.servedSC = self.servedSC + 1
-            self.nodeProxy[loc].recvSCWhisper(recipientId,senderId,msgText)
-        except ConnectionClosedError,e:
-            self.log.error("ConnectionClosedError in sendSCWhisper.  Reconnecting to nodes.")
-            self.updateNodes()
-        except ProtocolError,e:
-            self.log.error("ProtocolError in sendSCWhisper.  Reconnecting to nodes.")
-            self.updateNodes()
-        except Exception,e:
-            self.log.error("Couldn't send SCwhisper to sb.node.%s, had an error: %s"%(loc,''.join(Pyro.util.getPyroTraceback(e))))
+        self.servedChatSC = self.servedChatSC + 1
+        self.bus.post(nodeBusName(loc),"recvSCWhisper",recipientId,senderId,msgText)
 
     def recvSCWhisper(self,recipientId,senderId,msgText):
         self.log.debug("sbNode.recvSCWHISPER %d to %d: %s"%(senderId,recipientId,msgText))
-        if self.wedge is not None:
-            try:
-                self.wedge.recvWhisper(recipientId,senderId,msgText)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in recvSCWhisper.  Reconnecting to wedge.")
-                self.updateWedge()
-            except ProtocolError,e:
-                self.log.error("ProtocolError in recvSCWhisper.  Reconnecting to wedge.")
-                self.updateWedge()
-            except Exception,e:
-                self.log.error("Couldn't send whisper to my wedge, had an error: %s"%''.join(Pyro.util.getPyroTraceback(e)))
-                self.log.error("I sent: %d, %d, %s"%(recipientId,senderId,msgText))
-        else:
-            self.log.debug("No wedge connected!")
+        self.sendToWedge("recvWhisper",recipientId,senderId,msgText)
 
     #---------------------------------------------
     # Mail
     #---------------------------------------------
-    
+
     def sendMail(self,recipientId,senderId,msgText):
         self.log.debug("sbNode.sendMail %d to %d: %s" % (senderId,recipientId,msgText))
         self.servedMail = self.servedMail + 1
-        self.mailDB.putMail(recipientId,senderId,msgText)
+        self._startTask(self._runDB(self.mailDB.putMail,recipientId,senderId,msgText))
 
-        #if self.remotePlayerLoc.has_key(recipientId):
+        #if recipientId in self.remotePlayerLoc:
         #    loc = self.remotePlayerLoc[recipientId]
         #    self.log.debug("Sending mail update to :sb.node.%s."%loc)
-        #    self.nodeProxy[loc].recvMailUpdate(recipientId,senderId,msgText)
+        #    self.bus.post(nodeBusName(loc),"recvMailUpdate",recipientId,senderId,msgText)
 
     def sendSCMail(self,recipientId,senderId,msgText):
         self.log.debug("sbNode.sendSCMAIL %d to %d: %s" % (senderId,recipientId,msgText))
         self.servedMailSC = self.servedMailSC + 1
-        self.mailDB.putMail(recipientId,senderId,msgText)
+        self._startTask(self._runDB(self.mailDB.putMail,recipientId,senderId,msgText))
 
     def recvMailUpdate(self,recipientId,senderId,msgText):
-        if self.wedge is not None:
-            try:
-                self.wedge.recvMailUpdate(recipientId,senderId,msgText)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in recvMailUpdate.  Reconnecting to wedge.")
-                self.updateWedge()
-            except ProtocolError,e:
-                self.log.error("ProtocolError in recvMailUpdate.  Reconnecting to wedge.")
-                self.updateWedge()
-            except Exception,e:
-                self.log.error("Couldn't send mail update to my wedge, had an error: %s"%''.join(Pyro.util.getPyroTraceback(e)))
-                self.log.error("I sent: %d, %d, %s"%(recipientId,senderId,msgText))
-        else:
-            self.log.debug("Tried to receive mail update, but no wedge connected!")
-            
+        self.sendToWedge("recvMailUpdate",recipientId,senderId,msgText)
+
     def getMail(self,recipientId):
         #self.log.debug("Getting mail for %d"%recipientId)
-        mail = self.mailDB.getMail(recipientId)
+        self._startTask(self._getMail(recipientId))
+
+    async def _getMail(self,recipientId):
+        mail = await self._runDB(self.mailDB.getMail,recipientId)
+        infos = await self._loadFriendInfo([msg['senderId'] for msg in mail])
         for msg in mail:
-            senderInfo = self._getFriendInfo(msg['senderId'])
-            msg['senderName'] = senderInfo.playerName
+            msg['senderName'] = infos[msg['senderId']].playerName
 
-        if self.wedge is not None:
-            try:
-                self.wedge.recvMail(recipientId,mail)
-                self.log.debug("Sent mail to %d: %s" % (recipientId,mail))
-            except ConnectionClosedError,e:       
-                self.log.error("ConnectionClosedError in recvMail.  Reconnecting to wedge.")
-                self.updateWedge()
-            except ProtocolError,e:       
-                self.log.error("ProtocolError in recvMail.  Reconnecting to wedge.")
-                self.updateWedge()
-            except Exception,e:
-                self.log.error("Couldn't send mail to my wedge, had an error: %s"%''.join(Pyro.util.getPyroTraceback(e)))
-                self.log.error("I sent: %d, %s"%(recipientId,mail))
-        else:
-            self.log.debug("Tried to receive mail, but no wedge connected!")
+        self.sendToWedge("recvMail",recipientId,mail)
+        self.log.debug("Sent mail to %d: %s" % (recipientId,mail))
 
 
     def deleteMail(self,accountId,messageId):
         self.log.debug("User %d deleting message %d"%(accountId,messageId))
-        self.mailDB.deleteMail(accountId,messageId)
+        self._startTask(self._runDB(self.mailDB.deleteMail,accountId,messageId))
 
 
     def getLogTail(self,numLines=None):
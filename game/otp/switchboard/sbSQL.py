@@ -2,6 +2,9 @@
 
 getInfoSELECT = "SELECT * FROM playerinfo WHERE playerId=%s"
 
+# filled in with a %s per playerId
+getInfosSELECT = "SELECT * FROM playerinfo WHERE playerId IN (%s)"
+
 setInfoREPLACE = "REPLACE INTO playerinfo (playerId,avatarName,playerName,openChatEnabledYesNo,location,sublocation) VALUES (%s,%s,%s,%s,%s,%s)"
 
 setInfoINSERT = "INSERT INTO playerinfo (playerId,avatarName,playerName,openChatEnabledYesNo,location,sublocation) VALUES (%s,%s,%s,%s,%s,%s)"
@@ -12,6 +15,8 @@ setInfoUPDATE = "UPDATE playerinfo SET avatarName=%s,playerName=%s,openChatEnabl
 
 getMailSELECT = "SELECT * FROM recipientmail WHERE recipientId=%s"
 
+countMailSELECT = "SELECT COUNT(*) FROM recipientmail WHERE recipientId=%s"
+
 putMailINSERT = "INSERT INTO recipientmail (recipientId,senderId,message) VALUES (%s,%s,%s)"
 
 deleteMailDELETE = "DELETE FROM recipientmail WHERE messageId=%s AND recipientId=%s"
@@ -1,46 +1,71 @@
-import Pyro.core
-import Pyro.naming
-import Pyro.errors
+import asyncio
 import time
 import sys
 
-from Pyro.errors import ConnectionClosedError
-from Pyro.errors import ProtocolError
-
-from sbNode import sbNode
-from sbLog import sbLog
-import sbConfig
+from game.otp.switchboard.sbBus import sbBus,nodeBusName,wedgeBusName
+from game.otp.switchboard.sbLog import sbLog
+import game.otp.switchboard.sbConfig as sbConfig
 
 try:
-    import badwordpy
+    from game.otp.switchboard import badwordpy
     gotBadwordpy = True
 except ImportError:
     gotBadwordpy = False
     class BadwordDummy:
         def __init__(self, *args):
             pass
+        def init(self, *args):
+            pass
         def test(self, word):
             return False
         def scrub(self, str):
             return str
     badwordpy = BadwordDummy()
-        
 
-class sbWedge(Pyro.core.SynchronizedObjBase):
+
+class sbWedge:
+    """
+    The game server's end of the switchboard.  Apps subclass this and
+    override the recv* methods; everything the app sends goes to our node
+    as a one-way message on the bus.
+
+    If the app doesn't run an asyncio event loop of its own it should
+    call handleRequests() regularly to let the bus do its work.
+    """
+    # Methods our node may call over the bus.
+    busMethods = frozenset(["shutdown",
+                            "healthCheck",
+                            "statCheck",
+                            "getLogTail",
+                            "recvEnterNode",
+                            "recvExitNode",
+                            "recvEnterRemotePlayer",
+                            "recvExitRemotePlayer",
+                            "recvFriendsUpdate",
+                            "recvFriendshipRemoved",
+                            "recvAddFriendshipError",
+                            "recvSecretGenerated",
+                            "recvSecretRequestError",
+                            "recvSecretRedeemError",
+                            "recvInviteNotice",
+                            "recvInviteRetracted",
+                            "recvInviteRejected",
+                            "recvWhisper",
+                            "recvWLWhisper",
+                            "recvSCWhisper",
+                            "recvWhisperFailed",
+                            "recvSCWhisperFailed",
+                            "recvMailUpdate",
+                            "recvMail"])
+
     def __init__(self,wedgeName,
                  nodeName="",
-                 nsHost=None,nsPort=None,
-                 listenPort=None,
-                 bcLocate=False,
+                 nodeHost=None,nodePort=None,
+                 listenHost=None,listenPort=None,
                  clHost=None,clPort=None,
                  allowUnfilteredChat=0,
-                 bwDictPath=""):
-        Pyro.config.PYRO_MULTITHREADED = 0
-        Pyro.config.PYRO_TRACELEVEL = 2
-
-        Pyro.core.SynchronizedObjBase.__init__(self)
-        Pyro.core.initServer(banner=0)
-
+                 bwDictPath="",
+                 loop=None):
         self.log = sbLog(":sb.wedge.%s"%wedgeName,clHost,clPort)
 
         badwordpy.init(bwDictPath,"")
@@ -54,162 +79,114 @@ class sbWedge(Pyro.core.SynchronizedObjBase):
             self.nodeName = wedgeName
         else:
             self.nodeName = nodeName
-            
+
+        # bus name of our node, or None
         self.node = None
 
         self.log.info("Starting.")
         self.sbConnected = False
 
-        self.nsHost = nsHost
-        self.nsPort = nsPort
-        
+        self.onlinePlayers = 0
+        self.servedLogins = 0
+        self.servedChat = 0
+        self.servedChatSC = 0
+        self.servedMail = 0
+        self.servedMailSC = 0
+
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+        self.loop = loop
+        self.bus = sbBus(wedgeBusName(wedgeName),self,self.log,listenHost,listenPort,loop)
+        if nodeHost is not None and nodePort is not None:
+            self.bus.register(nodeBusName(self.nodeName),(nodeHost,nodePort))
+
+        if not loop.is_running():
+            loop.run_until_complete(self.start())
+
+    async def start(self):
+        """
+        Starts listening and announces us to our node.  Called by the
+        constructor unless the event loop is already running, in which
+        case the caller awaits it.
+        """
         try:
-            self.initPyro(nsHost,nsPort,listenPort,bcLocate)
+            await self.bus.start()
 
             self.updateNode()
             self.log.debug("Enter sendEnterWedge")
             self.sendEnterWedge()
             self.log.debug("Exit sendEnterWedge")
-            self.sbConnected = True
-        except Exception,e:
-            self.log.warning("Failed to connect to Switchboard.  Player friends are being faked.")
+        except Exception as e:
+            self.log.warning("Failed to connect to Switchboard (%s).  Player friends are being faked."%str(e))
 
-        self.onlinePlayers = 0
-        self.servedLogins = 0
-        self.servedChat = 0           
-        self.servedChatSC = 0
-        self.servedMail = 0
-        self.servedMailSC = 0
-            
         self.log.info("-- sb.wedge.%s is ready. --" %self.wedgeName)
 
     def shutdown(self):
+        self.sendExitWedge()
         self.sbConnected = False
-        self.pyroDaemon.disconnect(self)
         self.log.info("shutdown() called.  Shutting down cleanly.")
         sys.stdout.flush()
-        self.pyroDaemon.shutdown(True)
-        
+        self.loop.create_task(self._shutdown())
+
+    async def _shutdown(self):
+        await self.bus.flush(sbConfig.busCallTimeout)
+        self.bus.close()
+
     #def log(self,message):
     #    #pass
     #    print ":sb.wedge.%s: %s" % (self.wedgeName,message)
     #    sys.stdout.flush()
 
 
-    def initPyro(self,nsHost,nsPort,listenPort,bcLocate):
-        if listenPort is not None:
-            self.log.debug("Accepting requests on port %d."%listenPort)
-            Pyro.config.PYRO_PORT = listenPort
-            Pyro.config.PYRO_PORT_RANGE = 1
-
-        self.pyroDaemon = Pyro.core.Daemon()
-        
-        if nsHost is None:
-            if bcLocate is True:
-                self.log.info("No NS host/port specified, trying location via broadcast.")
-                self.nameServer = Pyro.naming.NameServerLocator().getNS()
-            else:
-                self.log.warning("No NS host/port specified and no broadcast enabled.  sbWedge not connecting to Switchboard.")
-                return
-        else:
-            self.log.info("Connecting to NS at %s:%d." % (nsHost,nsPort))
-            self.nameServer = Pyro.naming.NameServerLocator().getNS(host=nsHost,port=nsPort)
-            
-        self.pyroDaemon.useNameServer(self.nameServer)
-        try:
-            self.nameServer.createGroup(":sb")
-            self.nameServer.createGroup(":sb.node")
-            self.nameServer.createGroup(":sb.player")
-            self.nameServer.createGroup(":sb.wedge")
-        except Pyro.errors.NamingError:
-            pass
-        try:
-            self.pyroDaemon.connectPersistent(self,":sb.wedge.%s"%self.wedgeName)
-        except Pyro.errors.NamingError:
-            self.log.debug(":sb.wedge.%s was already registered, overwriting old entry."%self.wedgeName)
-            self.nameServer.unregister(":sb.wedge.%s"%self.wedgeName)
-            self.pyroDaemon.connectPersistent(self,":sb.wedge.%s"%self.wedgeName)
-
-
     def handleRequests(self,timeout):
-        if self.sbConnected:
-            self.pyroDaemon.handleRequests(timeout)
+        # Runs the event loop for a while, for apps that poll.
+        self.loop.run_until_complete(asyncio.sleep(timeout))
 
     def requestLoop(self):
-        if self.sbConnected:
-            try:
-                self.pyroDaemon.requestLoop()
-            finally:
-                self.pyroDaemon.shutdown(True)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.bus.close()
+
+    def sendToNode(self,method,*args):
+        if self.node is None:
+            return False
+        return self.bus.post(self.node,method,*args)
 
     #---------------------------------
     # Node/Wedge Entry/Exit
     #---------------------------------
 
-    def refreshNS(self):
-        self.nameServer = Pyro.naming.NameServerLocator().getNS(host=self.nsHost,port=self.nsPort)
-        self.pyroDaemon.useNameServer(self.nameServer)
-
     def sendEnterWedge(self):
-        if self.node:
-            try:
-                self.node.recvEnterWedge(self.wedgeName)
-            except Exception,e:
-                self.log.warning("Error contacting my node (%s), node is None."%str(e))
-                self.node = None
+        self.sendToNode("recvEnterWedge",self.wedgeName,self.bus.getAddress())
 
     def sendExitWedge(self):
-        try:
-            if self.node:
-                self.node.recvExitWedge(self.wedgeName)
-        except:
-            pass
-        
-    def recvEnterNode(self,nodeName):
+        self.sendToNode("recvExitWedge",self.wedgeName)
+
+    def recvEnterNode(self,nodeName,address):
         self.log.debug("Received enterNode.")
         #send out players online etc
         self.nodeName = nodeName
+        self.bus.register(nodeBusName(nodeName),address)
         self.updateNode()
 
     def recvExitNode(self,nodeName):
         self.log.debug("Received exitNode.")
         self.nodeName = nodeName
+        self.bus.unregister(nodeBusName(nodeName))
         self.updateNode()
 
     def updateNode(self):
         self.log.debug("updateNode")
-        try:
-            self.refreshNS()
-            self.node = Pyro.core.getProxyForURI(self.nameServer.resolve(":sb.node.%s"%self.nodeName))
-            self.log.debug("gotProxyForNode")
-            self.node._setOneway(["recvEnterWedge",
-                                  "recvExitWedge",
-                                  "recvEnterLocalPlayer",
-                                  "recvExitLocalPlayer",
-                                  "recvExitLocalAvatar",
-                                  "addFriendship",
-                                  "removeFriendship",
-                                  "getToken",
-                                  "redeemToken",
-                                  "sendWhisper",
-                                  "sendWLWhisper",
-                                  "sendSCWhisper",
-                                  "getMail",
-                                  "sendMail",
-                                  "sendWLMail",
-                                  "sendSCMail",
-                                  "deleteMail",
-                                  "recvSecretRequest",
-                                  "recvSecretRedeem",
-                                  "recvOpenInvite",
-                                  "recvDeclineInvite"])
+        if nodeBusName(self.nodeName) in self.bus.directory:
+            self.node = nodeBusName(self.nodeName)
             self.log.info("-- Connected to sb.node.%s. --" % self.nodeName)
             self.sbConnected = True
-        except Exception,e:
+        else:
             self.node = None
             self.sbConnected = False
             self.log.debug("Failed to locate sb.node.%s, node is None." % self.nodeName)
-            self.log.debug(str(e))
 
 
     #---------------------------------------
@@ -220,47 +197,17 @@ class sbWedge(Pyro.core.SynchronizedObjBase):
     def enterPlayer(self,playerId,playerInfo):
         self.log.debug("Player %d entered." % (playerId))
         self.servedLogins += 1
-        if self.node:
-            try:
-                self.node.recvEnterLocalPlayer(playerId,playerInfo)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in enterPlayer.  Refreshing node.")
-                self.updateNode()
-            except ProtocolError,e:
-                self.log.error("ProtocolError (%s) in enterPlayer.  Refreshing node."%str(e))
-                self.updateNode()
-            except Exception,e:
-                self.log.error("Unknown error sending enterLocalPlayer to my node: %s" % ''.join(Pyro.util.getPyroTraceback(e)))
+        self.sendToNode("recvEnterLocalPlayer",playerId,playerInfo)
 
     #app->wedge
     def exitPlayer(self,playerId):
         self.log.debug("Player %d exited." % (playerId))
-        if self.node:
-            try:
-                self.node.recvExitLocalPlayer(playerId)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in exitPlayer.  Refreshing node.")
-                self.updateNode()
-            except ProtocolError,e:
-                self.log.error("ProtocolError (%s) in exitPlayer.  Refreshing node."%str(e))
-                self.updateNode()
-            except Exception,e:
-                self.log.error("Error sending exitLocalPlayer to my node: %s" % ''.join(Pyro.util.getPyroTraceback(e)))
+        self.sendToNode("recvExitLocalPlayer",playerId)
 
     #app->wedge
     def exitAvatar(self,avatarId):
         self.log.debug("Avatar %d exited." % (avatarId))
-        if self.node:
-            try:
-                self.node.recvExitLocalAvatar(avatarId)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in exitAvatar.  Refreshing node.")
-                self.updateNode()
-            except ProtocolError,e:
-                self.log.error("ProtocolError (%s) in exitAvatar.  Refreshing node."%str(e))
-                self.updateNode()
-            except Exception,e:
-                self.log.error("Error sending exitLocalAvatar to my node: %s" % ''.join(Pyro.util.getPyroTraceback(e)))
+        self.sendToNode("recvExitLocalAvatar",avatarId)
 
 
     #wedge->app, override
@@ -272,54 +219,31 @@ class sbWedge(Pyro.core.SynchronizedObjBase):
     def recvExitRemotePlayer(self,playerId,friendsList):
         self.log.debug("Saw player %d exit."%(playerId))
         pass
-        
+
 
     #---------------------------------------------
     # Friends
     #---------------------------------------------
 
     def addFriendship(self,playerId1,playerId2):
-        if self.node:
-            self.node.addFriendship(playerId1,playerId2)
+        self.sendToNode("addFriendship",playerId1,playerId2)
 
     def removeFriendship(self,playerId1,playerId2):
-        if self.node:
-            self.node.removeFriendship(playerId1,playerId2)
+        self.sendToNode("removeFriendship",playerId1,playerId2)
 
     def sendOpenInvite(self,inviterId,inviteeId,secretYesNo=True):
         if self.node:
             self.log.debug("sendOpenInvite found node, sending request")
-            self.node.recvOpenInvite(inviterId,inviteeId,secretYesNo)
+            self.sendToNode("recvOpenInvite",inviterId,inviteeId,secretYesNo)
 
     def sendDeclineInvite(self,senderId,otherId):
-        if self.node:
-            self.node.recvDeclineInvite(senderId,otherId)
+        self.sendToNode("recvDeclineInvite",senderId,otherId)
 
     def sendSecretRequest(self,playerId,parentUsername=None,parentPassword=None):
-        if self.node:
-            try:
-                self.node.recvSecretRequest(playerId,parentUsername,parentPassword)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in sendSecretRequest.  Refreshing node.")
-                self.updateNode()
-            except ProtocolError,e:
-                self.log.error("ProtocolError (%s) in sendSecretRequest.  Refreshing node.")
-                self.updateNode()
-            except Exception,e:
-                self.log.error("Error sending secretRequest to my node: %s" % ''.join(Pyro.util.getPyroTraceback(e)))
+        self.sendToNode("recvSecretRequest",playerId,parentUsername,parentPassword)
 
     def sendSecretRedeem(self,playerId,secret,parentUsername=None,parentPassword=None):
-        if self.node:
-            try:
-                self.node.recvSecretRedeem(playerId,secret,parentUsername,parentPassword)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in sendSecretRedeem.  Refreshing node.")
-                self.updateNode()
-            except ProtocolError,e:
-                self.log.error("ProtocolError (%s) in sendSecretRedeem.  Refreshing node.")
-                self.updateNode()
-            except Exception,e:
-                self.log.error("Error sending secretRedeem to my node: %s" % ''.join(Pyro.util.getPyroTraceback(e)))
+        self.sendToNode("recvSecretRedeem",playerId,secret,parentUsername,parentPassword)
 
     #wedge->app, override
     def recvFriendsUpdate(self,playerId,friends):
@@ -368,17 +292,8 @@ class sbWedge(Pyro.core.SynchronizedObjBase):
         if not self._validateChatMessage(recipientId,senderId,msgText):
             return
 
-        if self.node:
-            try:
-                self.node.sendWhisper(recipientId,senderId,msgText)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in sendWhisper.  Refreshing node.")
-                self.updateNode()
-            except ProtocolError,e:
-                self.log.error("ProtocolError (%s) in sendWhisper.  Refreshing node."%str(e))
-                self.updateNode()
-            except Exception,e:
-                self.log.error("Error sending whisper to my node: %s" % ''.join(Pyro.util.getPyroTraceback(e)))
+        self.servedChat += 1
+        self.sendToNode("sendWhisper",recipientId,senderId,msgText)
 
     #app->wedge
     def sendWLWhisper(self,recipientId,senderId,msgText):
@@ -386,36 +301,18 @@ class sbWedge(Pyro.core.SynchronizedObjBase):
         if not self._validateChatMessage(recipientId,senderId,msgText):
             return
 
-        if self.node:
-            try:
-                self.node.sendWLWhisper(recipientId,senderId,msgText)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in sendWLWhisper.  Refreshing node.")
-                self.updateNode()
-            except ProtocolError,e:
-                self.log.error("ProtocolError (%s) in sendWLWhisper.  Refreshing node."%str(e))
-                self.updateNode()
-            except Exception,e:
-                self.log.error("Error sending WLwhisper to my node: %s" % ''.join(Pyro.util.getPyroTraceback(e)))
-            
+        self.servedChat += 1
+        self.sendToNode("sendWLWhisper",recipientId,senderId,msgText)
+
     #app->wedge
     def sendSCWhisper(self,recipientId,senderId,msgText):
         self.log.debug("sendSCWhisper %d->%d: %s" % (senderId,recipientId,msgText))
         if not self._validateChatMessage(recipientId,senderId,msgText):
             return
 
-        if self.node:
-            try:
-                self.node.sendSCWhisper(recipientId,senderId,msgText)
-            except ConnectionClosedError,e:
-                self.log.error("ConnectionClosedError in sendSCWhisper.  Refreshing node.")
-                self.updateNode()
-            except ProtocolError,e:
-                self.log.error("ProtocolError (%s) in sendSCWhisper.  Refreshing node."%str(e))
-                self.updateNode()
-            except Exception,e:
-                self.log.error("Error sending SCwhisper to my node: %s" % ''.join(Pyro.util.getPyroTraceback(e)))
-            
+        self.servedChatSC += 1
+        self.sendToNode("sendSCWhisper",recipientId,senderId,msgText)
+
     #wedge->app, override
     def recvWhisper(self,recipientId,senderId,msgText):
         #msgText = badwordpy.scrub(msgText)
@@ -453,34 +350,25 @@ class sbWedge(Pyro.core.SynchronizedObjBase):
     #---------------------------------------------
     # Mail
     #---------------------------------------------
-    
+
     def sendMail(self,recipientId,senderId,msgText):
         #CHECK FRIENDSHIP, permissions, ignore list, etc?
-        try:
-            self.servedMail += 1
-            self.node.sendMail(recipientId,senderId,msgText)
-        except Exception,e:
-            self.log.error("Error sending mail to my node: %s" % ''.join(Pyro.util.getPyroTraceback(e)))
+        self.servedMail += 1
+        self.sendToNode("sendMail",recipientId,senderId,msgText)
 
     def sendWLMail(self,recipientId,senderId,msgText):
         self.log.debug("sbWedge.sendWLMAIL %d to %d: %s" % (senderId,recipientId,msgText))
 
         #CHECK FRIENDSHIP
-        try:
-            self.servedMail += 1
-            self.node.sendSCMail(recipientId,senderId,msgText)
-        except Exception,e:
-            self.log.error("Error sending mail to my node: %s" % ''.join(Pyro.util.getPyroTraceback(e)))
+        self.servedMail += 1
+        self.sendToNode("sendSCMail",recipientId,senderId,msgText)
 
     def sendSCMail(self,recipientId,senderId,msgText):
         self.log.debug("sbWedge.sendSCMAIL %d to %d: %s" % (senderId,recipientId,msgText))
 
         #CHECK FRIENDSHIP
-        try:
-            self.servedMailSC += 1
-            self.node.sendSCMail(recipientId,senderId,msgText)
-        except Exception,e:
-            self.log.error("Error sending mail to my node: %s" % ''.join(Pyro.util.getPyroTraceback(e)))
+        self.servedMailSC += 1
+        self.sendToNode("sendSCMail",recipientId,senderId,msgText)
 
     #wedge->app, override
     def recvMailUpdate(self,recipientId,senderId,msgText):
@@ -489,38 +377,35 @@ class sbWedge(Pyro.core.SynchronizedObjBase):
 
     def recvMail(self,recipientId,mail):
         self.log.debug("Received mail for %d: %s" % (recipientId,mail))
-        pass    
+        pass
 
     def getMail(self,recipientId):
         self.log.debug("Requesting mail for %d"%recipientId)
-        self.node.getMail(recipientId)
+        self.sendToNode("getMail",recipientId)
 
     def deleteMail(self,accountId,messageId):
         self.log.debug("User %d deleting message %d"%(accountId,messageId))
-
-        try:
-            self.node.deleteMail(accountId,messageId)
-        except Exception,e:
-            self.log.error("Error sending mail to my node: %s" % ''.join(Pyro.util.getPyroTraceback(e)))
+        self.sendToNode("deleteMail",accountId,messageId)
 
 
 
     def healthCheck(self):
         return True
 
-    def statCheck(self):     
+    def statCheck(self):
         avgFriends = 0.0
-        return {'onlinePlayers':self.onlinePlayers,
-                'avgFriends':avgFriends,            
-                'servedLogins':self.servedLogins,
-                'servedChat':self.servedChat,
-                'servedChatSC':self.servedChatSC,
-                'servedMail':self.servedMail,
-                'servedMailSC':self.servedMailSC}
+        stats = {'onlinePlayers':self.onlinePlayers,
+                 'avgFriends':avgFriends,
+                 'servedLogins':self.servedLogins,
+                 'servedChat':self.servedChat,
+                 'servedChatSC':self.servedChatSC,
+                 'servedMail':self.servedMail,
+                 'servedMailSC':self.servedMailSC}
+        stats.update(self.bus.statCheck())
+        return stats
 
     def getLogTail(self,numLines=None):
         if numLines is None:
-            return self.log.getMemLog()                    
+            return self.log.getMemLog()
         else:
             return "numLInes!=NOne!"
-
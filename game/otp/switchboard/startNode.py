@@ -1,14 +1,15 @@
 from game.otp.switchboard.sbNode import sbNode
 from game.otp.switchboard.xd.ChannelManager import *
+import asyncio
 import sys
 import getopt
 
 try:
     opts,args = getopt.getopt(sys.argv[1:], "",
                               ['name=',
+                               'nodehost=',
                                'nodeport=',
-                               'nshost=',
-                               'nsport=',
+                               'peer=',
                                'clhost=',
                                'clport=',
                                'dshost=',
@@ -16,14 +17,14 @@ try:
                                'dislurl='
                                ])
 except getopt.GetoptError:
-    print "Please pass a node name with --name=."
+    print("Please pass a node name with --name=.")
     sys.exit(1)
 
 #defaults
 nodename = ""
+nodehost = None
 nodeport = None
-nshost = None
-nsport = None
+peers = []
 clhost = None
 clport = None
 dshost = None
@@ -33,12 +34,15 @@ dislurl = None
 for o,a in opts:
     if o == "--name":
         nodename = a
+    elif o == "--nodehost":
+        nodehost = a
     elif o == "--nodeport":
         nodeport = int(a)
-    elif o == "--nshost":
-        nshost = a
-    elif o == "--nsport":
-        nsport = int(a)
+    elif o == "--peer":
+        # --peer=name@host:port, another node to announce ourselves to
+        peername,address = a.split("@")
+        peerhost,peerport = address.split(":")
+        peers.append((peername,peerhost,int(peerport)))
     elif o == "--clhost":
         clhost = a
     elif o == "--clport":
@@ -50,30 +54,33 @@ for o,a in opts:
     elif o == "--dislurl":
         dislurl = a
     else:
-        print "Error: Illegal option: " + o
-        sys.exit(1)        
+        print("Error: Illegal option: " + o)
+        sys.exit(1)
 
 if nodename == "":
-    print "Please pass a node name with --name=."
+    print("Please pass a node name with --name=.")
     sys.exit(2)
-    
+
 cm = ChannelManager()
 ncm = NetChannelMessenger(nodename,cm,dshost,dsport,1,1000000)
 
-myNode = sbNode(nodeName=nodename,nsHost=nshost,nsPort=nsport,listenPort=nodeport,clHost=clhost,clPort=clport,chanMgr=cm,dislURL=dislurl)
+loop = asyncio.new_event_loop()
+asyncio.set_event_loop(loop)
+
+myNode = sbNode(nodeName=nodename,listenHost=nodehost,listenPort=nodeport,clHost=clhost,clPort=clport,chanMgr=cm,dislURL=dislurl,loop=loop)
+myNode.recvNodeDirectory(dict([(peername,(peerhost,peerport)) for peername,peerhost,peerport in peers]))
 
 sys.stdout.flush()
 
-try:
-    while 1:
-        myNode.pyroDaemon.handleRequests(0)
+async def pumpDISL():
+    while not myNode.stopped.is_set():
         ncm.pump()
         if ncm.checkReconnect():
             cm.addPromiscuousListener(ncm)
             myNode.joinChannels()
-        time.sleep(0.01)
+        await asyncio.sleep(0.01)
+
+try:
+    loop.run_until_complete(pumpDISL())
 finally:
-    #try:
-    #    myNode.pyroDaemon.shutdown(True)
-    #except: pass
     sys.stdout.flush()
@@ -1,26 +1,28 @@
-from sbWedge import sbWedge
+from game.otp.switchboard.sbWedge import sbWedge
 import sys
 import getopt
 
 try:
     opts,args = getopt.getopt(sys.argv[1:], "",
                               ['name=',
+                               'wedgehost=',
                                'wedgeport=',
-                               'nshost=',
-                               'nsport=',
+                               'nodehost=',
+                               'nodeport=',
                                'clhost=',
                                'clport=',
                                'bwdictpath='
                                ])
 except getopt.GetoptError:
-    print "Please pass a wedge name with --name=."
+    print("Please pass a wedge name with --name=.")
     sys.exit(1)
 
 #defaults
 wedgename = ""
+wedgehost = None
 wedgeport = None
-nshost = None
-nsport = None
+nodehost = None
+nodeport = None
 clhost = None
 clport = None
 bwdictpath = ""
@@ -28,12 +30,14 @@ bwdictpath = ""
 for o,a in opts:
     if o == "--name":
         wedgename = a
+    elif o == "--wedgehost":
+        wedgehost = a
     elif o == "--wedgeport":
         wedgeport = int(a)
-    elif o == "--nshost":
-        nshost = a
-    elif o == "--nsport":
-        nsport = int(a)
+    elif o == "--nodehost":
+        nodehost = a
+    elif o == "--nodeport":
+        nodeport = int(a)
     elif o == "--clhost":
         clhost = a
     elif o == "--clport":
@@ -41,17 +45,18 @@ for o,a in opts:
     elif o == "--bwdictpath":
         bwdictpath = a
     else:
-        print "Error: Illegal option: " + o
-        sys.exit(1)        
+        print("Error: Illegal option: " + o)
+        sys.exit(1)
 
 if wedgename == "":
-    print "Please pass a wedge name with --name=."
+    print("Please pass a wedge name with --name=.")
     sys.exit(2)
-    
+
 
 myWedge = sbWedge(wedgeName=wedgename,
-                  nsHost=nshost,
-                  nsPort=nsport,
+                  nodeHost=nodehost,
+                  nodePort=nodeport,
+                  listenHost=wedgehost,
                   listenPort=wedgeport,
                   clHost=clhost,
                   clPort=clport,
@@ -59,7 +64,4 @@ myWedge = sbWedge(wedgeName=wedgename,
 
 sys.stdout.flush()
 
-try:
-    myWedge.pyroDaemon.requestLoop()
-finally:
-    myWedge.pyroDaemon.shutdown(True)
+myWedge.requestLoop()
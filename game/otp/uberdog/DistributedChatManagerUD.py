@@ -19,13 +19,8 @@ class DistributedChatManagerUD(DistributedObjectUD):
             return
 
         modifications = []
-        words = message.split(' ')
         if self.WantWhitelist:
-            offset = 0
-            for word in words:
-                if word and not self.whitelist.isWord(word):
-                    modifications.append((offset, offset + len(word) - 1))
-                offset += len(word) + 1
+            modifications = self.whitelist.getModifications(message)
 
         cleanMessage = message
         for modStart, modStop in modifications:
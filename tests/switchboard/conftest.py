@@ -0,0 +1,119 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from game.otp.switchboard.sbLog import sbLog
+
+# The switchboard tables (see game/otp/switchboard/sql) in SQLite terms.
+SCHEMA = """
+CREATE TABLE playerinfo (
+  playerId             INTEGER     NOT NULL PRIMARY KEY,
+  avatarName           VARCHAR(64) NOT NULL,
+  playerName           VARCHAR(64) NOT NULL,
+  openChatEnabledYesNo TINYINT     NOT NULL,
+  location             VARCHAR(64) NOT NULL,
+  sublocation          VARCHAR(64) NOT NULL,
+  lastupdate           TIMESTAMP   NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE recipientmail (
+  messageId            INTEGER     PRIMARY KEY AUTOINCREMENT,
+  recipientId          BIGINT      NOT NULL,
+  senderId             BIGINT      NOT NULL,
+  message              TEXT        NOT NULL,
+  lastupdate           TIMESTAMP   NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX idx_recipientId ON recipientmail (recipientId);
+"""
+
+def dictRow(cursor, row):
+    return dict((column[0], value) for column, value in zip(cursor.description, row))
+
+class SQLiteCursor:
+    # The queries in sbSQL use MySQLdb's %s placeholders.
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, query, args=()):
+        self.cursor.execute(query.replace('%s', '?'), tuple(args))
+
+    def executemany(self, query, rows):
+        self.cursor.executemany(query.replace('%s', '?'), rows)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+class SQLiteConnection:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self, rowFactory=None):
+        cursor = self.conn.cursor()
+        if rowFactory is not None:
+            cursor.row_factory = rowFactory
+        return SQLiteCursor(cursor)
+
+class SQLitePool:
+    """
+    sbDBPool's interface on an in-memory SQLite database.  Remembers the
+    threads it was used from, and can take delay seconds per call to
+    stand in for a slow server.
+    """
+    available = True
+
+    def __init__(self, log, delay=0.0):
+        self.log = log
+        self.delay = delay
+        self.conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.Lock()
+        self.threads = set()
+        self.numQueries = 0
+
+    def run(self, name, func, default=None):
+        self.threads.add(threading.get_ident())
+        if self.delay:
+            time.sleep(self.delay)
+        with self.lock:
+            self.numQueries += 1
+            try:
+                result = func(SQLiteConnection(self.conn))
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                self.log.error("Unknown error in %s, giving up:\n%s" % (name, str(e)))
+                return default
+        return result
+
+    def cursor(self, conn):
+        return conn.cursor(dictRow)
+
+    def close(self):
+        pass
+
+    def statCheck(self):
+        return {'dbQueries': self.numQueries}
+
+    def query(self, sql, args=()):
+        with self.lock:
+            return self.conn.execute(sql, args).fetchall()
+
+@pytest.fixture
+def log():
+    return sbLog('test')
+
+@pytest.fixture
+def pool(log):
+    return SQLitePool(log)
+
+@pytest.fixture
+def slowPool(log):
+    return SQLitePool(log, delay=0.2)
@@ -0,0 +1,72 @@
+from game.otp.friends.FriendInfo import FriendInfo
+from game.otp.switchboard.LastSeenDB import LastSeenDB
+import game.otp.switchboard.sbConfig as sbConfig
+
+def makeDB(log, pool):
+    return LastSeenDB(log, None, None, None, None, None, pool=pool)
+
+def makeInfo(playerName, location='Radiator Springs'):
+    return FriendInfo(avatarName=playerName + ' car', playerName=playerName,
+                      openChatEnabledYesNo=1, location=location, sublocation='')
+
+def test_setInfo_waits_for_flush(log, pool):
+    db = makeDB(log, pool)
+    assert not db.setInfo(1, makeInfo('one'))
+    assert pool.query('SELECT COUNT(*) FROM playerinfo') == [(0,)]
+
+    # Not written yet, but getInfo sees it.
+    assert db.getInfo(1).playerName == 'one'
+
+    db.flush()
+    assert pool.query('SELECT playerId, playerName FROM playerinfo') == [(1, 'one')]
+    assert db.statCheck()['lastSeenFlushes'] == 1
+
+def test_setInfo_merges_per_player(log, pool):
+    db = makeDB(log, pool)
+    db.setInfo(1, makeInfo('one', 'Downtown'))
+    db.setInfo(1, makeInfo('one', 'Tailfin Pass'))
+    db.setInfo(2, makeInfo('two'))
+    db.flush()
+
+    assert pool.query('SELECT playerId, location FROM playerinfo ORDER BY playerId') == [
+        (1, 'Tailfin Pass'), (2, 'Radiator Springs')]
+    assert db.numFlushedRows == 2
+
+    # REPLACE over what is there already.
+    db.setInfo(1, makeInfo('one', 'Ornament Valley'))
+    db.flush()
+    assert pool.query('SELECT location FROM playerinfo WHERE playerId = 1') == [('Ornament Valley',)]
+
+def test_setInfo_reports_full_batch(log, pool, monkeypatch):
+    monkeypatch.setattr(sbConfig, 'lastSeenBatchSize', 3)
+    db = makeDB(log, pool)
+    assert not db.setInfo(1, makeInfo('one'))
+    assert not db.setInfo(2, makeInfo('two'))
+    assert db.setInfo(3, makeInfo('three'))
+
+    # Full or not, setInfo never writes itself.
+    assert pool.numQueries == 0
+
+def test_getInfos(log, pool):
+    db = makeDB(log, pool)
+    db.setInfo(1, makeInfo('one'))
+    db.flush()
+    db.setInfo(2, makeInfo('two'))
+
+    infos = db.getInfos([1, 2, 3])
+    assert infos[1].playerName == 'one'
+    assert infos[2].playerName == 'two'
+    assert infos[3].playerName == 'NotFound'
+
+def test_failed_flush_is_retried(log, pool):
+    db = makeDB(log, pool)
+    db.setInfo(1, makeInfo('one'))
+    pool.query('DROP TABLE playerinfo')
+    db.flush()
+    assert db.pending
+
+    pool.conn.executescript('CREATE TABLE playerinfo (playerId INTEGER PRIMARY KEY, avatarName, playerName, '
+                            'openChatEnabledYesNo, location, sublocation, lastupdate)')
+    db.flush()
+    assert not db.pending
+    assert pool.query('SELECT playerName FROM playerinfo') == [('one',)]
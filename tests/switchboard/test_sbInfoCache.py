@@ -0,0 +1,37 @@
+from game.otp.switchboard.sbInfoCache import sbInfoCache
+
+def test_lookup_and_putMany():
+    cache = sbInfoCache(size=10, ttl=60)
+    infos, missing = cache.lookup([1, 2])
+    assert infos == {}
+    assert sorted(missing) == [1, 2]
+
+    cache.putMany({1: 'one', 2: 'two'})
+    infos, missing = cache.lookup([1, 2, 3])
+    assert infos == {1: 'one', 2: 'two'}
+    assert missing == [3]
+
+    stats = cache.statCheck()
+    assert (stats['infoCacheHits'], stats['infoCacheMisses'], stats['infoCacheLoads']) == (2, 3, 1)
+
+def test_least_recently_used_go_first():
+    cache = sbInfoCache(size=2, ttl=60)
+    cache.putMany({1: 'one', 2: 'two'})
+    cache.lookup([1])
+    cache.put(3, 'three')
+
+    infos, missing = cache.lookup([1, 2, 3])
+    assert sorted(infos) == [1, 3]
+    assert missing == [2]
+
+def test_expiry_and_invalidate():
+    cache = sbInfoCache(size=10, ttl=60)
+    cache.putMany({1: 'one', 2: 'two'})
+    cache.invalidate(1)
+    # Backdate 2 past its expiry.
+    cache.entries[2] = (0.0, 'two')
+
+    infos, missing = cache.lookup([1, 2])
+    assert infos == {}
+    assert sorted(missing) == [1, 2]
+    assert len(cache.entries) == 0
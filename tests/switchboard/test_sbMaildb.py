@@ -0,0 +1,33 @@
+from game.otp.switchboard.sbMaildb import sbMaildb
+import game.otp.switchboard.sbConfig as sbConfig
+
+def makeDB(log, pool):
+    return sbMaildb(log, None, None, None, None, None, pool=pool)
+
+def test_putMail_getMail(log, pool):
+    db = makeDB(log, pool)
+    db.putMail(1, 2, 'hi')
+    db.putMail(1, 3, 'hello')
+    db.putMail(4, 2, 'not for 1')
+
+    mail = db.getMail(1)
+    assert [(msg['senderId'], msg['message']) for msg in mail] == [(2, 'hi'), (3, 'hello')]
+
+def test_mailbox_limit(log, pool, monkeypatch):
+    monkeypatch.setattr(sbConfig, 'mailStoreMessageLimit', 2)
+    db = makeDB(log, pool)
+    for i in range(4):
+        db.putMail(1, 2, 'message %d' % i)
+
+    assert [msg['message'] for msg in db.getMail(1)] == ['message 0', 'message 1']
+
+def test_deleteMail_only_own(log, pool):
+    db = makeDB(log, pool)
+    db.putMail(1, 2, 'hi')
+    messageId = db.getMail(1)[0]['messageId']
+
+    db.deleteMail(2, messageId)
+    assert len(db.getMail(1)) == 1
+
+    db.deleteMail(1, messageId)
+    assert db.getMail(1) == []
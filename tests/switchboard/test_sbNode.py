@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+
+from game.otp.friends.FriendInfo import FriendInfo
+from game.otp.switchboard.LastSeenDB import LastSeenDB
+from game.otp.switchboard.sbMaildb import sbMaildb
+from game.otp.switchboard.sbNode import sbNode
+from game.otp.switchboard.sbBus import wedgeBusName
+import game.otp.switchboard.sbConfig as sbConfig
+
+def makeInfo(playerName):
+    return FriendInfo(avatarName=playerName + ' car', playerName=playerName,
+                      openChatEnabledYesNo=1, location='Radiator Springs', sublocation='')
+
+def runNode(log, pool, test):
+    """
+    Runs test(node, sent) on a node using the SQLite pool for both
+    databases.  sent gets (method, args...) of everything the node posts.
+    """
+    lastSeenDB = LastSeenDB(log, None, None, None, None, None, pool=pool)
+    mailDB = sbMaildb(log, None, None, None, None, None, pool=pool)
+
+    async def main():
+        node = sbNode('test', friendsDB=object(), lastSeenDB=lastSeenDB, mailDB=mailDB,
+                      loop=asyncio.get_running_loop())
+        await node.start()
+        sent = []
+        node.wedge = wedgeBusName('test')
+        node.bus.post = lambda name, method, *args: sent.append((method,) + args)
+        try:
+            await test(node, sent)
+        finally:
+            node.flushTask.cancel()
+            node.bus.close()
+
+    asyncio.run(main())
+
+async def waitFor(condition, timeout=5.0):
+    # Returns how many times the loop got to run meanwhile.
+    ticks = 0
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, 'timed out'
+        await asyncio.sleep(0.01)
+        ticks += 1
+    return ticks
+
+def sentOf(sent, method):
+    return [args for args in sent if args[0] == method]
+
+def test_getMail_runs_in_the_executor(log, slowPool):
+    async def test(node, sent):
+        node.mailDB.putMail(1, 2, 'hi')
+        node.lastSeenDB.setInfo(2, makeInfo('two'))
+        node.lastSeenDB.flush()
+        slowPool.threads.clear()
+
+        start = time.monotonic()
+        node.getMail(1)
+        assert time.monotonic() - start < 0.1
+
+        # Two slow queries, the loop keeps going meanwhile.
+        ticks = await waitFor(lambda: sentOf(sent, 'recvMail'))
+        assert ticks > 10
+        (method, recipientId, mail), = sentOf(sent, 'recvMail')
+        assert recipientId == 1
+        assert [(msg['message'], msg['senderName']) for msg in mail] == [('hi', 'two')]
+        assert threading.get_ident() not in slowPool.threads
+
+    runNode(log, slowPool, test)
+
+def test_sendMail_and_deleteMail_run_in_the_executor(log, slowPool):
+    async def test(node, sent):
+        start = time.monotonic()
+        node.sendMail(1, 2, 'hi')
+        node.sendSCMail(1, 3, 'hello')
+        assert time.monotonic() - start < 0.1
+        await asyncio.gather(*node.tasks)
+        assert slowPool.query('SELECT senderId FROM recipientmail ORDER BY senderId') == [(2,), (3,)]
+
+        messageId = slowPool.query('SELECT messageId FROM recipientmail WHERE senderId = 2')[0][0]
+        node.deleteMail(1, messageId)
+        await asyncio.gather(*node.tasks)
+        assert slowPool.query('SELECT senderId FROM recipientmail') == [(3,)]
+        assert threading.get_ident() not in slowPool.threads
+
+    runNode(log, slowPool, test)
+
+def test_friends_update_loads_offline_friends(log, slowPool):
+    async def test(node, sent):
+        node.lastSeenDB.setInfo(2, makeInfo('two'))
+        node.lastSeenDB.flush()
+        slowPool.threads.clear()
+
+        node.recvEnterLocalPlayer(1, makeInfo('one'))
+        node.recvFriendsList(1, [[2, 1], [3, 0]])
+        await waitFor(lambda: sentOf(sent, 'recvFriendsUpdate'))
+
+        (method, playerId, friends), = sentOf(sent, 'recvFriendsUpdate')
+        views = dict((friendId, (info.playerName, info.openChatFriendshipYesNo)) for friendId, info in friends)
+        assert views == {2: ('two', 1), 3: ('NotFound', 0)}
+        assert threading.get_ident() not in slowPool.threads
+
+        # Now they come from infoCache.
+        stats = node.infoCache.statCheck()
+        node.recvFriendsList(1, [[2, 1]])
+        await waitFor(lambda: len(sentOf(sent, 'recvFriendsUpdate')) == 2)
+        assert node.infoCache.statCheck()['infoCacheLoads'] == stats['infoCacheLoads']
+
+    runNode(log, slowPool, test)
+
+def test_friends_update_for_player_gone_meanwhile(log, slowPool):
+    async def test(node, sent):
+        node.recvEnterLocalPlayer(1, makeInfo('one'))
+        node.recvFriendsList(1, [[2, 1]])
+        node.recvExitLocalPlayer(1)
+        await asyncio.gather(*node.tasks)
+        assert not sentOf(sent, 'recvFriendsUpdate')
+
+    runNode(log, slowPool, test)
+
+def test_full_last_seen_batch_is_flushed_early(log, pool, monkeypatch):
+    monkeypatch.setattr(sbConfig, 'lastSeenBatchSize', 2)
+
+    async def test(node, sent):
+        node.recvEnterLocalPlayer(1, makeInfo('one'))
+        node.recvEnterLocalPlayer(2, makeInfo('two'))
+        # Long before lastSeenFlushPeriod.
+        await waitFor(lambda: pool.query('SELECT COUNT(*) FROM playerinfo') == [(2,)],
+                      sbConfig.lastSeenFlushPeriod / 2.0)
+        assert threading.get_ident() not in pool.threads
+
+    runNode(log, pool, test)